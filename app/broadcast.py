@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from sqlalchemy import select, update
+
+from app.config import (
+    BROADCAST_RATE_PER_S,
+    BROADCAST_WORKERS,
+    BROADCAST_BATCH,
+    BROADCAST_PROGRESS_EDIT_S,
+    BROADCAST_POLL_S,
+)
+from app.db import SessionLocal, LEADER
+from app.models import BroadcastJob
+from app.segments import Segment, count_segment, fetch_page
+from app.utils import utcnow
+
+
+log = logging.getLogger("tilek_ai.broadcast")
+
+ACTIVE_STATUSES = ("queued", "running")
+SEND_RETRIES = 3
+
+
+# =========================================================
+# UX: progress text + controls (admin.py да колдонот)
+# =========================================================
+def render_progress(job: BroadcastJob) -> str:
+    icon = {
+        "queued": "🕒",
+        "running": "🚀",
+        "paused": "⏸",
+        "cancelled": "🛑",
+        "done": "✅",
+    }.get(job.status, "📣")
+    total = job.total or "?"
+    return (
+        f"{icon} Broadcast #{job.id}: {job.status.upper()}\n"
+        f"👥 {Segment.from_json(job.segment).describe()}\n\n"
+        f"📨 Sent: {job.sent} / {total}\n"
+        f"⚠️ Failed: {job.failed}\n"
+    )
+
+
+def kb_broadcast_controls(job: BroadcastJob) -> Optional[InlineKeyboardMarkup]:
+    if job.status in ("queued", "running"):
+        row = [InlineKeyboardButton(text="⏸ Пауза", callback_data=f"adm:bc:pause:{job.id}")]
+    elif job.status == "paused":
+        row = [InlineKeyboardButton(text="▶️ Улантуу", callback_data=f"adm:bc:resume:{job.id}")]
+    else:
+        return None
+    row.append(InlineKeyboardButton(text="🛑 Токтотуу", callback_data=f"adm:bc:cancel:{job.id}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+
+# =========================================================
+# Global send rate (Telegram ~30 msg/s)
+# =========================================================
+class SendRateLimiter:
+    """
+    Бардык worker'лер бөлүшкөн global темп: ар бир жөнөтүүгө убакыт слоту берилет.
+    TelegramRetryAfter келсе — pause() бардык worker'лерди ошончо убакытка токтотот.
+    """
+
+    def __init__(self, rate_per_s: float):
+        self.interval = 1.0 / max(0.1, float(rate_per_s))
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            slot = max(now, self._next, self._paused_until)
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        until = asyncio.get_running_loop().time() + float(seconds)
+        self._paused_until = max(self._paused_until, until)
+
+
+# =========================================================
+# Engine
+# =========================================================
+class BroadcastEngine:
+    """
+    broadcast_jobs таблицасынан job алып, сегменттин user'лерин tg_id боюнча
+    keyset менен batch-batch жөнөтөт. Ар бир batch'тан кийин cursor + санагычтар
+    commit болот — restart/failover болсо ошол жерден улантылат (эң көп 1 batch
+    кайра кетиши мүмкүн).
+
+    Leader replica гана иштетет (LEADER). pause/cancel DB'дагы status аркылуу
+    келет, ошондуктан админ каалаган replica'дан башкара алат.
+    """
+
+    def __init__(self, rate_per_s: float, workers: int, batch: int):
+        self.limiter = SendRateLimiter(rate_per_s)
+        self.workers = max(1, int(workers))
+        self.batch = max(1, int(batch))
+        self._wakeup = asyncio.Event()
+
+        self.active_job_id: Optional[int] = None
+        self.sent_total = 0
+        self.failed_total = 0
+        self.retry_after_hits = 0
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def run(self, bot: Bot) -> None:
+        while True:
+            if LEADER.is_leader:
+                try:
+                    job_id = await self._next_job_id()
+                    if job_id is not None:
+                        await self._run_job(bot, job_id)
+                        continue
+                except Exception as e:
+                    log.warning("Broadcast error: %s", e)
+
+            self._wakeup.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), BROADCAST_POLL_S)
+
+    # ---------- job loop ----------
+    async def _next_job_id(self) -> Optional[int]:
+        async with SessionLocal() as s:
+            return (await s.execute(
+                select(BroadcastJob.id)
+                .where(BroadcastJob.status.in_(ACTIVE_STATUSES))
+                .order_by(BroadcastJob.id)
+                .limit(1)
+            )).scalar_one_or_none()
+
+    async def _run_job(self, bot: Bot, job_id: int) -> None:
+        async with SessionLocal() as s:
+            job = await s.get(BroadcastJob, job_id)
+            seg = Segment.from_json(job.segment)
+            if job.status == "queued":
+                job.total = await count_segment(s, seg, job.cursor_tg_id)
+                job.status = "running"
+                job.updated_at = utcnow()
+                await s.commit()
+
+        self.active_job_id = job_id
+        loop = asyncio.get_running_loop()
+        last_edit = 0.0
+
+        try:
+            while LEADER.is_leader:
+                async with SessionLocal() as s:
+                    job = await s.get(BroadcastJob, job_id)
+                    if job.status != "running":
+                        # pause / cancel — админ handler өзү progress'ти жаңылайт
+                        return
+                    ids = await fetch_page(s, seg, job.cursor_tg_id, self.batch)
+                    text = job.message_text
+
+                if not ids:
+                    await self._finish(bot, job_id)
+                    return
+
+                ok, fail = await self._send_batch(bot, ids, text)
+
+                async with SessionLocal() as s:
+                    await s.execute(
+                        update(BroadcastJob)
+                        .where(BroadcastJob.id == job_id)
+                        .values(
+                            cursor_tg_id=ids[-1],
+                            sent=BroadcastJob.sent + ok,
+                            failed=BroadcastJob.failed + fail,
+                            updated_at=utcnow(),
+                        )
+                    )
+                    await s.commit()
+
+                if loop.time() - last_edit >= BROADCAST_PROGRESS_EDIT_S:
+                    last_edit = loop.time()
+                    await self._edit_progress(bot, job_id)
+        finally:
+            self.active_job_id = None
+
+    async def _finish(self, bot: Bot, job_id: int) -> None:
+        async with SessionLocal() as s:
+            await s.execute(
+                update(BroadcastJob)
+                .where(BroadcastJob.id == job_id, BroadcastJob.status == "running")
+                .values(status="done", finished_at=utcnow(), updated_at=utcnow())
+            )
+            await s.commit()
+        await self._edit_progress(bot, job_id)
+
+    async def _edit_progress(self, bot: Bot, job_id: int) -> None:
+        async with SessionLocal() as s:
+            job = await s.get(BroadcastJob, job_id)
+        if not job or not job.progress_chat_id or not job.progress_message_id:
+            return
+        with suppress(Exception):
+            await bot.edit_message_text(
+                render_progress(job),
+                chat_id=job.progress_chat_id,
+                message_id=job.progress_message_id,
+                reply_markup=kb_broadcast_controls(job),
+            )
+
+    # ---------- sending ----------
+    async def _send_batch(self, bot: Bot, ids: list[int], text: str) -> tuple[int, int]:
+        sem = asyncio.Semaphore(self.workers)
+
+        async def one(tg_id: int) -> bool:
+            async with sem:
+                return await self._send_one(bot, tg_id, text)
+
+        results = await asyncio.gather(*(one(tg_id) for tg_id in ids))
+        ok = sum(1 for r in results if r)
+        fail = len(results) - ok
+        self.sent_total += ok
+        self.failed_total += fail
+        return ok, fail
+
+    async def _send_one(self, bot: Bot, tg_id: int, text: str) -> bool:
+        for _ in range(SEND_RETRIES):
+            await self.limiter.acquire()
+            try:
+                await bot.send_message(tg_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                # flood wait: бардык worker'лер токтойт, ушул user кайра аракет
+                self.retry_after_hits += 1
+                self.limiter.pause(e.retry_after)
+            except Exception:
+                # ботту блоктогон / чат жок ж.б.
+                return False
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "active_job_id": self.active_job_id,
+            "sent": self.sent_total,
+            "failed": self.failed_total,
+            "retry_after": self.retry_after_hits,
+        }
+
+
+BROADCASTS = BroadcastEngine(
+    rate_per_s=BROADCAST_RATE_PER_S,
+    workers=BROADCAST_WORKERS,
+    batch=BROADCAST_BATCH,
+)
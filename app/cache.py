@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import USER_CACHE_TTL_S, USER_CACHE_MAX
+from app.db import SessionLocal, upsert_user, get_current_user
+from app.models import User
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+# =========================================================
+# Generic bounded TTL cache (LRU eviction)
+# =========================================================
+class TTLCache(Generic[K, V]):
+    """
+    Кичинекей in-process кэш:
+    - ар бир жазуунун өз TTL'и бар (expires_at)
+    - maxsize ашса — эң эски колдонулган (LRU) чыгат
+    - max_weight + weigh берилсе — жалпы салмак (мис. байт) чегинен ашса да LRU чыгат
+    - hits/misses санагычтары (TTL тууралоо үчүн)
+
+    asyncio бир thread'те иштегендиктен lock керек эмес.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl_s: float,
+        max_weight: Optional[int] = None,
+        weigh: Optional[Callable[[V], int]] = None,
+    ):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl_s = float(ttl_s)
+        self.max_weight = int(max_weight) if max_weight else None
+        self._weigh = weigh if self.max_weight else None
+        self._weight = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> Optional[V]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: K) -> Optional[V]:
+        """hits/misses санабай, LRU тартибин бузбай карайт."""
+        item = self._data.get(key)
+        if item is None or time.monotonic() >= item[0]:
+            return None
+        return item[1]
+
+    def set(self, key: K, value: V, ttl_s: Optional[float] = None) -> None:
+        ttl = self.ttl_s if ttl_s is None else float(ttl_s)
+        self._remove(key)
+        if self._weigh is not None:
+            w = self._weigh(value)
+            if w > self.max_weight:
+                return  # бир өзү чектен чоң — кэштебейбиз
+            self._weight += w
+        self._data[key] = (time.monotonic() + ttl, value)
+        while len(self._data) > self.maxsize or (
+            self._weigh is not None and self._weight > self.max_weight
+        ):
+            self._remove(next(iter(self._data)))
+
+    def _remove(self, key: K) -> None:
+        item = self._data.pop(key, None)
+        if item is not None and self._weigh is not None:
+            self._weight -= self._weigh(item[1])
+
+    def pop(self, key: K) -> None:
+        self._remove(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._weight = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        out = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+        if self.max_weight:
+            out.update(weight=self._weight, max_weight=self.max_weight)
+        return out
+
+
+# =========================================================
+# User snapshot (middleware -> handlers: data["db_user"])
+# =========================================================
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """
+    User'дин компакт, read-only көчүрмөсү.
+    Middleware толтурат, handler'лер data["db_user"] аркылуу окуйт.
+    Жазуу керек болсо — DB'дан ORM User алынат (кэш жаңыланат).
+    """
+
+    tg_id: int
+    username: Optional[str]
+    language: str
+    country_code: Optional[str]
+
+    plan: str
+    plan_until: Optional[dt.datetime]
+    blocked_until: Optional[dt.datetime]
+
+    chat_left: int
+    tokens_left: int
+    video_left: int
+    music_left: int
+    image_left: int
+    voice_left: int
+    doc_left: int
+
+    vip_video_credits: int
+    vip_music_minutes: int
+
+    style_counter: int
+    referrer_tg_id: Optional[int]
+    ref_balance_usd: float
+
+    is_banned: bool
+
+
+def snapshot_of(u: User) -> UserSnapshot:
+    return UserSnapshot(
+        tg_id=u.tg_id,
+        username=u.username,
+        language=u.language or "ky",
+        country_code=u.country_code,
+        plan=u.plan or "FREE",
+        plan_until=u.plan_until,
+        blocked_until=u.blocked_until,
+        chat_left=u.chat_left or 0,
+        tokens_left=u.tokens_left or 0,
+        video_left=u.video_left or 0,
+        music_left=u.music_left or 0,
+        image_left=u.image_left or 0,
+        voice_left=u.voice_left or 0,
+        doc_left=u.doc_left or 0,
+        vip_video_credits=u.vip_video_credits or 0,
+        vip_music_minutes=u.vip_music_minutes or 0,
+        style_counter=u.style_counter or 0,
+        referrer_tg_id=u.referrer_tg_id,
+        ref_balance_usd=float(u.ref_balance_usd or 0.0),
+        is_banned=bool(u.is_banned),
+    )
+
+
+USER_CACHE: TTLCache[int, UserSnapshot] = TTLCache(maxsize=USER_CACHE_MAX, ttl_s=USER_CACHE_TTL_S)
+
+
+def remember_user(u: User) -> UserSnapshot:
+    """
+    DB'га жазгандан кийин чакыр: кэштеги жазууну жаңылайт.
+    """
+    snap = snapshot_of(u)
+    USER_CACHE.set(u.tg_id, snap)
+    return snap
+
+
+def invalidate_user(tg_id: int) -> None:
+    USER_CACHE.pop(tg_id)
+
+
+async def get_user_snapshot(
+    tg_id: int,
+    username: Optional[str] = None,
+    session: Optional[AsyncSession] = None,
+) -> UserSnapshot:
+    """
+    Кэштен алат; жок болсо DB'дан жүктөйт (же түзөт).
+
+    session берилсе (update'тин session'у) — ошол session колдонулат,
+    commit жана кэшке жазуу DbSessionMiddleware'де болот.
+    """
+    snap = USER_CACHE.get(tg_id)
+    if snap is not None:
+        return snap
+
+    if session is not None:
+        u = await get_current_user(session, tg_id, username)
+        return snapshot_of(u)
+
+    async with SessionLocal() as s:
+        u = await upsert_user(s, tg_id, username=username)
+        await s.commit()
+
+    return remember_user(u)
+
+
+# =========================================================
+# Singleflight (бирдей in-flight суроолор 1 чакырууну бөлүшөт)
+# =========================================================
+class SingleFlightAborted(Exception):
+    """Leader cancel болду — күткөндөр өзү кайра аракет кылат."""
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Бир key боюнча бир эле учурда бир чакыруу (leader). Ошол учурда келген
+    бирдей суроолор (waiter) leader'дин жыйынтыгын күтөт; leader ката берсе —
+    ошол ката ар бир waiter'ге да чыгат.
+
+    do() — жөнөкөй учур; begin()/finish() — жыйынтык бөлүк-бөлүк келген учур (stream).
+    """
+
+    def __init__(self):
+        self._calls: dict[K, asyncio.Future] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def inflight(self, key: K) -> Optional[asyncio.Future]:
+        return self._calls.get(key)
+
+    def begin(self, key: K) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        # waiter жок болсо "exception was never retrieved" чыкпасын
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = fut
+        self.leaders += 1
+        return fut
+
+    def finish(
+        self,
+        key: K,
+        fut: asyncio.Future,
+        result: Optional[V] = None,
+        exc: Optional[BaseException] = None,
+    ) -> None:
+        if self._calls.get(key) is fut:
+            del self._calls[key]
+        if fut.done():
+            return
+        if exc is None:
+            fut.set_result(result)
+        elif isinstance(exc, Exception):
+            fut.set_exception(exc)
+        else:
+            # CancelledError / GeneratorExit — waiter'лерди cancel кылбайбыз
+            fut.set_exception(SingleFlightAborted())
+
+    async def wait(self, fut: asyncio.Future) -> V:
+        self.shared += 1
+        return await asyncio.shield(fut)
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        while True:
+            fut = self._calls.get(key)
+            if fut is None:
+                break
+            try:
+                return await self.wait(fut)
+            except SingleFlightAborted:
+                continue
+
+        fut = self.begin(key)
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.finish(key, fut, exc=e)
+            raise
+        self.finish(key, fut, result=result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._calls),
+            "leaders": self.leaders,
+            "shared": self.shared,
+        }
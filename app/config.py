@@ -79,6 +79,71 @@ SUNO_API_KEY = _get_str("SUNO_API_KEY")
 ELEVENLABS_API_KEY = _get_str("ELEVENLABS_API_KEY")
 
 
+# LLM жоопту stream менен жөнөтүү (placeholder -> edit)
+LLM_STREAMING = _get_bool("LLM_STREAMING", True)
+# Telegram бир чатта edit'ти тез-тез кабыл албайт (~1/сек)
+STREAM_EDIT_INTERVAL_S = _get_float("STREAM_EDIT_INTERVAL_S", 1.0)
+STREAM_MIN_DELTA_CHARS = _get_int("STREAM_MIN_DELTA_CHARS", 40)
+
+# LLM провайдерге бир убакта канча суроо (калгандары Plan.priority боюнча кезекте)
+LLM_CONCURRENCY = _get_int("LLM_CONCURRENCY", 16)
+# Кезекте ушунча секунд күткөн суроо 1 priority деңгээлге көтөрүлөт (FREE ачка калбайт)
+LLM_AGING_S = _get_float("LLM_AGING_S", 10.0)
+# 0 = чексиз
+LLM_QUEUE_MAX_WAIT_S = _get_float("LLM_QUEUE_MAX_WAIT_S", 90.0)
+
+# Load shedding (FREE гана): pressure = max((active + кезек) / LLM_CONCURRENCY, p95 / target)
+LLM_SHED_ENABLED = _get_bool("LLM_SHED_ENABLED", True)
+LLM_SHED_P95_TARGET_S = _get_float("LLM_SHED_P95_TARGET_S", 8.0)
+LLM_SHED_WINDOW_S = _get_float("LLM_SHED_WINDOW_S", 60.0)
+# pressure ушул чектерден ашса: 1) FREE кыска жооп 2) FREE кэштен гана 3) FREE "кийин жаз"
+LLM_SHED_LEVEL1 = _get_float("LLM_SHED_LEVEL1", 1.0)
+LLM_SHED_LEVEL2 = _get_float("LLM_SHED_LEVEL2", 1.5)
+LLM_SHED_LEVEL3 = _get_float("LLM_SHED_LEVEL3", 2.0)
+# Деңгээл төмөндөшү үчүн ушунча убакыт туруктуу болушу керек (flapping болбосун)
+LLM_SHED_HOLD_S = _get_float("LLM_SHED_HOLD_S", 15.0)
+LLM_SHED_FREE_MAX_TOKENS = _get_int("LLM_SHED_FREE_MAX_TOKENS", 300)
+
+# Provider gateway: primary ушунча убакытта жооп бербесе — запас провайдерге да жиберилет
+LLM_HEDGE_DELAY_S = _get_float("LLM_HEDGE_DELAY_S", 6.0)
+# Бир суроонун жалпы чеги (GROK_TIMEOUT_S 45 сек күтүп калбасын)
+LLM_TOTAL_TIMEOUT_S = _get_float("LLM_TOTAL_TIMEOUT_S", 25.0)
+# Circuit breaker: error EWMA же latency EWMA чектен ашса провайдер cooldown'го чыгат
+LLM_BREAKER_ERROR_RATE = _get_float("LLM_BREAKER_ERROR_RATE", 0.5)
+LLM_BREAKER_SLOW_S = _get_float("LLM_BREAKER_SLOW_S", 15.0)
+LLM_BREAKER_COOLDOWN_S = _get_float("LLM_BREAKER_COOLDOWN_S", 30.0)
+LLM_BREAKER_ALPHA = _get_float("LLM_BREAKER_ALPHA", 0.2)
+LLM_BREAKER_MIN_CALLS = _get_int("LLM_BREAKER_MIN_CALLS", 5)
+
+# Чат эс тутуму (chat_memory): акыркы turn'дер + эскилеринин кыскача мазмуну
+MEMORY_ENABLED = _get_bool("MEMORY_ENABLED", True)
+# turn саны ушундан ашса — эскилери фондо summary'ге жыйналат
+MEMORY_MAX_TURNS = _get_int("MEMORY_MAX_TURNS", 10)
+MEMORY_KEEP_TURNS = _get_int("MEMORY_KEEP_TURNS", 4)
+MEMORY_TURN_MAX_CHARS = _get_int("MEMORY_TURN_MAX_CHARS", 1500)
+MEMORY_SUMMARY_MAX_CHARS = _get_int("MEMORY_SUMMARY_MAX_CHARS", 1200)
+# Ушунча убакыт жазбаса — жаңы сүйлөшүү башталат
+MEMORY_IDLE_RESET_S = _get_float("MEMORY_IDLE_RESET_S", 6 * 3600.0)
+
+# Intent router: "канча суроо калды", "кантип төлөйм" сыяктуу меню суроолоруна LLM'сиз жооп
+INTENT_ROUTER = _get_bool("INTENT_ROUTER", True)
+# Билдирүү фразадан ушунча сөздөн ашык узун болсо — LLM'ге кетет (false positive болбосун)
+INTENT_SLACK_WORDS = _get_int("INTENT_SLACK_WORDS", 2)
+# FREE: intent жообу free_today_count'тан 1 суроо алабы (default — жок, бекер)
+INTENT_COUNTS_FREE = _get_bool("INTENT_COUNTS_FREE", False)
+
+
+# =========================================================
+# Outbound HTTP (runway / kling / suno / elevenlabs / cryptomus)
+# =========================================================
+# Ар провайдерге бир узак жашаган aiohttp session (keep-alive, DNS cache)
+HTTP_POOL_LIMIT = _get_int("HTTP_POOL_LIMIT", 100)          # бир session'догу жалпы connection
+HTTP_POOL_PER_HOST = _get_int("HTTP_POOL_PER_HOST", 10)     # бир host'ко
+HTTP_DNS_TTL_S = _get_int("HTTP_DNS_TTL_S", 300)
+HTTP_KEEPALIVE_S = _get_float("HTTP_KEEPALIVE_S", 30.0)     # бош connection канча сакталат
+HTTP_CONNECT_TIMEOUT_S = _get_float("HTTP_CONNECT_TIMEOUT_S", 10.0)
+
+
 # =========================================================
 # Payment (Cryptomus)
 # =========================================================
@@ -129,6 +194,64 @@ ENABLE_REFERRAL = _get_bool("ENABLE_REFERRAL", True)
 ENABLE_VIP = _get_bool("ENABLE_VIP", True)
 
 
+# =========================================================
+# In-process caches
+# =========================================================
+
+USER_CACHE_TTL_S = _get_float("USER_CACHE_TTL_S", 30.0)
+USER_CACHE_MAX = _get_int("USER_CACHE_MAX", 50000)
+
+# Admin stats панели
+ADMIN_STATS_TTL_S = _get_float("ADMIN_STATS_TTL_S", 30.0)
+# stats_rollup таблицасы + trigger'лер (чоң DB үчүн; ар бир жазууга кичине баа кошот)
+STATS_ROLLUP = _get_bool("STATS_ROLLUP", False)
+# Ар бир санагыч N сапка бөлүнөт (users_total'дун бир сабына бүт INSERT'тер кезек күтпөсүн)
+STATS_ROLLUP_STRIPES = _get_int("STATS_ROLLUP_STRIPES", 16)
+
+# Channel gate: катталган/катталбаган жыйынтыктын өз TTL'и
+MEMBERSHIP_CACHE_MAX = _get_int("MEMBERSHIP_CACHE_MAX", 100000)
+MEMBERSHIP_TTL_OK_S = _get_float("MEMBERSHIP_TTL_OK_S", 900.0)
+MEMBERSHIP_TTL_NO_S = _get_float("MEMBERSHIP_TTL_NO_S", 15.0)
+
+# LLM жооп кэши (бирдей суроолор -> Grok'ко кайра барбайт)
+LLM_CACHE_TTL_S = _get_float("LLM_CACHE_TTL_S", 6 * 3600.0)
+LLM_CACHE_MAX = _get_int("LLM_CACHE_MAX", 5000)
+LLM_CACHE_MAX_BYTES = _get_int("LLM_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+# Узун prompt'тор дээрлик кайталанбайт — кэшке киргизбейбиз
+LLM_CACHE_MAX_PROMPT = _get_int("LLM_CACHE_MAX_PROMPT", 300)
+
+
+# =========================================================
+# Scheduler
+# =========================================================
+
+# Timer heap'ке канча алдыга чейинки deadline'дар жүктөлөт (эс тутум чеги)
+DUE_TIMER_HORIZON_S = _get_float("DUE_TIMER_HORIZON_S", 6 * 3600.0)
+# Коопсуздук sweep'и: ensure_resets + heap'ти кайра жүктөө
+SCHEDULER_SWEEP_S = _get_float("SCHEDULER_SWEEP_S", 600.0)
+# last_action_at bulk flush
+LAST_ACTION_FLUSH_S = _get_float("LAST_ACTION_FLUSH_S", 60.0)
+
+# Бир нече replica: singleton иштерди advisory lock кармаган бирөө гана жасайт
+LEADER_LOCK_KEY = _get_int("LEADER_LOCK_KEY", 7150001)
+LEADER_CHECK_S = _get_float("LEADER_CHECK_S", 15.0)
+
+
+# =========================================================
+# Broadcast
+# =========================================================
+
+# Telegram глобалдык лимит ~30 msg/s — бир аз запас калтырабыз
+BROADCAST_RATE_PER_S = _get_float("BROADCAST_RATE_PER_S", 25.0)
+BROADCAST_WORKERS = _get_int("BROADCAST_WORKERS", 8)
+BROADCAST_BATCH = _get_int("BROADCAST_BATCH", 250)  # ~10 сек — pause/cancel ушунча кечигет
+BROADCAST_PROGRESS_EDIT_S = _get_float("BROADCAST_PROGRESS_EDIT_S", 5.0)
+BROADCAST_POLL_S = _get_float("BROADCAST_POLL_S", 10.0)
+
+# Сегмент (broadcast / bulk gift): keyset бетинин өлчөмү
+SEGMENT_PAGE_SIZE = _get_int("SEGMENT_PAGE_SIZE", 1000)
+
+
 # =========================================================
 # Startup Validation
 # =========================================================
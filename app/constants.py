@@ -19,6 +19,8 @@ FREE_DAILY_QUESTIONS = 10      # FREE: күнүнө 10 суроо
 BLOCK_HOURS_FREE = 6           # лимит бүтсө 6 саат блок
 FREE_MAX_TEXT_LEN = 3500       # спамдан коргоо (узун текст)
 FREE_COOLDOWN_SECONDS = 2      # flood control жеңил (2 сек)
+FLOOD_BURST = 3                # token bucket: катары менен 3 билдирүү, анан 1 / FREE_COOLDOWN_SECONDS
+FLOOD_MAX_TRACKED = 50000      # эс тутумда канча user'дин bucket'и сакталат (LRU)
 
 
 # =========================================================
@@ -39,6 +41,8 @@ class Plan:
     monthly_doc: int
 
     priority: int  # UX: PRO = 2, PLUS = 1, FREE = 0
+    memory_tokens: int  # чат эс тутуму: prompt'ко кошулган мурунку сүйлөшүү (болжол токен)
+    monthly_tokens: int  # LLM токен бюджети (prompt + completion); FREE — чектелбейт (күндүк суроо)
 
 
 # 3 план (сен айткандай — так 3 эле)
@@ -54,6 +58,8 @@ PLANS: Dict[str, Plan] = {
         monthly_voice=0,
         monthly_doc=0,
         priority=0,
+        memory_tokens=400,
+        monthly_tokens=0,
     ),
     "PLUS": Plan(
         code="PLUS",
@@ -66,6 +72,8 @@ PLANS: Dict[str, Plan] = {
         monthly_voice=5,
         monthly_doc=5,
         priority=1,
+        memory_tokens=1500,
+        monthly_tokens=1_000_000,
     ),
     "PRO": Plan(
         code="PRO",
@@ -78,10 +86,14 @@ PLANS: Dict[str, Plan] = {
         monthly_voice=15,
         monthly_doc=15,
         priority=2,
+        memory_tokens=4000,
+        monthly_tokens=3_000_000,
     ),
 }
 
 PLAN_ORDER = ["FREE", "PLUS", "PRO"]
+PAID_PLANS = ("PLUS", "PRO")
+MONTHLY_REFILL_DAYS = 30       # PLUS/PRO лимиттери last_monthly_reset'тен 30 күндө толот
 
 
 # =========================================================
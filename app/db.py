@@ -5,13 +5,17 @@ from contextlib import asynccontextmanager
 from typing import AsyncIterator, Optional
 
 from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
-from sqlalchemy import text
+from sqlalchemy import text, func, select, or_, false
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from app.config import DATABASE_URL
+from app.config import DATABASE_URL, LEADER_LOCK_KEY
+from app.models import User
+from app.utils import utcnow
 
 
 # =========================================================
@@ -131,6 +135,180 @@ async def get_db() -> AsyncIterator[AsyncSession]:
             await session.close()
 
 
+# =========================================================
+# User upsert (1 round trip, race-safe)
+# =========================================================
+
+async def upsert_user(
+    session: AsyncSession,
+    tg_id: int,
+    *,
+    username: Optional[str] = None,
+    refresh_username: bool = True,
+    referrer_tg_id: Optional[int] = None,
+    **defaults,
+) -> User:
+    """
+    INSERT ... ON CONFLICT (tg_id) DO UPDATE ... RETURNING users.*
+
+    - жаңы user болсо: түзөт (defaults — language, free_day_key ж.б.)
+    - бар болсо: username'ди жаңылайт (refresh_username=True жана username берилсе)
+    - referrer_tg_id бош болсо гана коюлат (бир жолу гана)
+
+    Эки update бир эле учурда келсе да unique ката болбойт.
+    Эч нерсе өзгөрбөсө сап кайра жазылбайт (жаңы row version / WAL жок) — анда
+    RETURNING бош келет жана user жөнөкөй SELECT менен окулат.
+    Commit'ти чакырган код кылат.
+    """
+    now = utcnow()
+
+    values: dict = {
+        "tg_id": tg_id,
+        "username": username,
+        "created_at": now,
+        "updated_at": now,
+        **defaults,
+    }
+    if referrer_tg_id and referrer_tg_id != tg_id:
+        values["referrer_tg_id"] = referrer_tg_id
+
+    stmt = pg_insert(User).values(**values)
+    excluded = stmt.excluded
+
+    set_: dict = {"tg_id": excluded.tg_id}
+    changed: list = []  # DO UPDATE ушулардын бирөө чын болгондо гана иштейт
+    if refresh_username and username:
+        set_["username"] = func.coalesce(excluded.username, User.username)
+        changed.append(User.username.is_distinct_from(excluded.username))
+    if "referrer_tg_id" in values:
+        set_["referrer_tg_id"] = func.coalesce(User.referrer_tg_id, excluded.referrer_tg_id)
+        changed.append(User.referrer_tg_id.is_(None))
+
+    stmt = (
+        stmt.on_conflict_do_update(
+            index_elements=[User.tg_id],
+            set_=set_,
+            where=or_(*changed) if changed else false(),
+        )
+        .returning(User)
+        .execution_options(populate_existing=True)
+    )
+
+    user = (await session.scalars(stmt)).one_or_none()
+    if user is None:
+        # сап бар жана өзгөрүү жок — DO UPDATE өткөрүлдү
+        user = (
+            await session.scalars(
+                select(User).where(User.tg_id == tg_id).execution_options(populate_existing=True)
+            )
+        ).one()
+    return user
+
+
+async def get_current_user(
+    session: AsyncSession,
+    tg_id: int,
+    username: Optional[str] = None,
+) -> User:
+    """
+    Update ичинде user бир гана жолу жүктөлөт (session.info'до сакталат).
+    Middleware жүктөсө — handler ошол эле ORM User'ди өзгөртөт, кайра SELECT жок.
+    """
+    u = session.info.get("user")
+    if u is None or u.tg_id != tg_id:
+        u = await upsert_user(session, tg_id, username=username)
+        session.info["user"] = u
+    return u
+
+
+async def commit_uow(session: AsyncSession) -> None:
+    """
+    Unit of work commit: өзгөргөн User'лердин updated_at'ын коюп, commit кылат.
+    """
+    if not session.in_transaction():
+        return
+    now = utcnow()
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            obj.updated_at = now
+    await session.commit()
+
+
+# =========================================================
+# Leader election (Postgres advisory lock)
+# =========================================================
+
+class AdvisoryLeader:
+    """
+    Session-level pg_try_advisory_lock өзүнчө connection'до кармалат.
+
+    - lock'ту алган replica — leader (singleton иштерди ошол гана жасайт)
+    - leader процесс өлсө/connection үзүлсө Postgres lock'ту өзү бошотот,
+      калгандары кийинки ensure()'де алып калат (automatic failover)
+    - connection AUTOCOMMIT: "idle in transaction" болуп турбайт
+    """
+
+    def __init__(self, key: int):
+        self.key = int(key)
+        self._conn: Optional[AsyncConnection] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._conn is not None
+
+    async def ensure(self) -> bool:
+        """
+        Leader болсо — connection тирүүбү текшерет; болбосо lock'ту алууга аракет кылат.
+        """
+        if self._conn is not None:
+            try:
+                await self._conn.execute(text("SELECT 1"))
+                return True
+            except Exception:
+                await self._drop()
+                return False
+
+        conn = await ENGINE.connect()
+        try:
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            got = (await conn.execute(
+                text("SELECT pg_try_advisory_lock(:k)"), {"k": self.key}
+            )).scalar()
+        except Exception:
+            await conn.close()
+            raise
+
+        if got:
+            self._conn = conn
+            return True
+
+        await conn.close()
+        return False
+
+    async def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            await self._conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": self.key})
+            await self._conn.close()
+        except Exception:
+            await self._drop()
+        self._conn = None
+
+    async def _drop(self) -> None:
+        # pool'го lock'у менен кайтпасын — физикалык connection'ду таштайбыз
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                await conn.invalidate()
+                await conn.close()
+            except Exception:
+                pass
+
+
+LEADER = AdvisoryLeader(LEADER_LOCK_KEY)
+
+
 # =========================================================
 # Health checks / init helpers
 # =========================================================
@@ -1,19 +1,25 @@
 from __future__ import annotations
 
 import datetime as dt
+from contextlib import suppress
 from typing import Optional
 
 from aiogram import Router, F
+from aiogram.dispatcher.event.bases import SkipHandler
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, not_
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import ADMIN_IDS
-from app.db import SessionLocal
-from app.models import User, Invoice
+from app.db import commit_uow
+from app.models import User, BroadcastJob
+from app.broadcast import BROADCASTS, render_progress, kb_broadcast_controls
+from app.segments import Segment, count_segment, bulk_update
+from app.stats import admin_stats_snapshot
 from app.constants import PLANS
 from app.utils import utcnow, in_30_days
 
@@ -51,6 +57,14 @@ def kb_confirm(action: str) -> InlineKeyboardMarkup:
     ])
 
 
+def kb_broadcast_confirm() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Ооба, аткар", callback_data="adm:confirm:broadcast")],
+        [InlineKeyboardButton(text="🎯 Сегмент тандоо", callback_data="adm:bc_segment")],
+        [InlineKeyboardButton(text="❌ Жок, отмена", callback_data="adm:home")],
+    ])
+
+
 def kb_plan_choices() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -87,6 +101,7 @@ class AdminFlow(StatesGroup):
     waiting_plan_days = State()           # plan duration days
     waiting_gift_amount = State()         # amount of credits/minutes/chat
     waiting_broadcast_text = State()      # broadcast message text
+    waiting_segment = State()             # broadcast audience segment
     waiting_ban_reason = State()          # ban reason
 
 
@@ -126,18 +141,135 @@ def parse_user_query(q: str) -> tuple[Optional[int], Optional[str]]:
     return None, None
 
 
-async def get_user_by_query(q: str) -> Optional[User]:
+SEGMENT_HELP = (
+    "🎯 *Сегмент* (бош жер менен бөлүп жаз):\n"
+    "• plan=PLUS,PRO\n"
+    "• country=KG,KZ\n"
+    "• lang=ky,ru\n"
+    "• active=7 (акыркы 7 күндө жазгандар)\n"
+    "• inactive=30 (30 күндөн бери жок)\n"
+    "• vip (VIP кредити барлар)\n"
+    "• all (баары)\n\n"
+    "Мисал: plan=PLUS country=KG active=7\n"
+    "Banned user'лер ар дайым чыгарылат."
+)
+
+
+def parse_segment_query(q: str) -> Optional[Segment]:
+    """
+    "seg: plan=PLUS vip" -> Segment; башка текст -> None (бул user query).
+    ValueError — сегмент туура эмес жазылса.
+    """
+    q = (q or "").strip()
+    for prefix in ("seg:", "сегмент:"):
+        if q.lower().startswith(prefix):
+            return Segment.parse(q[len(prefix):])
+    return None
+
+
+async def get_user_by_query(q: str, session: AsyncSession) -> Optional[User]:
     tg_id, uname = parse_user_query(q)
-    async with SessionLocal() as s:
-        if tg_id:
-            res = await s.execute(select(User).where(User.tg_id == tg_id))
-            return res.scalar_one_or_none()
-        if uname:
-            res = await s.execute(select(User).where(func.lower(User.username) == uname))
-            return res.scalar_one_or_none()
+    if tg_id:
+        res = await session.execute(select(User).where(User.tg_id == tg_id))
+        return res.scalar_one_or_none()
+    if uname:
+        # ix_users_username_lc (lower(username)) индекси колдонулат
+        res = await session.execute(select(User).where(func.lower(User.username) == uname).limit(1))
+        return res.scalar_one_or_none()
     return None
 
 
+# -------------------------
+# Search (prefix -> fuzzy), беттер менен
+# -------------------------
+SEARCH_PAGE_SIZE = 8
+
+
+async def search_users_prefix(
+    session: AsyncSession,
+    q: str,
+    after: Optional[str] = None,
+    limit: int = SEARCH_PAGE_SIZE,
+) -> list[User]:
+    """
+    lower(username) LIKE 'q%' — btree (text_pattern_ops) боюнча,
+    keyset: кийинки бет after'дан баштайт.
+    """
+    uname = func.lower(User.username)
+    stmt = select(User).where(uname.startswith(q, autoescape=True))
+    if after:
+        stmt = stmt.where(uname > after)
+    res = await session.execute(stmt.order_by(uname).limit(limit))
+    return list(res.scalars().all())
+
+
+async def search_users_fuzzy(
+    session: AsyncSession,
+    q: str,
+    offset: int = 0,
+    limit: int = SEARCH_PAGE_SIZE,
+) -> list[User]:
+    """
+    Trigram окшоштук (pg_trgm): lower(username) % q, ORDER BY <-> (GiST KNN index scan).
+    Prefix'ке туура келгендер кайталанбайт.
+    pg_trgm жок болсо — бош тизме (savepoint, update'тин transaction'у бузулбайт).
+    """
+    uname = func.lower(User.username)
+    stmt = (
+        select(User)
+        .where(uname.op("%")(q), not_(uname.startswith(q, autoescape=True)))
+        .order_by(uname.op("<->")(q))
+        .offset(offset)
+        .limit(limit)
+    )
+    try:
+        async with session.begin_nested():
+            res = await session.execute(stmt)
+            return list(res.scalars().all())
+    except SQLAlchemyError:
+        return []
+
+
+async def search_page(session: AsyncSession, state: FSMContext) -> tuple[list[User], bool]:
+    """
+    FSM'деги search_* боюнча кийинки бет: адегенде prefix, бүтсө — fuzzy.
+    Returns: (users, has_more)
+    """
+    data = await state.get_data()
+    q = data.get("search_q") or ""
+
+    if (data.get("search_mode") or "prefix") == "prefix":
+        users = await search_users_prefix(session, q, data.get("search_after"))
+        if len(users) == SEARCH_PAGE_SIZE:
+            await state.update_data(search_after=users[-1].username.lower())
+            return users, True
+        # prefix бүттү — беттин калганын fuzzy менен толтурабыз
+        await state.update_data(search_mode="fuzzy")
+        offset = 0
+    else:
+        users = []
+        offset = int(data.get("search_offset") or 0)
+
+    need = SEARCH_PAGE_SIZE - len(users)
+    more = await search_users_fuzzy(session, q, offset, need) if need else []
+    await state.update_data(search_offset=offset + len(more))
+    return users + more, bool(need) and len(more) == need
+
+
+def kb_search_results(users: list[User], has_more: bool) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(
+            text=f"@{u.username or '—'} · {u.tg_id} · {u.plan}",
+            callback_data=f"adm:uf:open:{u.tg_id}",
+        )]
+        for u in users
+    ]
+    if has_more:
+        rows.append([InlineKeyboardButton(text="▶️ Дагы", callback_data="adm:uf:more")])
+    rows.append([InlineKeyboardButton(text="⬅️ Артка (Admin)", callback_data="adm:home")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 def fmt_user(u: User) -> str:
     un = f"@{u.username}" if u.username else "(username жок)"
     plan_until = u.plan_until.isoformat() if u.plan_until else "-"
@@ -149,6 +281,7 @@ def fmt_user(u: User) -> str:
         f"• plan: {u.plan}\n"
         f"• plan_until: {plan_until}\n"
         f"• chat_left: {u.chat_left}\n"
+        f"• tokens_left: {u.tokens_left}\n"
         f"• vip_video_credits: {u.vip_video_credits}\n"
         f"• vip_music_minutes: {u.vip_music_minutes}\n"
         f"• blocked_until: {blocked}\n"
@@ -189,32 +322,26 @@ async def admin_close(c: CallbackQuery, state: FSMContext):
 # Stats
 # -------------------------
 @router.callback_query(F.data == "adm:stats")
-async def admin_stats(c: CallbackQuery):
+async def admin_stats(c: CallbackQuery, session: AsyncSession):
     if not await guard_admin(c):
         return
 
-    async with SessionLocal() as s:
-        total_users = (await s.execute(select(func.count(User.id)))).scalar_one()
-        plan_free = (await s.execute(select(func.count(User.id)).where(User.plan == "FREE"))).scalar_one()
-        plan_plus = (await s.execute(select(func.count(User.id)).where(User.plan == "PLUS"))).scalar_one()
-        plan_pro = (await s.execute(select(func.count(User.id)).where(User.plan == "PRO"))).scalar_one()
-
-        paid_cnt = (await s.execute(select(func.count(Invoice.id)).where(Invoice.status == "paid"))).scalar_one()
-        revenue = (await s.execute(select(func.coalesce(func.sum(Invoice.amount_usd), 0.0)).where(Invoice.status == "paid"))).scalar_one()
+    # 1 query (же stats_rollup) + кыска TTL кэш — app/stats.py
+    st = await admin_stats_snapshot(session)
 
     text = (
         "📊 *Stats*\n\n"
-        f"👥 Users: {total_users}\n"
-        f"🆓 FREE: {plan_free}\n"
-        f"💎 PLUS: {plan_plus}\n"
-        f"🔴 PRO: {plan_pro}\n\n"
-        f"✅ Paid invoices: {paid_cnt}\n"
-        f"💰 Revenue (USD): {float(revenue):.2f}\n\n"
+        f"👥 Users: {st['users_total']}\n"
+        f"🆓 FREE: {st['plan_FREE']}\n"
+        f"💎 PLUS: {st['plan_PLUS']}\n"
+        f"🔴 PRO: {st['plan_PRO']}\n\n"
+        f"✅ Paid invoices: {st['paid_invoices']}\n"
+        f"💰 Revenue (USD): {st['revenue_usd']:.2f}\n\n"
         "😈 Досум, бул сандар өссө — сен масштабга чыктың деген сөз!"
     )
 
     await c.message.edit_text(text, reply_markup=kb_admin_back())
-    await c.answer)
+    await c.answer()
 
 
 # -------------------------
@@ -231,24 +358,38 @@ async def admin_user_find(c: CallbackQuery, state: FSMContext):
         "Жаз:\n"
         "• tg_id (мисал: 123456789)\n"
         "же\n"
-        "• @username (мисал: @tilek)\n",
+        "• @username (мисал: @tilek)\n"
+        "• username'дин башы же окшошу (мисал: tile)\n",
         reply_markup=kb_admin_back()
     )
     await c.answer()
 
 
-@router.message(AdminFlow.waiting_user_query)
-async def admin_user_find_input(m: Message, state: FSMContext):
-    if not await guard_admin(m):
+@router.callback_query(F.data == "adm:uf:more")
+async def admin_user_search_more(c: CallbackQuery, state: FSMContext, session: AsyncSession):
+    if not await guard_admin(c):
         return
+    users, has_more = await search_page(session, state)
+    if not users:
+        await c.answer("Башка жок 🙂")
+        return
+    with suppress(Exception):
+        await c.message.edit_reply_markup(reply_markup=kb_search_results(users, has_more))
+    await c.answer()
+
 
-    u = await get_user_by_query(m.text)
+@router.callback_query(F.data.startswith("adm:uf:open:"))
+async def admin_user_search_open(c: CallbackQuery, state: FSMContext, session: AsyncSession):
+    if not await guard_admin(c):
+        return
+    tg_id = int(c.data.split(":")[-1])
+    u = await get_user_by_query(str(tg_id), session)
     if not u:
-        await m.answer("❌ Табылган жок, досум 😅\nКайра жаз: tg_id же @username", reply_markup=kb_admin_back())
+        await c.answer("Табылган жок 😅", show_alert=True)
         return
-
     await state.update_data(last_user_tg_id=u.tg_id)
-    await m.answer(fmt_user(u), reply_markup=kb_admin_back())
+    await c.message.answer(fmt_user(u), reply_markup=kb_admin_back())
+    await c.answer()
 
 
 # -------------------------
@@ -277,14 +418,16 @@ async def admin_gift_pick(c: CallbackQuery, state: FSMContext):
     await c.message.edit_text(
         f"{title} кошобуз.\n\n"
         "Алгач user жаз:\n"
-        "• tg_id же • @username",
+        "• tg_id же • @username\n"
+        "же сегментке: seg: plan=PLUS country=KG\n\n"
+        f"{SEGMENT_HELP}",
         reply_markup=kb_admin_back()
     )
     await c.answer()
 
 
 @router.message(AdminFlow.waiting_user_query)
-async def admin_waiting_user_then_amount(m: Message, state: FSMContext):
+async def admin_waiting_user_then_amount(m: Message, state: FSMContext, session: AsyncSession):
     """
     Бул handler user_find’ден кийин да түшүшү мүмкүн.
     Ошондуктан data ичинде gift_kind бар болсо — gift flow,
@@ -296,19 +439,48 @@ async def admin_waiting_user_then_amount(m: Message, state: FSMContext):
     data = await state.get_data()
     gift_kind = data.get("gift_kind")
 
-    # Эгер gift эмес болсо — user_find flow мурдагы функцияда кармалат.
     if not gift_kind:
-        # user find иштетип коёбуз
-        u = await get_user_by_query(m.text)
-        if not u:
-            await m.answer("❌ Табылган жок, кайра жаз: tg_id же @username", reply_markup=kb_admin_back())
+        # setplan / ban flow'лору — төмөнкү handler'лер (ошол эле state)
+        if data.get("target_plan") or data.get("ban_mode"):
+            raise SkipHandler()
+
+        # user find: адегенде так дал келүү (tg_id / username)
+        u = await get_user_by_query(m.text, session)
+        if u:
+            await state.update_data(last_user_tg_id=u.tg_id)
+            await m.answer(fmt_user(u), reply_markup=kb_admin_back())
             return
-        await state.update_data(last_user_tg_id=u.tg_id)
-        await m.answer(fmt_user(u), reply_markup=kb_admin_back())
+
+        # болбосо — prefix + fuzzy издөө, беттер менен
+        _, uname = parse_user_query(m.text)
+        if uname:
+            await state.update_data(search_q=uname, search_mode="prefix", search_after=None, search_offset=0)
+            users, has_more = await search_page(session, state)
+            if users:
+                await m.answer(f"🔎 «{uname}» боюнча табылгандар:", reply_markup=kb_search_results(users, has_more))
+                return
+
+        await m.answer("❌ Табылган жок, кайра жаз: tg_id же @username", reply_markup=kb_admin_back())
+        return
+
+    # Gift flow: сегментке (bulk)
+    try:
+        seg = parse_segment_query(m.text)
+    except ValueError as e:
+        await m.answer(f"❌ Сегмент түшүнүксүз: {e}\n\n{SEGMENT_HELP}", reply_markup=kb_admin_back())
+        return
+    if seg is not None:
+        n = await count_segment(session, seg)
+        await state.update_data(gift_segment=seg.to_json(), last_user_tg_id=None)
+        await state.set_state(AdminFlow.waiting_gift_amount)
+        await m.answer(
+            f"🎯 Сегмент: {seg.describe()}\n👥 User: {n}\n\nЭми ар бирине кошула турган сан жаз:",
+            reply_markup=kb_admin_back()
+        )
         return
 
-    # Gift flow
-    u = await get_user_by_query(m.text)
+    # Gift flow: бир user'ге
+    u = await get_user_by_query(m.text, session)
     if not u:
         await m.answer("❌ Табылган жок 😅\nКайра жаз: tg_id же @username", reply_markup=kb_admin_back())
         return
@@ -323,15 +495,16 @@ async def admin_waiting_user_then_amount(m: Message, state: FSMContext):
 
 
 @router.message(AdminFlow.waiting_gift_amount)
-async def admin_gift_apply(m: Message, state: FSMContext):
+async def admin_gift_apply(m: Message, state: FSMContext, session: AsyncSession):
     if not await guard_admin(m):
         return
 
     data = await state.get_data()
     gift_kind = data.get("gift_kind")
     target_tg_id = data.get("last_user_tg_id")
+    gift_segment = data.get("gift_segment")
 
-    if not gift_kind or not target_tg_id:
+    if not gift_kind or not (target_tg_id or gift_segment):
         await state.clear()
         await m.answer("⚠️ Flow бузулду. /admin кайра ач 😅")
         return
@@ -344,24 +517,33 @@ async def admin_gift_apply(m: Message, state: FSMContext):
     if amount <= 0 or amount > 100000:
         await m.answer("❌ Туура сан бер: 1..100000")
         return
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == target_tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            await m.answer("❌ User DBде жок болуп калды 😅")
-            return
 
-        if gift_kind == "video":
-            u.vip_video_credits += amount
-            done = f"🎥 VIP VIDEO кредит: +{amount}"
-        elif gift_kind == "music":
-            u.vip_music_minutes += amount
-            done = f"🪉 VIP MUSIC минут: +{amount}"
-        else:
-            u.chat_left += amount
-            done = f"💬 CHAT лимит: +{amount}"
+    if gift_segment:
+        seg = Segment.from_json(gift_segment)
+        column = {"video": "vip_video_credits", "music": "vip_music_minutes"}.get(gift_kind, "chat_left")
+        n = await bulk_update(seg, {column: getattr(User, column) + amount})
+        await state.clear()
+        await m.answer(
+            f"✅ Done!\n🎁 {column}: +{amount}\n🎯 {seg.describe()}\n👥 User: {n}",
+            reply_markup=kb_admin_home()
+        )
+        return
 
-        await s.commit()
+    res = await session.execute(select(User).where(User.tg_id == target_tg_id))
+    u = res.scalar_one_or_none()
+    if not u:
+        await m.answer("❌ User DBде жок болуп калды 😅")
+        return
+
+    if gift_kind == "video":
+        u.vip_video_credits += amount
+        done = f"🎥 VIP VIDEO кредит: +{amount}"
+    elif gift_kind == "music":
+        u.vip_music_minutes += amount
+        done = f"🪉 VIP MUSIC минут: +{amount}"
+    else:
+        u.chat_left += amount
+        done = f"💬 CHAT лимит: +{amount}"
 
     await state.clear()
     await m.answer(f"✅ Done!\n{done}\n\nTarget: {target_tg_id}", reply_markup=kb_admin_home())
@@ -403,7 +585,7 @@ async def admin_setplan_pick(c: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminFlow.waiting_plan_days)
-async def admin_setplan_days(m: Message, state: FSMContext):
+async def admin_setplan_days(m: Message, state: FSMContext, session: AsyncSession):
     if not await guard_admin(m):
         return
 
@@ -425,29 +607,27 @@ async def admin_setplan_days(m: Message, state: FSMContext):
         await m.answer("❌ Күн 1..3650 болсун 😈")
         return
 
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == target_tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            await m.answer("❌ User табылган жок 😅")
-            return
-
-        u.plan = plan
-        if plan == "FREE":
-            u.plan_until = None
-        else:
-            u.plan_until = utcnow() + dt.timedelta(days=days)
-            # refill limits immediately
-            p = PLANS[plan]
-            u.chat_left = p.monthly_chat
-            u.video_left = p.monthly_video
-            u.music_left = p.monthly_music
-            u.image_left = p.monthly_image
-            u.voice_left = p.monthly_voice
-            u.doc_left = p.monthly_doc
-            u.last_monthly_reset = utcnow()
-
-        await s.commit()
+    res = await session.execute(select(User).where(User.tg_id == target_tg_id))
+    u = res.scalar_one_or_none()
+    if not u:
+        await m.answer("❌ User табылган жок 😅")
+        return
+
+    u.plan = plan
+    if plan == "FREE":
+        u.plan_until = None
+    else:
+        u.plan_until = utcnow() + dt.timedelta(days=days)
+        # refill limits immediately
+        p = PLANS[plan]
+        u.chat_left = p.monthly_chat
+        u.tokens_left = p.monthly_tokens
+        u.video_left = p.monthly_video
+        u.music_left = p.monthly_music
+        u.image_left = p.monthly_image
+        u.voice_left = p.monthly_voice
+        u.doc_left = p.monthly_doc
+        u.last_monthly_reset = utcnow()
 
     await state.clear()
     await m.answer(f"✅ План коюлду: {plan} ({days} күн)\nTarget: {target_tg_id}", reply_markup=kb_admin_home())
@@ -455,7 +635,7 @@ async def admin_setplan_days(m: Message, state: FSMContext):
 
 # Hook user selection for setplan
 @router.message(AdminFlow.waiting_user_query)
-async def admin_setplan_user_then_days(m: Message, state: FSMContext):
+async def admin_setplan_user_then_days(m: Message, state: FSMContext, session: AsyncSession):
     if not await guard_admin(m):
         return
 
@@ -465,19 +645,15 @@ async def admin_setplan_user_then_days(m: Message, state: FSMContext):
 
     # setplan flow (эгер target_plan бар болсо)
     if plan and not gift_kind:
-        u = await get_user_by_query(m.text)
+        u = await get_user_by_query(m.text, session)
         if not u:
             await m.answer("❌ Табылган жок, кайра жаз: tg_id же @username", reply_markup=kb_admin_back())
             return
         await state.update_data(last_user_tg_id=u.tg_id)
         if plan == "FREE":
             # FREE үчүн күн сурабай эле коюп салабыз
-            async with SessionLocal() as s:
-                res = await s.execute(select(User).where(User.tg_id == u.tg_id))
-                uu = res.scalar_one()
-                uu.plan = "FREE"
-                uu.plan_until = None
-                await s.commit()
+            u.plan = "FREE"
+            u.plan_until = None
             await state.clear()
             await m.answer(f"✅ План коюлду: FREE\nTarget: {u.tg_id}", reply_markup=kb_admin_home())
             return
@@ -486,8 +662,9 @@ async def admin_setplan_user_then_days(m: Message, state: FSMContext):
         await m.answer(f"✅ Таптым:\n{fmt_user(u)}\nЭми канча күн? (мисал: 30)", reply_markup=kb_admin_back())
         return
 
-    # калган учурлар: башка flow handler’лер кармайт
-    # бул жерде эч нерсе кылбайбыз
+    # калган учурлар: башка flow handler’лер кармайт (ban)
+    raise SkipHandler()
+
 
 
 # -------------------------
@@ -517,17 +694,50 @@ async def admin_broadcast_confirm(m: Message, state: FSMContext):
         await m.answer("❌ Текст өтө кыска 😅")
         return
 
-    await state.update_data(broadcast_text=text)
+    await state.update_data(broadcast_text=text, broadcast_segment=None)
     await m.answer(
         "😈 Досум, confirm кылайлы!\n\n"
         f"Текст:\n{text}\n\n"
+        "👥 Кимге: баары\n\n"
+        "Жөнөтөбүзбү?",
+        reply_markup=kb_broadcast_confirm()
+    )
+
+
+@router.callback_query(F.data == "adm:bc_segment")
+async def admin_broadcast_segment(c: CallbackQuery, state: FSMContext):
+    if not await guard_admin(c):
+        return
+    await state.set_state(AdminFlow.waiting_segment)
+    await c.message.answer(SEGMENT_HELP, reply_markup=kb_admin_back())
+    await c.answer()
+
+
+@router.message(AdminFlow.waiting_segment)
+async def admin_broadcast_segment_input(m: Message, state: FSMContext, session: AsyncSession):
+    if not await guard_admin(m):
+        return
+    try:
+        seg = Segment.parse(m.text or "")
+    except ValueError as e:
+        await m.answer(f"❌ Түшүнүксүз: {e}\n\n{SEGMENT_HELP}", reply_markup=kb_admin_back())
+        return
+
+    data = await state.get_data()
+    n = await count_segment(session, seg)
+    await state.update_data(broadcast_segment=seg.to_json())
+    await state.set_state(None)
+    await m.answer(
+        "😈 Досум, confirm кылайлы!\n\n"
+        f"Текст:\n{data.get('broadcast_text') or '—'}\n\n"
+        f"👥 Кимге: {seg.describe()} ({n} user)\n\n"
         "Жөнөтөбүзбү?",
-        reply_markup=kb_confirm("broadcast")
+        reply_markup=kb_broadcast_confirm()
     )
 
 
 @router.callback_query(F.data == "adm:confirm:broadcast")
-async def admin_broadcast_send(c: CallbackQuery, state: FSMContext):
+async def admin_broadcast_send(c: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not await guard_admin(c):
         return
     data = await state.get_data()
@@ -538,26 +748,59 @@ async def admin_broadcast_send(c: CallbackQuery, state: FSMContext):
         await c.answer()
         return
 
-    # collect users
-    async with SessionLocal() as s:
-        ids = (await s.execute(select(User.tg_id))).scalars().all()
-
-    ok, fail = 0, 0
-    for tg_id in ids:
-        try:
-            await c.bot.send_message(tg_id, text)
-            ok += 1
-        except Exception:
-            fail += 1
+    # Job катары сакталат; жөнөтүүнү leader replica'дагы BROADCASTS engine жасайт
+    job = BroadcastJob(
+        admin_tg_id=c.from_user.id,
+        message_text=text,
+        segment=data.get("broadcast_segment"),
+        status="queued",
+        progress_chat_id=c.message.chat.id,
+        progress_message_id=c.message.message_id,
+    )
+    session.add(job)
+    await commit_uow(session)  # engine job'ду дароо көрсүн
+    BROADCASTS.wake()
 
     await state.clear()
-    await c.message.edit_text(
-        f"✅ Broadcast бүттү!\n"
-        f"📨 Sent: {ok}\n"
-        f"⚠️ Failed: {fail}\n",
-        reply_markup=kb_admin_home()
-    )
-    await c.answer()
+    await c.message.edit_text(render_progress(job), reply_markup=kb_broadcast_controls(job))
+    await c.answer("📣 Кезекке кошулду")
+
+
+@router.callback_query(F.data.startswith("adm:bc:"))
+async def admin_broadcast_control(c: CallbackQuery, session: AsyncSession):
+    if not await guard_admin(c):
+        return
+    try:
+        _, _, action, raw_id = c.data.split(":")
+        job_id = int(raw_id)
+    except ValueError:
+        await c.answer("Ката 😅", show_alert=True)
+        return
+
+    job = await session.get(BroadcastJob, job_id)
+    if not job:
+        await c.answer("Job табылган жок 😅", show_alert=True)
+        return
+
+    if action == "pause" and job.status in ("queued", "running"):
+        job.status = "paused"
+    elif action == "resume" and job.status == "paused":
+        # total эсептеле элек болсо — engine кайра queued'ден баштайт
+        job.status = "running" if job.total else "queued"
+    elif action == "cancel" and job.status in ("queued", "running", "paused"):
+        job.status = "cancelled"
+        job.finished_at = utcnow()
+    else:
+        await c.answer(f"Азыр {job.status} 🙂")
+        return
+
+    job.updated_at = utcnow()
+    await commit_uow(session)
+    BROADCASTS.wake()
+
+    with suppress(Exception):
+        await c.message.edit_text(render_progress(job), reply_markup=kb_broadcast_controls(job))
+    await c.answer("✅")
 
 
 # -------------------------
@@ -593,7 +836,7 @@ async def admin_ban_pick(c: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminFlow.waiting_ban_reason)
-async def admin_ban_apply(m: Message, state: FSMContext):
+async def admin_ban_apply(m: Message, state: FSMContext, session: AsyncSession):
     if not await guard_admin(m):
         return
 
@@ -605,24 +848,22 @@ async def admin_ban_apply(m: Message, state: FSMContext):
     if not reason:
         reason = "Admin decision"
 
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == target_tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            await m.answer("❌ User табылган жок 😅")
-            return
+    res = await session.execute(select(User).where(User.tg_id == target_tg_id))
+    u = res.scalar_one_or_none()
+    if not u:
+        await m.answer("❌ User табылган жок 😅")
+        return
 
-        # Бул field’дер models.py’да болушу керек.
-        setattr(u, "is_banned", True if mode == "on" else False)
-        setattr(u, "banned_reason", reason if mode == "on" else None)
-        await s.commit()
+    # Бул field’дер models.py’да болушу керек.
+    setattr(u, "is_banned", True if mode == "on" else False)
+    setattr(u, "banned_reason", reason if mode == "on" else None)
 
     await state.clear()
     await m.answer(f"✅ {mode.upper()} done\nTarget: {target_tg_id}\nReason: {reason}", reply_markup=kb_admin_home())
 
 
 @router.message(AdminFlow.waiting_user_query)
-async def admin_ban_user_then_reason(m: Message, state: FSMContext):
+async def admin_ban_user_then_reason(m: Message, state: FSMContext, session: AsyncSession):
     """
     Ban flow: user -> (if ban on) reason -> apply
     """
@@ -638,7 +879,7 @@ async def admin_ban_user_then_reason(m: Message, state: FSMContext):
     if not mode or plan or gift_kind:
         return
 
-    u = await get_user_by_query(m.text)
+    u = await get_user_by_query(m.text, session)
     if not u:
         await m.answer("❌ Табылган жок, кайра жаз: tg_id же @username", reply_markup=kb_admin_back())
         return
@@ -647,12 +888,8 @@ async def admin_ban_user_then_reason(m: Message, state: FSMContext):
 
     if mode == "off":
         # Unban үчүн reason сурабай эле койсок болот
-        async with SessionLocal() as s:
-            res = await s.execute(select(User).where(User.tg_id == u.tg_id))
-            uu = res.scalar_one()
-            setattr(uu, "is_banned", False)
-            setattr(uu, "banned_reason", None)
-            await s.commit()
+        setattr(u, "is_banned", False)
+        setattr(u, "banned_reason", None)
 
         await state.clear()
         await m.answer(f"✅ UNBAN done\nTarget: {u.tg_id}", reply_markup=kb_admin_home())
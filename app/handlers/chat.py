@@ -1,19 +1,35 @@
 from __future__ import annotations
 
+import asyncio
 import datetime as dt
 from typing import Optional, Literal
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from sqlalchemy import select
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+from sqlalchemy import update, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app.db import SessionLocal
+from app.db import get_current_user, commit_uow
 from app.models import User
+from app.cache import UserSnapshot, get_user_snapshot
 from app.constants import FREE_DAILY_QUESTIONS, BLOCK_HOURS_FREE, PLANS
-from app.utils import utcnow, minutes_left
+from app.config import (
+    LLM_STREAMING,
+    STREAM_EDIT_INTERVAL_S,
+    STREAM_MIN_DELTA_CHARS,
+    MEMORY_ENABLED,
+    INTENT_ROUTER,
+    INTENT_COUNTS_FREE,
+)
+from app.intents import route_intent, intent_answer, SALES_INTENTS
+from app.memory import load_memory, history_messages, memory_budget, remember_turn
+from app.usage import tokens_left
+from app.utils import utcnow, minutes_left, day_key_utc, clamp_text
 from app.style_engine import tilek_wrap, limit_ad_text, soft_error_text
 from app.keyboards import kb_main, kb_premium
-from app.services.grok import grok_chat
+from app.services.grok import grok_chat, grok_chat_stream, grok_admission, GrokStreamError
 
 router = Router()
 
@@ -24,7 +40,6 @@ Mode = Literal["chat", "video", "music", "image", "voice", "doc"]
 # NOTE: restart болгондо тазаланат. Кийин DB'га кошобуз.
 # ---------------------------
 _user_mode: dict[int, Mode] = {}
-_last_msg_at: dict[int, dt.datetime] = {}
 
 
 def _set_mode(tg_id: int, mode: Mode) -> None:
@@ -35,39 +50,6 @@ def _get_mode(tg_id: int) -> Mode:
     return _user_mode.get(tg_id, "chat")
 
 
-def _flood_ok(tg_id: int) -> bool:
-    """Simple anti-spam: 1.2 сек ичинде кайра жазса - токтотот."""
-    now = utcnow()
-    prev = _last_msg_at.get(tg_id)
-    _last_msg_at[tg_id] = now
-    if not prev:
-        return True
-    return (now - prev).total_seconds() >= 1.2
-
-
-async def _load_or_create_user(m: Message) -> User:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == m.from_user.id))
-        u = res.scalar_one_or_none()
-        if u:
-            # update username sometimes
-            if m.from_user.username and u.username != m.from_user.username:
-                u.username = m.from_user.username
-                u.updated_at = utcnow()
-                await s.commit()
-            return u
-
-        u = User(
-            tg_id=m.from_user.id,
-            username=m.from_user.username,
-            plan="FREE",
-        )
-        s.add(u)
-        await s.commit()
-        await s.refresh(u)
-        return u
-
-
 def _is_blocked(u: User) -> bool:
     return bool(u.blocked_until and utcnow() < u.blocked_until)
 
@@ -76,29 +58,119 @@ def _is_premium(u: User) -> bool:
     return u.plan in ("PLUS", "PRO")
 
 
-async def _save_user(u: User) -> None:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == u.tg_id))
-        dbu = res.scalar_one_or_none()
-        if not dbu:
-            return
-        # copy mutable fields we change here
-        dbu.plan = u.plan
-        dbu.plan_until = u.plan_until
-        dbu.chat_left = u.chat_left
-        dbu.video_left = u.video_left
-        dbu.music_left = u.music_left
-        dbu.image_left = u.image_left
-        dbu.voice_left = u.voice_left
-        dbu.doc_left = u.doc_left
-        dbu.free_today_count = u.free_today_count
-        dbu.free_day_key = u.free_day_key
-        dbu.blocked_until = u.blocked_until
-        dbu.style_counter = u.style_counter
-        dbu.vip_video_credits = u.vip_video_credits
-        dbu.vip_music_minutes = u.vip_music_minutes
-        dbu.updated_at = utcnow()
-        await s.commit()
+async def _take_free_question(session: AsyncSession, u: User) -> bool:
+    """
+    FREE күндүк лимиттен 1 суроо алат (lazy daily reset менен, атомдук).
+
+    free_day_key бүгүн эмес болсо — санагыч 1'ден башталат (түн ортосунда
+    бүт таблицаны жаңылаган sweep керек эмес). Бир UPDATE ичинде болгондуктан
+    эки параллель билдирүү лимиттен ашып кетпейт.
+    False => бүгүнкү лимит бүткөн.
+    """
+    today = day_key_utc()
+    fresh_day = User.free_day_key.is_distinct_from(today)
+    stmt = (
+        update(User)
+        .where(User.tg_id == u.tg_id)
+        .where(fresh_day | (User.free_today_count < FREE_DAILY_QUESTIONS))
+        .values(
+            free_day_key=today,
+            free_today_count=case((fresh_day, 1), else_=User.free_today_count + 1),
+        )
+        .returning(User.free_today_count)
+        .execution_options(synchronize_session=False)
+    )
+    count = (await session.execute(stmt)).scalar_one_or_none()
+    if count is None:
+        return False
+
+    # ORM объектти DB менен шайкеш кылабыз (dirty деп белгилебей)
+    set_committed_value(u, "free_day_key", today)
+    set_committed_value(u, "free_today_count", count)
+    return True
+
+
+async def _answer_intent(m: Message, u: User, intent: str) -> None:
+    kb = kb_premium() if intent in SALES_INTENTS else kb_main()
+    await m.answer(intent_answer(intent, u), reply_markup=kb)
+
+
+def _llm_priority(u: User) -> int:
+    plan = PLANS.get(u.plan or "FREE")
+    return plan.priority if plan else 0
+
+
+# ---------------------------
+# Streaming answer (placeholder -> throttled edits)
+# ---------------------------
+async def _answer_streaming(
+    m: Message,
+    u: User,
+    prompt: str,
+    history: Optional[list[dict]] = None,
+) -> Optional[str]:
+    """
+    Placeholder жөнөтүп, LLM stream'и келген сайын ошол билдирүүнү edit кылат.
+    Edit'тер STREAM_EDIT_INTERVAL_S'тен тез эмес (Telegram per-chat лимити);
+    RetryAfter келсе — ошол убакытка чейин аралык edit'тер өткөрүлөт.
+    Акырында tilek_wrap менен толук стилдеген текст коюлат.
+
+    Returns: LLM жообу (эс тутум үчүн) же None — ката болсо.
+    """
+    loop = asyncio.get_running_loop()
+    placeholder = await m.answer("⏳ Ойлонуп жатам...", parse_mode=None)
+
+    buf = ""
+    shown = 0
+    next_edit_at = 0.0
+    try:
+        async for delta in grok_chat_stream(
+            prompt,
+            lang=u.language or "ky",
+            style_counter=u.style_counter or 0,
+            is_pro=(u.plan == "PRO"),
+            priority=_llm_priority(u),
+            history=history,
+            tg_id=u.tg_id,
+        ):
+            buf += delta
+            now = loop.time()
+            if now < next_edit_at or len(buf) - shown < STREAM_MIN_DELTA_CHARS:
+                continue
+            next_edit_at = now + STREAM_EDIT_INTERVAL_S
+            try:
+                # markdown жарым-жартылай болушу мүмкүн — аралык edit'тер plain text
+                await placeholder.edit_text(clamp_text(buf) + " ▌", parse_mode=None)
+                shown = len(buf)
+            except TelegramRetryAfter as e:
+                next_edit_at = now + float(e.retry_after)
+            except TelegramBadRequest:
+                pass
+        answer = clamp_text(buf)
+        ok = True
+    except GrokStreamError as e:
+        answer = e.result.text
+        ok = False
+    except Exception:
+        # күтүлбөгөн ката (timeout, тармак, ...) — placeholder "⏳" болуп калбасын
+        try:
+            await placeholder.edit_text(soft_error_text(), reply_markup=kb_main(), parse_mode=None)
+        except TelegramBadRequest:
+            await m.answer(soft_error_text(), reply_markup=kb_main())
+        return None
+
+    # tilek_wrap header/footer кошот — акыркы текст да Telegram лимитинен ашпасын
+    final = clamp_text(tilek_wrap(u, answer))
+    try:
+        await placeholder.edit_text(final, reply_markup=kb_main())
+    except TelegramBadRequest:
+        # markdown parse болбой калса — plain text
+        try:
+            await placeholder.edit_text(final, reply_markup=kb_main(), parse_mode=None)
+        except TelegramBadRequest:
+            # edit такыр өтпөсө (мис. placeholder өчүрүлгөн) — жаңы билдирүү
+            await m.answer(final, reply_markup=kb_main(), parse_mode=None)
+    return answer if ok else None
 
 
 # ---------------------------
@@ -160,8 +232,8 @@ async def cb_doc(call: CallbackQuery):
 # Quick user stats
 # ---------------------------
 @router.message(F.text.in_({"/me", "/profile"}))
-async def me(m: Message):
-    u = await _load_or_create_user(m)
+async def me(m: Message, db_user: Optional[UserSnapshot] = None):
+    u = db_user or await get_user_snapshot(m.from_user.id, m.from_user.username)
     text = (
         f"👤 *Профиль*\n\n"
         f"• План: *{u.plan}*\n"
@@ -169,6 +241,8 @@ async def me(m: Message):
         f"• VIP VIDEO: *{u.vip_video_credits}*\n"
         f"• VIP MUSIC min: *{u.vip_music_minutes}*\n"
     )
+    if _is_premium(u):
+        text += f"• AI tokens left: *{u.tokens_left}*\n"
     if _is_blocked(u):
         text += f"\n⛔ FREE блок: *{minutes_left(u.blocked_until)} мүнөт* калды\n"
     await m.answer(text, reply_markup=kb_main())
@@ -178,13 +252,10 @@ async def me(m: Message):
 # Main text handler
 # ---------------------------
 @router.message(F.text)
-async def on_text(m: Message):
-    # anti spam
-    if not _flood_ok(m.from_user.id):
-        await m.answer("🐌 Досум жайыраак 😅 1 секунд күтө тур.")
-        return
-
-    u = await _load_or_create_user(m)
+async def on_text(m: Message, session: AsyncSession):
+    # anti spam: ChannelGateMiddleware (FLOOD token bucket) кармайт
+    # user middleware жүктөгөн болсо — кайра SELECT жок; commit DbSessionMiddleware'де
+    u = await get_current_user(session, m.from_user.id, m.from_user.username)
 
     # block check
     if _is_blocked(u):
@@ -207,38 +278,86 @@ async def on_text(m: Message):
     # 1) CHAT MODE
     # ==========
     if mode == "chat":
+        # меню суроолору ("канча суроо калды", "кантип төлөйм") — LLM'сиз, TEXTS'тен
+        intent = route_intent(prompt) if INTENT_ROUTER else None
+        if intent is not None:
+            if INTENT_COUNTS_FREE and not _is_premium(u):
+                if not await _take_free_question(session, u):
+                    u.blocked_until = utcnow() + dt.timedelta(hours=BLOCK_HOURS_FREE)
+                    await m.answer(limit_ad_text(), reply_markup=kb_premium())
+                    return
+            await _answer_intent(m, u, intent)
+            return
+
+        mem = await load_memory(session, u.tg_id) if MEMORY_ENABLED else None
+        history = history_messages(mem, memory_budget(u.plan))
+
         # premium limits
         if _is_premium(u):
             if u.chat_left <= 0:
                 await m.answer("🚫 Айлык чат лимит бүттү 😭\n\n" + limit_ad_text(), reply_markup=kb_premium())
                 return
-            u.chat_left -= 1
-        else:
-            # FREE daily limit
-            if u.free_today_count >= FREE_DAILY_QUESTIONS:
-                u.blocked_until = utcnow() + dt.timedelta(hours=BLOCK_HOURS_FREE)
-                await _save_user(u)
-                await m.answer(limit_ad_text(), reply_markup=kb_premium())
+            left = tokens_left(u)
+            if left is not None and left <= 0:
+                await m.answer(
+                    "🚫 Айлык AI токен бюджети бүттү 😭\n"
+                    "Кийинки айлык refill'де кайра толот.\n\n" + limit_ad_text(),
+                    reply_markup=kb_premium(),
+                )
                 return
             u.chat_left -= 1
         else:
-            # FREE daily limit
-            if u.free_today_count >= FREE_DAILY_QUESTIONS:
+            # жүктөм учурунда FREE суроосу бекер күйбөсүн — лимитке чейин текшеребиз
+            shed = grok_admission(
+                prompt,
+                lang=u.language or "ky",
+                style_counter=u.style_counter or 0,
+                is_pro=False,
+                priority=_llm_priority(u),
+                history=history,
+            )
+            if shed is not None:
+                await m.answer(shed.text, reply_markup=kb_main())
+                return
+
+            # FREE daily limit (күн алмашса — ушул жерде reset болот)
+            if not await _take_free_question(session, u):
                 u.blocked_until = utcnow() + dt.timedelta(hours=BLOCK_HOURS_FREE)
-                await _save_user(u)
                 await m.answer(limit_ad_text(), reply_markup=kb_premium())
                 return
-            u.free_today_count += 1
+
+        # Лимитти LLM'ден мурун бекитебиз жана connection'ду pool'го кайтарабыз:
+        # grok бир нече секунд алат, ошол убакта transaction ачык турбасын.
+        await commit_uow(session)
+
+        if LLM_STREAMING:
+            try:
+                answer = await _answer_streaming(m, u, prompt, history)
+            except Exception:
+                await m.answer(soft_error_text(), reply_markup=kb_main())
+                return
+            if MEMORY_ENABLED and answer:
+                await remember_turn(session, mem, u.tg_id, prompt, answer)
+            return
 
         try:
-            ai = await grok_chat(prompt, lang=u.language or "ky", is_pro=(u.plan == "PRO"))
+            ai = await grok_chat(
+                prompt,
+                lang=u.language or "ky",
+                style_counter=u.style_counter or 0,
+                is_pro=(u.plan == "PRO"),
+                priority=_llm_priority(u),
+                history=history,
+                tg_id=u.tg_id,
+            )
         except Exception:
             await m.answer(soft_error_text(), reply_markup=kb_main())
             return
 
-        styled = tilek_wrap(u, ai)
-        await _save_user(u)
+        styled = tilek_wrap(u, ai.text)
         await m.answer(styled, reply_markup=kb_main())
+        if MEMORY_ENABLED and ai.ok:
+            await remember_turn(session, mem, u.tg_id, prompt, ai.text)
         return
 
     # ==========
@@ -255,7 +374,6 @@ async def on_text(m: Message):
 
         # MVP: азырынча генерация stub (real API кийин services/media/runway.py)
         u.vip_video_credits -= 1
-        await _save_user(u)
         await m.answer(
             "🎬 *Видео заказ кабыл алынды!* 😎\n\n"
             f"📌 Тема: {prompt}\n"
@@ -279,7 +397,6 @@ async def on_text(m: Message):
 
         # MVP: азырынча 1 суроо = 1 мин деп алабыз (кийин duration параметр кошобуз)
         u.vip_music_minutes -= 1
-        await _save_user(u)
         await m.answer(
             "🎧 *Музыка заказ кабыл алынды!* 😎\n\n"
             f"📌 Тема: {prompt}\n"
@@ -1,23 +1,23 @@
 # app/handlers/history.py
 from __future__ import annotations
 
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
-from sqlalchemy import select
 
-from app.db import SessionLocal
-from app.models import User
+from app.cache import UserSnapshot, get_user_snapshot
 from app.keyboards import kb_main
 
 router = Router()
 
 
-def _safe_username(u: User) -> str:
+def _safe_username(u: UserSnapshot) -> str:
     uname = (u.username or "").strip()
     return f"@{uname}" if uname else "Tilek_Ald_Builder"
 
 
-def _legend_story(u: User) -> str:
+def _legend_story(u: UserSnapshot) -> str:
     builder = _safe_username(u)
     # “Tilek A.L.D” легенда-бренд блок
     return (
@@ -40,7 +40,7 @@ def _legend_story(u: User) -> str:
     )
 
 
-def _tilek_identity(u: User) -> str:
+def _tilek_identity(u: UserSnapshot) -> str:
     vibe = u.style_counter % 3
     if vibe == 0:
         return (
@@ -80,7 +80,7 @@ def _how_it_works_block() -> str:
     )
 
 
-def _status_block(u: User) -> str:
+def _status_block(u: UserSnapshot) -> str:
     plan = (u.plan or "FREE").upper()
     lang = (u.language or "ky")
     return (
@@ -102,7 +102,7 @@ def _cta_block() -> str:
     )
 
 
-def _full_text(u: User) -> str:
+def _full_text(u: UserSnapshot) -> str:
     return (
         f"{_tilek_identity(u)}\n"
         f"{_legend_story(u)}\n"
@@ -114,22 +114,10 @@ def _full_text(u: User) -> str:
 
 
 @router.callback_query(F.data == "m:history")
-async def history(call: CallbackQuery):
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == call.from_user.id))
-        u = res.scalar_one_or_none()
-
-        # /start баспай кирсе да иштесин
-        if not u:
-            u = User(
-                tg_id=call.from_user.id,
-                username=getattr(call.from_user, "username", None),
-            )
-            s.add(u)
-            await s.commit()
-            await s.refresh(u)
-
-        text = _full_text(u)
+async def history(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    # /start баспай кирсе да иштесин (кэш → DB load / create)
+    u = db_user or await get_user_snapshot(call.from_user.id, getattr(call.from_user, "username", None))
+    text = _full_text(u)
 
     await call.message.answer(text, reply_markup=kb_main())
     await call.answer()
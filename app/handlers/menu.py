@@ -1,9 +1,10 @@
 # app/handlers/menu.py
 from __future__ import annotations
 
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
-from sqlalchemy import select
 
 from app.keyboards import (
     kb_main,
@@ -11,27 +12,21 @@ from app.keyboards import (
     kb_vip_video,
     kb_vip_music,
 )
-from app.db import SessionLocal
-from app.models import User
+from app.cache import UserSnapshot, get_user_snapshot
 from app.style_engine import tilek_card
 from app.constants import PLANS
 
 router = Router()
 
 
-async def _load_user(tg_id: int) -> User:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            u = User(tg_id=tg_id)
-            s.add(u)
-            await s.commit()
-            await s.refresh(u)
-        return u
+async def _load_user(tg_id: int, db_user: Optional[UserSnapshot] = None) -> UserSnapshot:
+    # middleware data["db_user"] берсе — DB'га барбайбыз
+    if db_user is not None:
+        return db_user
+    return await get_user_snapshot(tg_id)
 
 
-def _status_text(u: User) -> str:
+def _status_text(u: UserSnapshot) -> str:
     plan = (u.plan or "FREE").upper()
     lang = (u.language or "ky")
     plan_until = u.plan_until.isoformat() if u.plan_until else "—"
@@ -77,8 +72,8 @@ async def back(call: CallbackQuery):
 
 
 @router.callback_query(F.data == "m:status")
-async def status(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def status(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     text = tilek_card(u, _status_text(u))
     await _edit_or_send(call, text, kb_main())
     await call.answer()
@@ -88,8 +83,8 @@ async def status(call: CallbackQuery):
 # PREMIUM / VIP MENUS
 # =========================
 @router.callback_query(F.data == "m:premium")
-async def premium(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def premium(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     plus = PLANS.get("PLUS")
     pro = PLANS.get("PRO")
 
@@ -113,8 +108,8 @@ async def premium(call: CallbackQuery):
 
 
 @router.callback_query(F.data == "m:vip_video")
-async def vip_video(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def vip_video(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     text = (
         "🎥 VIP VIDEO\n\n"
         "Бул — кино деңгээл 😎🎬\n"
@@ -128,8 +123,8 @@ async def vip_video(call: CallbackQuery):
 
 
 @router.callback_query(F.data == "m:vip_music")
-async def vip_music(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def vip_music(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     text = (
         "🪉 VIP MUSIC\n\n"
         "Бул — проф трек 😈🎧\n"
@@ -146,16 +141,16 @@ async def vip_music(call: CallbackQuery):
 # QUICK ACTIONS
 # =========================
 @router.callback_query(F.data == "m:chat")
-async def go_chat(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def go_chat(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     text = tilek_card(u, "💬 Чат режим\nСурооңду жазчы, досум 😎✍️")
     await call.message.answer(text)
     await call.answer()
 
 
 @router.callback_query(F.data == "m:video")
-async def go_video(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def go_video(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     text = tilek_card(
         u,
         "🎥 Видео режим\n"
@@ -167,8 +162,8 @@ async def go_video(call: CallbackQuery):
 
 
 @router.callback_query(F.data == "m:music")
-async def go_music(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def go_music(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     text = tilek_card(
         u,
         "🪉 Музыка режим\n"
@@ -180,8 +175,8 @@ async def go_music(call: CallbackQuery):
 
 
 @router.callback_query(F.data == "m:lang")
-async def change_lang(call: CallbackQuery):
-    u = await _load_user(call.from_user.id)
+async def change_lang(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = await _load_user(call.from_user.id, db_user)
     text = tilek_card(
         u,
         "🌐 Тил өзгөртүү\n\n"
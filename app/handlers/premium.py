@@ -2,14 +2,14 @@
 from __future__ import annotations
 
 import uuid
-from contextlib import suppress
+from typing import Optional
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
-from app.models import User, Invoice
+from app.models import Invoice
+from app.cache import UserSnapshot, get_user_snapshot
 from app.constants import PLANS, VIP_VIDEO_PACKS, VIP_MUSIC_PACKS_MINUTES
 from app.config import PUBLIC_BASE_URL
 from app.keyboards import kb_premium, kb_vip_video, kb_vip_music, kb_main
@@ -24,7 +24,7 @@ router = Router(name="premium_router")
 def _money(x: float) -> str:
     return f"${x:.2f}"
 
-def _plan_card(u: User) -> str:
+def _plan_card(u: UserSnapshot) -> str:
     # Кыска, сатканча сүйлөгөн статус
     if u.plan in ("PLUS", "PRO"):
         until = u.plan_until.isoformat()[:10] if u.plan_until else "—"
@@ -46,29 +46,16 @@ def _plan_card(u: User) -> str:
         "Күч ачыш үчүн PLUS/PRO же VIP алсаң — бот “ракета” болот 😎🚀"
     )
 
-async def _get_user(tg_id: int, username: str | None = None) -> User:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            u = User(tg_id=tg_id, username=username)
-            s.add(u)
-            await s.commit()
-            await s.refresh(u)
-        return u
-
-async def _save_invoice(tg_id: int, kind: str, amount: float, pay_url: str | None) -> None:
-    async with SessionLocal() as s:
-        inv = Invoice(
-            order_id=f"{kind}-{tg_id}-{uuid.uuid4().hex[:10]}",
-            tg_id=tg_id,
-            kind=kind,
-            amount_usd=float(amount),
-            status="created",
-            payment_url=pay_url,
-        )
-        s.add(inv)
-        await s.commit()
+def _save_invoice(session: AsyncSession, tg_id: int, kind: str, amount: float, pay_url: str | None) -> None:
+    # commit — DbSessionMiddleware'де
+    session.add(Invoice(
+        order_id=f"{kind}-{tg_id}-{uuid.uuid4().hex[:10]}",
+        tg_id=tg_id,
+        kind=kind,
+        amount_usd=float(amount),
+        status="created",
+        payment_url=pay_url,
+    ))
 
 
 def _kb_pay(pay_url: str, order_id: str) -> InlineKeyboardMarkup:
@@ -84,8 +71,8 @@ def _kb_pay(pay_url: str, order_id: str) -> InlineKeyboardMarkup:
 # Premium menu
 # -----------------------------
 @router.callback_query(F.data == "m:premium")
-async def premium_menu(call: CallbackQuery):
-    u = await _get_user(call.from_user.id, call.from_user.username)
+async def premium_menu(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = db_user or await get_user_snapshot(call.from_user.id, call.from_user.username)
     text = (
         "💎 ПРЕМИУМ ДҮКӨН\n\n"
         f"{_plan_card(u)}\n\n"
@@ -128,7 +115,12 @@ async def premium_vip_music(call: CallbackQuery):
 # -----------------------------
 # BUY: Plan / VIP
 # -----------------------------
-async def _mk_invoice(call: CallbackQuery, kind: str, amount: float) -> tuple[str | None, str]:
+async def _mk_invoice(
+    call: CallbackQuery,
+    session: AsyncSession,
+    kind: str,
+    amount: float,
+) -> tuple[str | None, str]:
     """
     Returns: (pay_url, order_id)
     """
@@ -142,24 +134,21 @@ async def _mk_invoice(call: CallbackQuery, kind: str, amount: float) -> tuple[st
         result = data.get("result") or {}
         pay_url = result.get("url") or result.get("pay_url") or result.get("payment_url")
 
-    # Save invoice
-    async with SessionLocal() as s:
-        inv = Invoice(
-            order_id=order_id,
-            tg_id=call.from_user.id,
-            kind=kind,
-            amount_usd=float(amount),
-            status="created",
-            payment_url=pay_url,
-        )
-        s.add(inv)
-        await s.commit()
+    # Save invoice (commit — DbSessionMiddleware'де)
+    session.add(Invoice(
+        order_id=order_id,
+        tg_id=call.from_user.id,
+        kind=kind,
+        amount_usd=float(amount),
+        status="created",
+        payment_url=pay_url,
+    ))
 
     return pay_url, order_id
 
 
 @router.callback_query(F.data.startswith("buy:plan:"))
-async def buy_plan(call: CallbackQuery):
+async def buy_plan(call: CallbackQuery, session: AsyncSession):
     plan_code = call.data.split(":")[2].strip().upper()
     if plan_code not in PLANS:
         await call.answer("Ката 😅", show_alert=True)
@@ -170,7 +159,7 @@ async def buy_plan(call: CallbackQuery):
         await call.answer("FREE сатып алынбайт 😄", show_alert=True)
         return
 
-    pay_url, order_id = await _mk_invoice(call, kind=f"PLAN_{plan_code}", amount=float(plan.price_usd))
+    pay_url, order_id = await _mk_invoice(call, session, kind=f"PLAN_{plan_code}", amount=float(plan.price_usd))
 
     if not pay_url:
         await call.message.answer(
@@ -192,23 +181,19 @@ async def buy_plan(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("buy:vip_video:"))
-async def buy_vip_video(call: CallbackQuery):
+async def buy_vip_video(call: CallbackQuery, session: AsyncSession):
     n = int(call.data.split(":")[2])
     if n not in VIP_VIDEO_PACKS:
         await call.answer("Ката 😅", show_alert=True)
         return
     amount = float(VIP_VIDEO_PACKS[n])
 
-    pay_url, order_id = await _mk_invoice(call, kind=f"VIP_VIDEO_{n}", amount=amount)
+    pay_url, order_id = await _mk_invoice(call, session, kind=f"VIP_VIDEO_{n}", amount=amount)
     if not pay_url:
         await call.message.answer("⚠️ Төлөм линк табылган жок. Cryptomus settings текшер 😅")
         await call.answer()
         return
 
-    await call.message.answer("⚠️ Төлөм линк табылган жок. Cryptomus settings текшер 😅")
-        await call.answer()
-        return
-
     await call.message.answer(
         f"🎥 VIP VIDEO пакет\n\n"
         f"📦 Кредит: {n} видео\n"
@@ -222,14 +207,14 @@ async def buy_vip_video(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("buy:vip_music:"))
-async def buy_vip_music(call: CallbackQuery):
+async def buy_vip_music(call: CallbackQuery, session: AsyncSession):
     minutes = int(call.data.split(":")[2])
     if minutes not in VIP_MUSIC_PACKS_MINUTES:
         await call.answer("Ката 😅", show_alert=True)
         return
     amount = float(VIP_MUSIC_PACKS_MINUTES[minutes])
 
-    pay_url, order_id = await _mk_invoice(call, kind=f"VIP_MUSIC_{minutes}", amount=amount)
+    pay_url, order_id = await _mk_invoice(call, session, kind=f"VIP_MUSIC_{minutes}", amount=amount)
     if not pay_url:
         await call.message.answer("⚠️ Төлөм линк табылган жок. Cryptomus settings текшер 😅")
         await call.answer()
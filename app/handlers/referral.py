@@ -1,12 +1,12 @@
 # app/handlers/referral.py
 from __future__ import annotations
 
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import select
 
-from app.db import SessionLocal
-from app.models import User
+from app.cache import UserSnapshot, get_user_snapshot
 from app.config import CHANNEL_URL
 from app.constants import REF_BONUS_USD, REF_FREE_PLUS_DAYS, REF_FREE_PLUS_MIN_PAID_USD
 
@@ -33,7 +33,7 @@ def _kb_withdraw() -> InlineKeyboardMarkup:
 def _fmt_money(x: float) -> str:
     return f"${x:.2f}"
 
-def _ref_text(u: User, link: str) -> str:
+def _ref_text(u: UserSnapshot, link: str) -> str:
     invited_by = f"{u.referrer_tg_id}" if u.referrer_tg_id else "—"
     channel = CHANNEL_URL or "—"
 
@@ -57,24 +57,12 @@ def _ref_text(u: User, link: str) -> str:
         "Система ушундай иштейт, досум 😈💎"
     )
 
-async def _get_user(tg_id: int, username: str | None) -> User:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            u = User(tg_id=tg_id, username=username)
-            s.add(u)
-            await s.commit()
-            await s.refresh(u)
-        return u
-
-
 # -----------------------------
 # Main referral screen
 # -----------------------------
 @router.callback_query(F.data == "m:ref")
-async def ref_menu(call: CallbackQuery):
-    u = await _get_user(call.from_user.id, call.from_user.username)
+async def ref_menu(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = db_user or await get_user_snapshot(call.from_user.id, call.from_user.username)
 
     # bot.username must exist (polling mode)
     bot_username = (call.bot.username or "").strip()
@@ -11,6 +11,8 @@ from typing import Optional, Any
 
 import aiohttp
 
+from app.services.http_clients import http_session, request_timeout
+
 
 # =========================================================
 # ENV
@@ -144,33 +146,33 @@ async def _request_json(
 
     for attempt in range(retries + 1):
         try:
-            timeout = aiohttp.ClientTimeout(total=timeout_s)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                if payload is None:
-                    headers = {"Accept": "application/json"}
-                else:
-                    headers = _headers(payload)
-
-                async with session.request(method, url, json=payload, headers=headers) as resp:
-                    text = await resp.text()
-
-                    if 200 <= resp.status < 300:
-                        if not text.strip():
-                            return {}
-                        try:
-                            return json.loads(text)
-                        except Exception:
-                            return {"raw": text}
-
-                    err = _err_by_status(resp.status, text)
-
-                    # retry only if: rate-limit or server
-                    if isinstance(err, (CryptomusRateLimit, CryptomusServerError)) and attempt < retries:
-                        await asyncio.sleep(1.5 * (attempt + 1))
-                        last_err = err
-                        continue
-
-                    raise err
+            timeout = request_timeout(timeout_s)
+            session = http_session("cryptomus")
+            if payload is None:
+                headers = {"Accept": "application/json"}
+            else:
+                headers = _headers(payload)
+
+            async with session.request(method, url, json=payload, headers=headers, timeout=timeout) as resp:
+                text = await resp.text()
+
+                if 200 <= resp.status < 300:
+                    if not text.strip():
+                        return {}
+                    try:
+                        return json.loads(text)
+                    except Exception:
+                        return {"raw": text}
+
+                err = _err_by_status(resp.status, text)
+
+                # retry only if: rate-limit or server
+                if isinstance(err, (CryptomusRateLimit, CryptomusServerError)) and attempt < retries:
+                    await asyncio.sleep(1.5 * (attempt + 1))
+                    last_err = err
+                    continue
+
+                raise err
 
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             last_err = e
@@ -2,13 +2,47 @@
 from __future__ import annotations
 
 import os
+import re
+import json
+import hashlib
+import time
 import asyncio
+from contextlib import suppress
 from dataclasses import dataclass
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 from openai import AsyncOpenAI
 from openai import APIError, APIConnectionError, RateLimitError, AuthenticationError, BadRequestError
 
+from app.cache import TTLCache, SingleFlight, SingleFlightAborted
+from app.llm_queue import (
+    LLM_QUEUE,
+    LLMQueueTimeout,
+    SHEDDER,
+    SHED_NORMAL,
+    SHED_FREE_SHORT,
+    SHED_FREE_CACHE_ONLY,
+    SHED_FREE_REJECT,
+)
+from app.config import (
+    LLM_CACHE_TTL_S,
+    LLM_CACHE_MAX,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_MAX_PROMPT,
+    LLM_HEDGE_DELAY_S,
+    LLM_TOTAL_TIMEOUT_S,
+    LLM_BREAKER_ERROR_RATE,
+    LLM_BREAKER_SLOW_S,
+    LLM_BREAKER_COOLDOWN_S,
+    LLM_BREAKER_ALPHA,
+    LLM_BREAKER_MIN_CALLS,
+    LLM_SHED_FREE_MAX_TOKENS,
+)
+from app.services.llm_gateway import CircuitBreaker, Provider, LLMGateway
+from app.data.countries import LANGUAGES
+from app.usage import USAGE
+from app.utils import estimate_tokens
+
 
 # =========================================================
 # ENV
@@ -18,14 +52,21 @@ GROK_BASE_URL = os.getenv("GROK_BASE_URL", "https://api.x.ai/v1").strip()
 GROK_MODEL = os.getenv("GROK_MODEL", "grok-beta").strip()
 GROK_TIMEOUT_S = int(os.getenv("GROK_TIMEOUT_S", "45"))
 
+# Запас провайдер (Grok жай/ката болсо hedge/fallback)
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").strip()
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini").strip()
+OPENAI_TIMEOUT_S = int(os.getenv("OPENAI_TIMEOUT_S", "45"))
+
 # Telegram safe length (markdown)
 TELEGRAM_MAX_CHARS = 3800
 
 
 # =========================================================
-# Client
+# Clients
 # =========================================================
 _client: Optional[AsyncOpenAI] = None
+_openai_client: Optional[AsyncOpenAI] = None
 
 
 def _get_client() -> Optional[AsyncOpenAI]:
@@ -41,43 +82,100 @@ def _get_client() -> Optional[AsyncOpenAI]:
     return _client
 
 
+def _get_openai_client() -> Optional[AsyncOpenAI]:
+    global _openai_client
+    if not OPENAI_API_KEY:
+        return None
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=OPENAI_TIMEOUT_S,
+        )
+    return _openai_client
+
+
+def _breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        error_rate=LLM_BREAKER_ERROR_RATE,
+        slow_s=LLM_BREAKER_SLOW_S,
+        cooldown_s=LLM_BREAKER_COOLDOWN_S,
+        alpha=LLM_BREAKER_ALPHA,
+        min_calls=LLM_BREAKER_MIN_CALLS,
+    )
+
+
+# Тартип маанилүү: биринчиси — primary
+GATEWAY = LLMGateway(
+    providers=[
+        Provider("grok", GROK_MODEL, _get_client, _breaker()),
+        Provider("openai", OPENAI_MODEL, _get_openai_client, _breaker()),
+    ],
+    hedge_delay_s=LLM_HEDGE_DELAY_S,
+    total_timeout_s=LLM_TOTAL_TIMEOUT_S,
+)
+
+
 # =========================================================
 # Tilek system prompt (core brand)
 # =========================================================
-def _tilek_system(lang: str, style_mode: str, is_pro: bool) -> str:
-    """
-    style_mode: "cool" | "hard" | "smart"
-    """
-    # тон
-    if style_mode == "cool":
-        persona = "Сен Tilek AIсың: дос, күлкүлүү, абдан боорукер, түшүнүктүү сүйлөйсүң."
-    elif style_mode == "hard":
-        persona = "Сен Tilek AIсың: бир аз катуураак, мотивация берип, бирок адамды сындырбайсың."
-    else:
-        persona = "Сен Tilek AIсың: азыр серьёзный, так, логикалуу, системалуу жооп бересиң."
-
-    pro_hint = (
+# Провайдер prompt caching'и так prefix боюнча иштейт: бардык user'лерге бирдей
+# эрежелер биринчи, өзгөрмө бөлүктөр (тон, тил, план) эң аягында. Текст мурункудай,
+# тартиби гана өзгөрдү. Блок кыска болсо провайдер кэштебейт — ага толтурма кошпойбуз.
+_STATIC_RULES = (
+    "Стиль: жеңил, түшүнүктүү, эмодзи орду менен.\n"
+    "Ар дайым структура менен жооп бер:\n"
+    "1) 📌 Негизги жооп (1-4 сүйлөм)\n"
+    "2) 📊 Түшүндүрмө (1-3 пункт)\n"
+    "3) 💡 Кеңеш/Кийинки кадам (1-2 пункт)\n"
+    "Эгер суроо түшүнүксүз болсо — 1 тактоочу суроо бер.\n"
+    "Эгер код сураса — кыска, иштей турган мисал бер.\n"
+    "Узак текст жазба, бирок маанилүүсүн калтыр.\n"
+)
+
+_PERSONAS = {
+    "cool": "Сен Tilek AIсың: дос, күлкүлүү, абдан боорукер, түшүнүктүү сүйлөйсүң.",
+    "hard": "Сен Tilek AIсың: бир аз катуураак, мотивация берип, бирок адамды сындырбайсың.",
+    "smart": "Сен Tilek AIсың: азыр серьёзный, так, логикалуу, системалуу жооп бересиң.",
+}
+
+_PLAN_HINTS = {
+    True: (
         "Колдонуучу PRO: жоопту так, кыска, максимал пайдалуу бер. "
         "Керек болсо 1-2 альтернатив сунушта."
-        if is_pro else
-        "Колдонуучу FREE/PLUS: ашыкча узартпай, түшүнүктүү бер."
-    )
+    ),
+    False: "Колдонуучу FREE/PLUS: ашыкча узартпай, түшүнүктүү бер.",
+}
 
-    # Негизги правила
-    rules = (
-        f"{persona}\n"
+
+def _build_system(lang: str, style_mode: str, is_pro: bool) -> str:
+    return (
+        f"{_STATIC_RULES}"
+        f"{_PERSONAS.get(style_mode, _PERSONAS['smart'])}\n"
         f"Жооп тили: {lang}.\n"
-        "Стиль: жеңил, түшүнүктүү, эмодзи орду менен.\n"
-        "Ар дайым структура менен жооп бер:\n"
-        "1) 📌 Негизги жооп (1-4 сүйлөм)\n"
-        "2) 📊 Түшүндүрмө (1-3 пункт)\n"
-        "3) 💡 Кеңеш/Кийинки кадам (1-2 пункт)\n"
-        "Эгер суроо түшүнүксүз болсо — 1 тактоочу суроо бер.\n"
-        "Эгер код сураса — кыска, иштей турган мисал бер.\n"
-        "Узак текст жазба, бирок маанилүүсүн калтыр.\n"
-        f"{pro_hint}"
+        f"{_PLAN_HINTS[is_pro]}"
     )
-    return rules
+
+
+# (lang, style_mode, is_pro) -> system string; import учурунда бир жолу
+_SYSTEM_PROMPTS: dict[tuple[str, str, bool], str] = {
+    (lang, style, is_pro): _build_system(lang, style, is_pro)
+    for lang in {"ky", *(l.code for l in LANGUAGES)}
+    for style in _PERSONAS
+    for is_pro in (False, True)
+}
+
+
+def _tilek_system(lang: str, style_mode: str, is_pro: bool) -> str:
+    """
+    style_mode: "cool" | "hard" | "smart"
+    """
+    key = (lang, style_mode, bool(is_pro))
+    system = _SYSTEM_PROMPTS.get(key)
+    if system is None:
+        # тизмеде жок тил (кол менен коюлган) — бир жолу курулат
+        system = _SYSTEM_PROMPTS[key] = _build_system(*key)
+    return system
 
 
 def _pick_style(style_counter: int) -> str:
@@ -106,37 +204,162 @@ class GrokResult:
 
 
 # =========================================================
-# Public function
+# Response cache (normalized prompt + lang + style + is_pro)
 # =========================================================
-async def grok_chat(
+# Маани: жооп текст гана (tilek_wrap кэштен кийин колдонулат — стиль айланат)
+RESPONSE_CACHE: TTLCache[tuple, str] = TTLCache(
+    maxsize=LLM_CACHE_MAX,
+    ttl_s=LLM_CACHE_TTL_S,
+    max_weight=LLM_CACHE_MAX_BYTES,
+    weigh=lambda text: len(text.encode("utf-8")),
+)
+
+# Бирдей in-flight суроолор (кэшке кире элек) бир upstream чакырууну бөлүшөт
+INFLIGHT: SingleFlight[tuple, "GrokResult"] = SingleFlight()
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _normalize_prompt(prompt: str) -> str:
+    """
+    "Эмне кыла аласың?? " == "эмне  кыла аласың" — регистр, боштук, аягындагы тыныш белгилер.
+    """
+    return _WS_RE.sub(" ", prompt.lower()).strip(" .,!?;:…")
+
+
+def _history_digest(history: Optional[list[dict]]) -> Optional[str]:
+    if not history:
+        return None
+    raw = json.dumps(history, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _cache_key(
+    prompt: str,
+    lang: str,
+    style_counter: int,
+    is_pro: bool,
+    history: Optional[list[dict]] = None,
+) -> Optional[tuple]:
+    """
+    history болсо жооп контекстке көз каранды — ачкычка анын digest'и кирет: ошол эле
+    контексттеги кайталанган суроо (double-send) кэштен / in-flight'тан алат.
+    """
+    if len(prompt) > LLM_CACHE_MAX_PROMPT:
+        return None
+    norm = _normalize_prompt(prompt)
+    if not norm:
+        return None
+    return (norm, lang, _pick_style(style_counter), bool(is_pro), _history_digest(history))
+
+
+def _flight_key(cache_key: tuple, kwargs: dict, priority: int) -> tuple:
+    # max_tokens да кирет: кыскартылган (degrade) жооп толук жооп менен аралашпасын.
+    # priority да кирет: PLUS/PRO FREE leader'дин кезегин (жана анын timeout/shed катасын) мурастабасын
+    return cache_key + (GROK_MODEL, kwargs["max_tokens"], priority)
+
+
+# =========================================================
+# Load shedding (FREE гана; PLUS/PRO ар дайым толук сапат)
+# =========================================================
+def _shed_level(priority: int) -> int:
+    # priority <= 0: FREE жана фон иштери
+    return SHEDDER.level() if priority <= 0 else SHED_NORMAL
+
+
+def _busy_result(level: int) -> GrokResult:
+    SHEDDER.count(level)
+    msg = (
+        "📌 Негизги жооп:\nАзыр сервер абдан жүктөлгөн 😅\n\n"
+        "📊 Түшүндүрмө:\n• FREE суроолор убактылуу тыным алып турат\n\n"
+        "💡 Кеңеш:\n2-3 мүнөттөн кийин кайра жаз. 💎 PLUS/PRO'до жооп тыным жок келет 😎"
+    )
+    return GrokResult(ok=False, text=msg, model="local", error=f"shed:{level}")
+
+
+def _degrade(level: int, key: Optional[tuple], kwargs: dict, priority: int) -> tuple:
+    """
+    Returns (store_key, flight_key, busy_result).
+    - FREE_CACHE_ONLY: кэш жок болсо — ушундай суроо азыр жүрүп жатса ага кошулат, болбосо busy
+    - FREE_SHORT: max_tokens кичирейет; кыска жооп кэшке жазылбайт
+    """
+    if level >= SHED_FREE_CACHE_ONLY:
+        fkey = _flight_key(key, kwargs, priority) if key is not None else None
+        if fkey is not None and INFLIGHT.inflight(fkey) is not None:
+            SHEDDER.count(level)
+            return None, fkey, None
+        return None, None, _busy_result(level)
+
+    if level >= SHED_FREE_SHORT:
+        SHEDDER.count(level)
+        kwargs["max_tokens"] = min(kwargs["max_tokens"], LLM_SHED_FREE_MAX_TOKENS)
+        return None, (_flight_key(key, kwargs, priority) if key is not None else None), None
+
+    return key, (_flight_key(key, kwargs, priority) if key is not None else None), None
+
+
+def grok_admission(
     prompt: str,
     *,
     lang: str = "ky",
     style_counter: int = 0,
     is_pro: bool = False,
-) -> GrokResult:
+    priority: int = 0,
+    history: Optional[list[dict]] = None,
+) -> Optional[GrokResult]:
     """
-    Returns GrokResult(text=...) always safe for Telegram.
+    Лимит кармалганга чейин текшерүү: None — кабыл алынат, болбосо "кийин жаз" жообу.
+    (grok_chat ичинде да ушул эреже иштейт; бул — FREE суроосу бекер күйбөсүн.)
     """
+    level = _shed_level(priority)
+    if level < SHED_FREE_CACHE_ONLY:
+        return None
+    if level >= SHED_FREE_REJECT:
+        return _busy_result(level)
+
+    key = _cache_key((prompt or "").strip(), lang, style_counter, is_pro, history)
+    if key is not None:
+        if RESPONSE_CACHE.peek(key) is not None:
+            return None
+        kwargs = _request_kwargs(prompt, lang, style_counter, is_pro, history)
+        if INFLIGHT.inflight(_flight_key(key, kwargs, priority)) is not None:
+            return None
+    return _busy_result(level)
+
+
+def _empty_prompt_result() -> GrokResult:
+    return GrokResult(ok=True, text="📌 Негизги жооп:\nЭмне деп берейин, досум? 🙂\n\n💡 Кеңеш:\nСурооңду 1 сүйлөм менен тактап жазчы 😎", model="local")
+
+
+def _demo_result(prompt: str) -> GrokResult:
+    demo = (
+        "📌 Негизги жооп:\n"
+        f"(DEMO) Сен жаздың: {prompt}\n\n"
+        "📊 Түшүндүрмө:\n"
+        "• Азыр GROK_API_KEY коюла элек\n"
+        "• Render ENVке кошсоң — реал жооп иштейт\n\n"
+        "💡 Кеңеш:\n"
+        "Render → Environment → GROK_API_KEY кошуп, кайра Deploy кыл 😎"
+    )
+    return GrokResult(ok=True, text=_safe_trim(demo), model="demo")
+
+
+def _empty_answer_text() -> str:
+    return "📌 Негизги жооп:\nАзыр жооп бош болуп калды 😅\n\n💡 Кеңеш:\nКайра 1 жолу жиберип көр, досум."
+
+
+def _final_text(content: str) -> str:
+    """Провайдердин жообу -> колдонуучуга (жана кэшке / waiter'лерге) бериле турган текст."""
+    return _safe_trim(content) or _empty_answer_text()
 
-    prompt = (prompt or "").strip()
-    if not prompt:
-        return GrokResult(ok=True, text="📌 Негизги жооп:\nЭмне деп берейин, досум? 🙂\n\n💡 Кеңеш:\nСурооңду 1 сүйлөм менен тактап жазчы 😎", model="local")
-
-    # DEMO режим
-    client = _get_client()
-    if client is None:
-        demo = (
-            "📌 Негизги жооп:\n"
-            f"(DEMO) Сен жаздың: {prompt}\n\n"
-            "📊 Түшүндүрмө:\n"
-            "• Азыр GROK_API_KEY коюла элек\n"
-            "• Render ENVке кошсоң — реал жооп иштейт\n\n"
-            "💡 Кеңеш:\n"
-            "Render → Environment → GROK_API_KEY кошуп, кайра Deploy кыл 😎"
-        )
-        return GrokResult(ok=True, text=_safe_trim(demo), model="demo")
 
+def _request_kwargs(
+    prompt: str,
+    lang: str,
+    style_counter: int,
+    is_pro: bool,
+    history: Optional[list[dict]] = None,
+) -> dict:
     style_mode = _pick_style(style_counter)
     system = _tilek_system(lang, style_mode, is_pro)
 
@@ -144,24 +367,23 @@ async def grok_chat(
     max_tokens = 900 if is_pro else 650
     temperature = 0.7 if style_mode != "smart" else 0.55
 
-    try:
-        resp = await client.chat.completions.create(
-            model=GROK_MODEL,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-
-        content = (resp.choices[0].message.content or "").strip()
-        if not content:
-            content = "📌 Негизги жооп:\nАзыр жооп бош болуп калды 😅\n\n💡 Кеңеш:\nКайра 1 жолу жиберип көр, досум."
+    return dict(
+        model=GROK_MODEL,
+        messages=[
+            {"role": "system", "content": system},
+            *(history or ()),
+            {"role": "user", "content": prompt},
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
 
-        return GrokResult(ok=True, text=_safe_trim(content), model=GROK_MODEL)
 
-    except AuthenticationError:
+def _error_result(e: BaseException) -> GrokResult:
+    """
+    Exception -> колдонуучуга көрсөтүлө турган коопсуз GrokResult.
+    """
+    if isinstance(e, AuthenticationError):
         msg = (
             "📌 Негизги жооп:\nGrok key туура эмес болуп калды 😭\n\n"
             "📊 Түшүндүрмө:\n• GROK_API_KEY жараксыз/эски\n\n"
@@ -169,7 +391,15 @@ async def grok_chat(
         )
         return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error="auth")
 
-    except RateLimitError:
+    if isinstance(e, LLMQueueTimeout):
+        msg = (
+            "📌 Негизги жооп:\nАзыр кезек абдан узун болуп турат 😅\n\n"
+            "📊 Түшүндүрмө:\n• Көп колдонуучу бир убакта жазып жатат\n\n"
+            "💡 Кеңеш:\n1-2 мүнөттөн кийин кайра жибер. 🔴 PRO'до кезек биринчи 😎"
+        )
+        return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error="queue_timeout")
+
+    if isinstance(e, RateLimitError):
         msg = (
             "📌 Негизги жооп:\nАзыр көп суроо болуп жатат (rate limit) 😅\n\n"
             "📊 Түшүндүрмө:\n• Сервер убактылуу жүктөлгөн\n\n"
@@ -177,7 +407,7 @@ async def grok_chat(
         )
         return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error="rate_limit")
 
-    except (APIConnectionError, asyncio.TimeoutError):
+    if isinstance(e, (APIConnectionError, asyncio.TimeoutError)):
         msg = (
             "📌 Негизги жооп:\nИнтернет/сервер байланышы үзүлдү окшойт 😭\n\n"
             "📊 Түшүндүрмө:\n• API жетпей калды же timeout болду\n\n"
@@ -185,7 +415,7 @@ async def grok_chat(
         )
         return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error="connection")
 
-    except BadRequestError as e:
+    if isinstance(e, BadRequestError):
         msg = (
             "📌 Негизги жооп:\nСуроо форматы туура эмес болуп калды 😅\n\n"
             "📊 Түшүндүрмө:\n• API 'bad request' кайтарды\n\n"
@@ -193,7 +423,7 @@ async def grok_chat(
         )
         return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error=f"bad_request:{e}")
 
-    except APIError as e:
+    if isinstance(e, APIError):
         msg = (
             "📌 Негизги жооп:\nAI сервер ички ката берди 😭\n\n"
             "📊 Түшүндүрмө:\n• APIError болду\n\n"
@@ -201,10 +431,326 @@ async def grok_chat(
         )
         return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error=f"api_error:{e}")
 
+    msg = (
+        "📌 Негизги жооп:\nБелгисиз ката болуп калды 😭\n\n"
+        "📊 Түшүндүрмө:\n• Ката: unknown\n\n"
+        "💡 Кеңеш:\nКайра жибер. Эгер кайталанса — error текстин мага ташта 😎"
+    )
+    return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error=f"unknown:{e}")
+
+
+# =========================================================
+# Provider ops (GATEWAY.run үчүн)
+# =========================================================
+async def _complete(p: Provider, kwargs: dict) -> tuple[str, object]:
+    """Returns (content, resp.usage)."""
+    resp = await p.get_client().chat.completions.create(**{**kwargs, "model": p.model})
+    return (resp.choices[0].message.content or "").strip(), resp.usage
+
+
+def _record_usage(
+    tg_id: Optional[int],
+    model: str,
+    usage,
+    kwargs: dict,
+    answer: str,
+    latency_s: float,
+) -> None:
+    """
+    Провайдер usage бербесе (кээ бир stream'дер) — болжол менен эсептейбиз.
+    cached_tokens: провайдер prompt cache'тен окуган prompt токендер
+    (usage.prompt_tokens_details.cached_tokens; жок болсо 0).
+    """
+    cached_tokens = 0
+    if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+    else:
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in kwargs["messages"])
+        completion_tokens = estimate_tokens(answer)
+    USAGE.record(tg_id, model, prompt_tokens, completion_tokens, latency_s, cached_tokens)
+
+
+async def _open_stream(p: Provider, kwargs: dict) -> tuple:
+    """
+    Stream ачып, биринчи текст бөлүгүнө чейин окуйт (hedge time-to-first-token боюнча).
+    Returns (stream, iterator, first_delta); бош жооп болсо first_delta == "".
+    """
+    stream = await p.get_client().chat.completions.create(
+        **{**kwargs, "model": p.model},
+        stream=True,
+        stream_options={"include_usage": True},  # акыркы chunk'та usage келет
+    )
+    it = stream.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await it.__anext__()
+            except StopAsyncIteration:
+                return stream, it, ""
+            if chunk.choices and chunk.choices[0].delta.content:
+                return stream, it, chunk.choices[0].delta.content
+    except BaseException:
+        # ката же hedge'те утулду (cancel) — connection'ду жабабыз
+        with suppress(Exception):
+            await stream.close()
+        raise
+
+
+async def _close_stream(opened: tuple) -> None:
+    with suppress(Exception):
+        await opened[0].close()
+
+
+# =========================================================
+# Public function
+# =========================================================
+async def grok_chat(
+    prompt: str,
+    *,
+    lang: str = "ky",
+    style_counter: int = 0,
+    is_pro: bool = False,
+    priority: int = 0,
+    history: Optional[list[dict]] = None,
+    tg_id: Optional[int] = None,
+) -> GrokResult:
+    """
+    Returns GrokResult(text=...) always safe for Telegram.
+    Провайдерге чакыруу LLM_QUEUE аркылуу өтөт (priority = Plan.priority).
+    history: app.memory.history_messages() — system менен user'дин ортосуна кошулат.
+    tg_id: токен usage ушул user'ге жазылат (app.usage.USAGE).
+    """
+
+    prompt = (prompt or "").strip()
+    if not prompt:
+        return _empty_prompt_result()
+
+    # DEMO режим (бир да провайдер key'и жок)
+    if not GATEWAY.configured():
+        return _demo_result(prompt)
+
+    level = _shed_level(priority)
+    if level >= SHED_FREE_REJECT:
+        return _busy_result(level)
+
+    key = _cache_key(prompt, lang, style_counter, is_pro, history)
+    if key is not None:
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            return GrokResult(ok=True, text=cached, model=GROK_MODEL)
+
+    kwargs = _request_kwargs(prompt, lang, style_counter, is_pro, history)
+    store_key, fkey, busy = _degrade(level, key, kwargs, priority)
+    if busy is not None:
+        return busy
+
+    async def fetch() -> GrokResult:
+        queued_at = time.monotonic()
+        try:
+            async with LLM_QUEUE.slot(priority):
+                started = time.monotonic()
+                provider, (content, usage) = await GATEWAY.run(lambda p: _complete(p, kwargs))
+        finally:
+            # timeout / ката да кирет — так ошолор каныккандыктын белгиси
+            SHEDDER.observe(time.monotonic() - queued_at)
+        _record_usage(tg_id, provider.model, usage, kwargs, content, time.monotonic() - started)
+
+        text = _final_text(content)
+        if store_key is not None and content.strip():
+            RESPONSE_CACHE.set(store_key, text)
+        return GrokResult(ok=True, text=text, model=provider.model)
+
+    try:
+        if fkey is None:
+            return await fetch()
+        # usage leader'ге жазылат; калгандары акысыз бөлүшөт
+        return await INFLIGHT.do(fkey, fetch)
     except Exception as e:
-        msg = (
-            "📌 Негизги жооп:\nБелгисиз ката болуп калды 😭\n\n"
-            "📊 Түшүндүрмө:\n• Ката: unknown\n\n"
-            "💡 Кеңеш:\nКайра жибер. Эгер кайталанса — error текстин мага ташта 😎"
-        )
-        return GrokResult(ok=False, text=_safe_trim(msg), model=GROK_MODEL, error=f"unknown:{e}")
+        return _error_result(e)
+
+
+# Фон иштери (summary) user суроолорунан кийин кызмат алат
+BACKGROUND_PRIORITY = -1
+
+
+async def grok_summarize(
+    summary: Optional[str],
+    turns: list[list[str]],
+    tg_id: Optional[int] = None,
+) -> Optional[str]:
+    """
+    Мурунку summary + эски turn'дер -> жаңы кыска summary. Ката болсо None.
+    """
+    if not GATEWAY.configured():
+        return None
+    # жүктөм учурунда фон summary күтө турат (кийинки turn'де кайра аракет)
+    if _shed_level(BACKGROUND_PRIORITY) >= SHED_FREE_CACHE_ONLY:
+        return None
+
+    dialog = "\n".join(f"User: {q}\nTilek: {a}" for q, a in turns)
+    content = (
+        (f"Мурунку кыскача мазмун:\n{summary}\n\n" if summary else "")
+        + f"Жаңы сүйлөшүү:\n{dialog}"
+    )
+    kwargs = dict(
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "Сүйлөшүүнү 5-8 кыска пунктка жыйна: колдонуучу ким, эмнени сурады, "
+                    "кандай чечимдер/фактылар айтылды. Колдонуучунун тилинде жаз. Ашыкча сөз жок."
+                ),
+            },
+            {"role": "user", "content": content},
+        ],
+        temperature=0.2,
+        max_tokens=300,
+    )
+    try:
+        async with LLM_QUEUE.slot(BACKGROUND_PRIORITY):
+            started = time.monotonic()
+            provider, (text, usage) = await GATEWAY.run(lambda p: _complete(p, kwargs))
+        _record_usage(tg_id, provider.model, usage, kwargs, text, time.monotonic() - started)
+        return text or None
+    except Exception:
+        return None
+
+
+class GrokStreamError(Exception):
+    """
+    Stream учурунда ката: .result — колдонуучуга көрсөтүлө турган GrokResult.
+    """
+
+    def __init__(self, result: GrokResult):
+        super().__init__(result.error or "stream_error")
+        self.result = result
+
+
+async def grok_chat_stream(
+    prompt: str,
+    *,
+    lang: str = "ky",
+    style_counter: int = 0,
+    is_pro: bool = False,
+    priority: int = 0,
+    history: Optional[list[dict]] = None,
+    tg_id: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """
+    stream=True: текст бөлүктөрүн (delta) келген сайын yield кылат.
+    DEMO / бош prompt — бүт текст бир бөлүк болуп келет.
+    Ката болсо — GrokStreamError (.result.text коопсуз текст).
+    LLM_QUEUE слоту stream аягына чейин кармалат.
+    """
+    prompt = (prompt or "").strip()
+    if not prompt:
+        yield _empty_prompt_result().text
+        return
+
+    if not GATEWAY.configured():
+        yield _demo_result(prompt).text
+        return
+
+    level = _shed_level(priority)
+    if level >= SHED_FREE_REJECT:
+        raise GrokStreamError(_busy_result(level))
+
+    key = _cache_key(prompt, lang, style_counter, is_pro, history)
+    if key is not None:
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    kwargs = _request_kwargs(prompt, lang, style_counter, is_pro, history)
+    store_key, fkey, busy = _degrade(level, key, kwargs, priority)
+    if busy is not None:
+        raise GrokStreamError(busy)
+
+    if fkey is None:
+        async for delta in _stream_upstream(kwargs, priority, tg_id, store_key):
+            yield delta
+        return
+
+    # ушундай суроо азыр эле жүрүп жатса — ошонун жообун күтөбүз (бүт текст бир бөлүк)
+    running = INFLIGHT.inflight(fkey)
+    if running is not None:
+        try:
+            shared = await INFLIGHT.wait(running)
+        except SingleFlightAborted:
+            pass  # leader токтоп калды — өзүбүз сурайбыз
+        except Exception as e:
+            raise GrokStreamError(_error_result(e)) from e
+        else:
+            yield shared.text
+            return
+
+    flight = INFLIGHT.begin(fkey)
+    parts: list[str] = []
+    try:
+        async for delta in _stream_upstream(kwargs, priority, tg_id, store_key):
+            parts.append(delta)
+            yield delta
+    except GrokStreamError as e:
+        # waiter'лер баштапкы катаны алып, өздөрү _error_result кылат
+        INFLIGHT.finish(fkey, flight, exc=e.__cause__ or e)
+        raise
+    except BaseException as e:
+        INFLIGHT.finish(fkey, flight, exc=e)
+        raise
+    # waiter'лер grok_chat'тегидей иштетилген текстти алат (trim / бош жооп)
+    INFLIGHT.finish(fkey, flight, result=GrokResult(ok=True, text=_final_text("".join(parts)), model=GROK_MODEL))
+
+
+async def _stream_upstream(
+    kwargs: dict,
+    priority: int,
+    tg_id: Optional[int],
+    key: Optional[tuple],
+) -> AsyncIterator[str]:
+    parts: list[str] = []
+    usage = None
+    queued_at = time.monotonic()
+    observed = False
+    try:
+        async with LLM_QUEUE.slot(priority):
+            started = time.monotonic()
+            provider, (stream, it, first) = await GATEWAY.run(
+                lambda p: _open_stream(p, kwargs),
+                discard=_close_stream,
+            )
+            SHEDDER.observe(time.monotonic() - queued_at)  # биринчи токенге чейин
+            observed = True
+            try:
+                if first:
+                    parts.append(first)
+                    yield first
+                async for chunk in it:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+            finally:
+                with suppress(Exception):
+                    await stream.close()
+                # жарым калган stream да төлөнөт
+                _record_usage(tg_id, provider.model, usage, kwargs, "".join(parts), time.monotonic() - started)
+    except Exception as e:
+        raise GrokStreamError(_error_result(e)) from e
+    finally:
+        if not observed:
+            # кезек timeout / провайдер катасы биринчи токенге чейин — p95'ке кирет
+            SHEDDER.observe(time.monotonic() - queued_at)
+
+    content = "".join(parts)
+    if not content.strip():
+        yield _empty_answer_text()
+    elif key is not None:
+        RESPONSE_CACHE.set(key, _final_text(content))
@@ -0,0 +1,110 @@
+# app/services/http_clients.py
+from __future__ import annotations
+
+import aiohttp
+
+from app.config import (
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_PER_HOST,
+    HTTP_DNS_TTL_S,
+    HTTP_KEEPALIVE_S,
+    HTTP_CONNECT_TIMEOUT_S,
+)
+
+
+# Ар бири өз pool'у менен: бир провайдердин жай жүктөөлөрү башкасынын connection'ун жебейт
+PROVIDERS = ("cryptomus", "runway", "kling", "suno", "elevenlabs")
+
+
+class HttpClients:
+    """
+    Провайдер -> бир узак жашаган aiohttp.ClientSession (TCP/TLS handshake жана DNS
+    ар суроодо кайталанбайт, keep-alive сакталат).
+
+    on_startup: start() — session'дор түзүлөт; on_shutdown: close().
+    get() start'ка чейин чакырылса (скрипт/тест) — session ошол жерде түзүлөт.
+    Timeout суроо деңгээлинде берилет: session.request(..., timeout=request_timeout(total_s)).
+    aiohttp суроо timeout'ун session'дукуна кошпойт, алмаштырат — ошондуктан sock_connect
+    ар бир суроонун ClientTimeout'унда болушу керек.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        limit_per_host: int,
+        dns_ttl_s: int,
+        keepalive_s: float,
+        connect_timeout_s: float,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl_s = dns_ttl_s
+        self.keepalive_s = keepalive_s
+        self.connect_timeout_s = connect_timeout_s
+
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self.created = 0
+        self.requests: dict[str, int] = {}
+
+    def _new_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_ttl_s,
+            keepalive_timeout=self.keepalive_s,
+        )
+        self.created += 1
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout_s),
+        )
+
+    async def start(self) -> None:
+        for name in PROVIDERS:
+            self.get(name, count=False)
+
+    def get(self, name: str, *, count: bool = True) -> aiohttp.ClientSession:
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = self._sessions[name] = self._new_session()
+        if count:
+            self.requests[name] = self.requests.get(name, 0) + 1
+        return session
+
+    async def close(self) -> None:
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            if not session.closed:
+                await session.close()
+
+    def stats(self) -> dict:
+        return {
+            "sessions_created": self.created,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "providers": {
+                name: {
+                    "open": name in self._sessions and not self._sessions[name].closed,
+                    "requests": self.requests.get(name, 0),
+                }
+                for name in PROVIDERS
+            },
+        }
+
+
+HTTP = HttpClients(
+    limit=HTTP_POOL_LIMIT,
+    limit_per_host=HTTP_POOL_PER_HOST,
+    dns_ttl_s=HTTP_DNS_TTL_S,
+    keepalive_s=HTTP_KEEPALIVE_S,
+    connect_timeout_s=HTTP_CONNECT_TIMEOUT_S,
+)
+
+
+def http_session(name: str) -> aiohttp.ClientSession:
+    return HTTP.get(name)
+
+
+def request_timeout(total_s: float) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(total=total_s, sock_connect=HTTP_CONNECT_TIMEOUT_S)
@@ -0,0 +1,249 @@
+# app/services/llm_gateway.py
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+
+# =========================================================
+# Circuit breaker (error-rate + latency EWMA)
+# =========================================================
+class CircuitBreaker:
+    """
+    closed    -> кадимки иш
+    open      -> провайдерге барбайбыз (cooldown_s бою)
+    half_open -> cooldown бүттү, 1 сыноо суроосу өтөт: ийгилик -> closed, ката/жай -> open
+
+    Ачылат: min_calls'тан кийин error EWMA >= error_rate же latency EWMA >= slow_s.
+    """
+
+    def __init__(self, error_rate: float, slow_s: float, cooldown_s: float, alpha: float, min_calls: int):
+        self.error_rate = float(error_rate)
+        self.slow_s = float(slow_s)
+        self.cooldown_s = float(cooldown_s)
+        self.alpha = min(1.0, max(0.01, float(alpha)))
+        self.min_calls = max(1, int(min_calls))
+
+        self.state = "closed"
+        self.latency_ewma = 0.0
+        self.error_ewma = 0.0
+        self.calls = 0
+        self.trips = 0
+        self._open_until = 0.0
+
+    def _ewma(self, old: float, x: float) -> float:
+        return x if self.calls <= 1 else old + self.alpha * (x - old)
+
+    def _trip(self) -> None:
+        self.state = "open"
+        self.trips += 1
+        self._open_until = time.monotonic() + self.cooldown_s
+
+    def _should_trip(self) -> bool:
+        return self.calls >= self.min_calls and (
+            self.error_ewma >= self.error_rate or self.latency_ewma >= self.slow_s
+        )
+
+    def allow(self) -> bool:
+        """
+        Суроо жөнөтсө болобу. half_open'до True бир гана жолу кайтат (сыноо).
+        """
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() >= self._open_until:
+            self.state = "half_open"
+            return True
+        return False
+
+    def record_success(self, latency_s: float) -> None:
+        self.calls += 1
+        self.latency_ewma = self._ewma(self.latency_ewma, latency_s)
+        self.error_ewma = self._ewma(self.error_ewma, 0.0)
+        if self.state == "half_open":
+            if latency_s >= self.slow_s:
+                self._trip()
+                return
+            # кайра жанды — эски статистика эми маанилүү эмес
+            self.state = "closed"
+            self.calls = 1
+            self.latency_ewma = latency_s
+            self.error_ewma = 0.0
+        elif self._should_trip():
+            self._trip()
+
+    def record_failure(self, latency_s: float) -> None:
+        self.calls += 1
+        self.latency_ewma = self._ewma(self.latency_ewma, latency_s)
+        self.error_ewma = self._ewma(self.error_ewma, 1.0)
+        if self.state == "half_open" or self._should_trip():
+            self._trip()
+
+    def record_abandoned(self, latency_s: float) -> None:
+        """
+        Hedge утуп, бул суроо жокко чыгарылды: ката эмес, бирок ушунча убакыт жооп жок.
+        """
+        self.calls += 1
+        self.latency_ewma = self._ewma(self.latency_ewma, latency_s)
+        if self.state == "half_open" or self._should_trip():
+            self._trip()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "latency_ewma_s": round(self.latency_ewma, 3),
+            "error_ewma": round(self.error_ewma, 3),
+            "calls": self.calls,
+            "trips": self.trips,
+        }
+
+
+# =========================================================
+# Provider
+# =========================================================
+@dataclass
+class Provider:
+    name: str
+    model: str
+    get_client: Callable[[], Any]  # None кайтарса — key жок (провайдер өчүк)
+    breaker: CircuitBreaker
+    wins: int = field(default=0)
+
+    def configured(self) -> bool:
+        return self.get_client() is not None
+
+
+class NoProviderConfigured(Exception):
+    pass
+
+
+# =========================================================
+# Gateway (hedged requests)
+# =========================================================
+class LLMGateway:
+    """
+    Провайдерлер тартип менен (биринчиси — primary).
+
+    run(op): op(provider) — бир провайдерге суроо жасаган coroutine.
+    - primary hedge_delay_s ичинде жооп бербесе — кийинки провайдерге да жиберилет,
+      биринчи келген жооп утат, калгандары cancel болот
+    - бирөө ката берсе — дароо кийинкиси (fallback)
+    - баары total_timeout_s ичинде бүтпөсө — asyncio.TimeoutError
+    - breaker ачык провайдерлер өткөрүлөт; баары ачык болсо — primary баары бир сыналат
+    """
+
+    def __init__(self, providers: list[Provider], hedge_delay_s: float, total_timeout_s: float):
+        self.providers = providers
+        self.hedge_delay_s = max(0.0, float(hedge_delay_s))
+        self.total_timeout_s = max(1.0, float(total_timeout_s))
+        self.hedges = 0
+        self.fallbacks = 0
+        self.timeouts = 0
+
+    def configured(self) -> list[Provider]:
+        return [p for p in self.providers if p.configured()]
+
+    async def run(
+        self,
+        op: Callable[[Provider], Awaitable[Any]],
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> tuple[Provider, Any]:
+        """
+        discard(result): утулган, бирок бүтүп калган жыйынтыкты тазалоо (мис. stream жабуу).
+        """
+        providers = self.configured()
+        if not providers:
+            raise NoProviderConfigured()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout_s
+        queue = iter(providers)
+        pending: dict[asyncio.Task, tuple[Provider, float]] = {}
+
+        def launch(force: bool = False) -> bool:
+            for p in queue:
+                if force or p.breaker.allow():
+                    task = asyncio.ensure_future(op(p))
+                    # cancel болгон/утулган task'тын exception'у log'ду булгабасын
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    pending[task] = (p, loop.time())
+                    return True
+            return False
+
+        if not launch():
+            queue = iter(providers[:1])
+            launch(force=True)
+
+        last_exc: Optional[BaseException] = None
+        hedge_at = loop.time() + self.hedge_delay_s
+
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    self.timeouts += 1
+                    raise asyncio.TimeoutError()
+
+                wait_s = deadline - now
+                if now < hedge_at:
+                    wait_s = min(wait_s, hedge_at - now)
+
+                done, _ = await asyncio.wait(
+                    pending, timeout=wait_s, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    if loop.time() >= hedge_at:
+                        hedge_at = float("inf")
+                        if launch():
+                            self.hedges += 1
+                    continue
+
+                winner: Optional[tuple[Provider, Any]] = None
+                for task in done:
+                    p, started = pending.pop(task)
+                    latency = loop.time() - started
+                    exc = task.exception()
+                    if exc is not None:
+                        p.breaker.record_failure(latency)
+                        last_exc = exc
+                    elif winner is None:
+                        p.breaker.record_success(latency)
+                        p.wins += 1
+                        winner = (p, task.result())
+                    else:
+                        p.breaker.record_success(latency)
+                        if discard is not None:
+                            await discard(task.result())
+
+                if winner is not None:
+                    return winner
+
+                if not pending:
+                    if launch():
+                        self.fallbacks += 1
+                    else:
+                        raise last_exc  # type: ignore[misc]
+        finally:
+            for task, (p, started) in pending.items():
+                task.cancel()
+                p.breaker.record_abandoned(loop.time() - started)
+
+        raise last_exc or asyncio.TimeoutError()
+
+    def stats(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "fallbacks": self.fallbacks,
+            "timeouts": self.timeouts,
+            "providers": {
+                p.name: {
+                    "configured": p.configured(),
+                    "model": p.model,
+                    "wins": p.wins,
+                    **p.breaker.stats(),
+                }
+                for p in self.providers
+            },
+        }
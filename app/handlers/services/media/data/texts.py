@@ -8,8 +8,8 @@ from app.constants import (
     PLANS,
     FREE_DAILY_QUESTIONS,
     BLOCK_HOURS_FREE,
-    VIP_VIDEO_PACKS,
-    VIP_MUSIC_PACKS_MINUTES,
+    VIP_VIDEO_PACKS_USD as VIP_VIDEO_PACKS,
+    VIP_MUSIC_PACKS_MIN_USD as VIP_MUSIC_PACKS_MINUTES,
 )
 
 
@@ -136,6 +136,15 @@ TEXTS: Dict[str, str] = {
         "✅ Эң чоң лимит 😈"
     ),
 
+    "premium_how_to_pay": (
+        "💳 *Кантип төлөйм?*\n\n"
+        "1) «💎 Премиум» менюну ач\n"
+        "2) PLUS / PRO же VIP пакетти танда\n"
+        "3) Cryptomus шилтемеси ачылат — крипто менен төлө\n"
+        "4) Төлөм өткөндөн кийин план *автомат* ачылат ✅\n\n"
+        "Ачылбай калса — «🆘 Support»ко order_id жибер 😎"
+    ),
+
     "payment_creating": "💳 Төлөм барагы даярдалып жатат... 5 секунда күт 🙏",
     "payment_open_url": "✅ Даяр! Төмөнкү шилтемеден төлөп кой:\n\n{url}\n\nТөлөгөндөн кийин автомат ачылат 😎",
     "payment_error": "😭 Төлөм түзүүдө ката кетти. Кийинчерээк кайра аракет кылып көр.",
@@ -191,6 +200,19 @@ TEXTS: Dict[str, str] = {
         "💡 Скрин + кыскача түшүндүрмө жиберсең тез чечебиз 😎"
     ),
 
+    "support_faq": (
+        "📌 FAQ / Эреже\n\n"
+        "1) Төлөм төлөдүң, бирок ачылган жокпу?\n"
+        "   → Төлөмдүн скриншотун + order_id жибер.\n\n"
+        "2) Лимит бүтүп калдыбы?\n"
+        f"   → FREE: {FREE_DAILY_QUESTIONS} суроо/күн, анан {BLOCK_HOURS_FREE} саат блок.\n"
+        "   → PLUS/PRO: ай сайын reset.\n\n"
+        "3) Бот жооп бербей жатабы?\n"
+        "   → 1 мүнөттөн кийин кайра аракет кыл.\n\n"
+        "💡 Кеңеш:\n"
+        "Канча так жазсаң — ошончо тез чечилет 😎"
+    ),
+
     # ---- HISTORY / ABOUT ----
     "history_title": (
         "📖 *Tilek AI ким?*\n\n"
@@ -9,6 +9,8 @@ from typing import Optional, Dict, Any
 
 import aiohttp
 
+from app.services.http_clients import http_session, request_timeout
+
 
 # =========================
 # Config (ENV)
@@ -69,24 +71,24 @@ async def _request_with_retry(
 
     for attempt in range(retries + 1):
         try:
-            timeout = aiohttp.ClientTimeout(total=timeout_s)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.request(method, url, headers=headers, json=json_body) as resp:
-                    data = await resp.read()
-
-                    if 200 <= resp.status < 300:
-                        return data
-
-                    # Try parse error message
-                    msg = ""
-                    try:
-                        # if json error
-                        import json as _json
-                        msg = _json.loads(data.decode("utf-8", errors="ignore")).get("detail") or ""
-                    except Exception:
-                        msg = data.decode("utf-8", errors="ignore")[:400]
-
-                    raise ElevenLabsError(f"ElevenLabs HTTP {resp.status}: {msg}")
+            timeout = request_timeout(timeout_s)
+            session = http_session("elevenlabs")
+            async with session.request(method, url, headers=headers, json=json_body, timeout=timeout) as resp:
+                data = await resp.read()
+
+                if 200 <= resp.status < 300:
+                    return data
+
+                # Try parse error message
+                msg = ""
+                try:
+                    # if json error
+                    import json as _json
+                    msg = _json.loads(data.decode("utf-8", errors="ignore")).get("detail") or ""
+                except Exception:
+                    msg = data.decode("utf-8", errors="ignore")[:400]
+
+                raise ElevenLabsError(f"ElevenLabs HTTP {resp.status}: {msg}")
 
         except Exception as e:
             last_err = e
@@ -10,6 +10,8 @@ from typing import Optional, Literal, Any
 
 import aiohttp
 
+from app.services.http_clients import http_session, request_timeout
+
 
 # =========================================================
 # ENV (Render)
@@ -115,29 +117,29 @@ async def _request_json(
 
     for attempt in range(retries + 1):
         try:
-            timeout = aiohttp.ClientTimeout(total=timeout_s)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.request(method, url, headers=_headers(), json=payload) as resp:
-                    text = await resp.text()
-                    if 200 <= resp.status < 300:
-                        # кээде бош жооп болушу мүмкүн
-                        if not text.strip():
-                            return {}
-                        try:
-                            return json.loads(text)
-                        except Exception:
-                            # JSON эмес болсо да кайтарабыз
-                            return {"raw": text}
-
-                    err = _err_from_status(resp.status, text)
-
-                    # retry only for 429/5xx
-                    if isinstance(err, (KlingRateLimitError, KlingServerError)) and attempt < retries:
-                        await asyncio.sleep(1.2 * (attempt + 1))
-                        last_err = err
-                        continue
-
-                    raise err
+            timeout = request_timeout(timeout_s)
+            session = http_session("kling")
+            async with session.request(method, url, headers=_headers(), json=payload, timeout=timeout) as resp:
+                text = await resp.text()
+                if 200 <= resp.status < 300:
+                    # кээде бош жооп болушу мүмкүн
+                    if not text.strip():
+                        return {}
+                    try:
+                        return json.loads(text)
+                    except Exception:
+                        # JSON эмес болсо да кайтарабыз
+                        return {"raw": text}
+
+                err = _err_from_status(resp.status, text)
+
+                # retry only for 429/5xx
+                if isinstance(err, (KlingRateLimitError, KlingServerError)) and attempt < retries:
+                    await asyncio.sleep(1.2 * (attempt + 1))
+                    last_err = err
+                    continue
+
+                raise err
 
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             last_err = e
@@ -151,14 +153,14 @@ async def _request_json(
 
 async def _download_file(url: str, out_path: str, timeout_s: int = 120) -> str:
     os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
-    timeout = aiohttp.ClientTimeout(total=timeout_s)
-
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise KlingError(f"Download failed status={resp.status}, body={text[:400]}")
-            data = await resp.read()
+    timeout = request_timeout(timeout_s)
+
+    session = http_session("kling")
+    async with session.get(url, timeout=timeout) as resp:
+        if resp.status != 200:
+            text = await resp.text()
+            raise KlingError(f"Download failed status={resp.status}, body={text[:400]}")
+        data = await resp.read()
 
     with open(out_path, "wb") as f:
         f.write(data)
@@ -4,12 +4,12 @@ from __future__ import annotations
 from aiogram import Router, F
 from aiogram.filters import CommandStart
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
+from app.db import upsert_user, get_current_user
 from app.models import User
 from app.keyboards import kb_main
-from app.utils import utcnow, day_key_utc
+from app.utils import day_key_utc
 from app.data.countries import COUNTRIES, DEFAULT_LANG  # сенде 100+ болушу керек
 from app.config import CHANNEL_URL, REQUIRED_CHANNEL
 
@@ -21,39 +21,23 @@ PER_PAGE = 12
 # -----------------------------
 # DB helpers
 # -----------------------------
-async def _get_or_create_user(tg_id: int, username: str | None, referrer: int | None) -> User:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == tg_id))
-        u = res.scalar_one_or_none()
-
-        if not u:
-            u = User(
-                tg_id=tg_id,
-                username=username,
-                language=DEFAULT_LANG or "ky",
-                free_day_key=day_key_utc(),
-                created_at=utcnow(),
-                updated_at=utcnow(),
-            )
-            if referrer and referrer != tg_id:
-                u.referrer_tg_id = referrer
-            s.add(u)
-            await s.commit()
-            await s.refresh(u)
-            return u
-
-        # update username if changed
-        if username and (u.username != username):
-            u.username = username
-            u.updated_at = utcnow()
-
-        # save referrer only if empty (бир жолу гана)
-        if referrer and referrer != tg_id and not u.referrer_tg_id:
-            u.referrer_tg_id = referrer
-            u.updated_at = utcnow()
-
-        await s.commit()
-        return u
+async def _get_or_create_user(
+    session: AsyncSession,
+    tg_id: int,
+    username: str | None,
+    referrer: int | None,
+) -> User:
+    # username жаңыланат, referrer бош болсо гана коюлат (бир жолу гана)
+    u = await upsert_user(
+        session,
+        tg_id,
+        username=username,
+        referrer_tg_id=referrer,
+        language=DEFAULT_LANG or "ky",
+        free_day_key=day_key_utc(),
+    )
+    session.info["user"] = u
+    return u
 
 
 # -----------------------------
@@ -143,7 +127,7 @@ def _soft_channel_hint() -> str:
 # -----------------------------
 @router.message(CommandStart(deep_link=True))
 @router.message(CommandStart())
-async def start(message: Message):
+async def start(message: Message, session: AsyncSession):
     # parse referral id: /start 12345
     referrer = None
     parts = (message.text or "").split()
@@ -152,6 +136,7 @@ async def start(message: Message):
 
     # create / update user
     u = await _get_or_create_user(
+        session,
         tg_id=message.from_user.id,
         username=message.from_user.username,
         referrer=referrer
@@ -183,7 +168,7 @@ async def lang_page(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("lang:set:"))
-async def lang_set(call: CallbackQuery):
+async def lang_set(call: CallbackQuery, session: AsyncSession):
     _, _, code, page = call.data.split(":")
     info = COUNTRIES.get(code)
 
@@ -192,18 +177,9 @@ async def lang_set(call: CallbackQuery):
         return
 
     lang = info.get("lang", "ky")
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == call.from_user.id))
-        u = res.scalar_one_or_none()
-        if not u:
-            u = User(tg_id=call.from_user.id, username=call.from_user.username)
-            s.add(u)
-            await s.flush()
-
-        u.country_code = code
-        u.language = lang
-        u.updated_at = utcnow()
-        await s.commit()
+    u = await get_current_user(session, call.from_user.id, call.from_user.username)
+    u.country_code = code
+    u.language = lang
 
     await call.message.answer(
         f"✅ Тандалды: {info.get('flag','🌐')} {info.get('name', code)}\n"
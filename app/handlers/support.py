@@ -13,6 +13,7 @@ from aiogram.exceptions import TelegramBadRequest
 from app.config import SUPPORT_ADMINS, ADMIN_IDS
 from app.keyboards import kb_main  # сенде бар болсо
 from app.style_engine import limit_ad_text  # бар болсо (жок болсо алып сал)
+from app.data.texts import t
 
 
 router = Router()
@@ -113,19 +114,7 @@ async def support_entry(call: CallbackQuery):
 
 @router.callback_query(F.data == "support:faq")
 async def support_faq(call: CallbackQuery):
-    text = (
-        "📌 FAQ / Эреже\n\n"
-        "1) Төлөм төлөдүң, бирок ачылган жокпу?\n"
-        "   → Төлөмдүн скриншотун + order_id жибер.\n\n"
-        "2) Лимит бүтүп калдыбы?\n"
-        "   → FREE: 10 суроо/күн, анан 6 саат блок.\n"
-        "   → PLUS/PRO: ай сайын reset.\n\n"
-        "3) Бот жооп бербей жатабы?\n"
-        "   → 1 мүнөттөн кийин кайра аракет кыл.\n\n"
-        "💡 Кеңеш:\n"
-        "Канча так жазсаң — ошончо тез чечилет 😎"
-    )
-    await call.message.answer(text, reply_markup=kb_support_menu())
+    await call.message.answer(t("support_faq"), reply_markup=kb_support_menu())
     await call.answer()
 
 
@@ -7,11 +7,13 @@ from dataclasses import dataclass
 from typing import Dict, Optional, Tuple
 
 from aiogram import Router, F
+from aiogram.filters import Command
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
+from app.db import upsert_user, get_current_user, commit_uow
 from app.models import User
+from app.cache import UserSnapshot, get_user_snapshot
 from app.config import ADMIN_IDS
 from app.constants import PLANS
 from app.style_engine import tilek_wrap, limit_ad_text
@@ -72,34 +74,7 @@ def _clean_prompt(text: str, max_len: int = 500) -> str:
     return t
 
 
-async def _get_user(tg_id: int, username: Optional[str] = None) -> User:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            u = User(tg_id=tg_id, username=username)
-            s.add(u)
-            await s.commit()
-            await s.refresh(u)
-        return u
-
-
-async def _save_user(u: User) -> None:
-    async with SessionLocal() as s:
-        res = await s.execute(select(User).where(User.tg_id == u.tg_id))
-        db_u = res.scalar_one()
-        # copy fields we touched
-        db_u.plan = u.plan
-        db_u.plan_until = u.plan_until
-        db_u.video_left = u.video_left
-        db_u.music_left = u.music_left
-        db_u.vip_video_credits = u.vip_video_credits
-        db_u.vip_music_minutes = u.vip_music_minutes
-        db_u.style_counter = u.style_counter
-        await s.commit()
-
-
-def _vip_balance_text(u: User) -> str:
+def _vip_balance_text(u: UserSnapshot) -> str:
     return (
         "📦 VIP баланс\n\n"
         f"🎥 VIP VIDEO кредит: {u.vip_video_credits}\n"
@@ -188,8 +163,8 @@ async def vip_home(call: CallbackQuery):
 
 
 @router.callback_query(F.data == "vip:balance")
-async def vip_balance(call: CallbackQuery):
-    u = await _get_user(call.from_user.id, call.from_user.username)
+async def vip_balance(call: CallbackQuery, db_user: Optional[UserSnapshot] = None):
+    u = db_user or await get_user_snapshot(call.from_user.id, call.from_user.username)
     await call.message.answer(_vip_balance_text(u))
     await call.answer()
 
@@ -221,7 +196,7 @@ async def vip_cancel(call: CallbackQuery):
 # Handle prompts
 # =========================================================
 @router.message(F.text)
-async def on_text(message: Message):
+async def on_text(message: Message, session: AsyncSession):
     state = VIP_STATE.get(message.from_user.id)
     if not state:
         return  # VIP эмес, башка chat handler кармайт
@@ -229,7 +204,7 @@ async def on_text(message: Message):
     kind, _ts = state
     prompt = _clean_prompt(message.text)
 
-    u = await _get_user(message.from_user.id, message.from_user.username)
+    u = await get_current_user(session, message.from_user.id, message.from_user.username)
 
     # Consume credits/limits first (so users can't spam)
     if kind == "video":
@@ -239,7 +214,8 @@ async def on_text(message: Message):
             await message.answer(_need_text("video"), reply_markup=kb_upsell())
             return
 
-        await _save_user(u)
+        # кредитти генерациядан мурун бекитебиз (connection да бошойт)
+        await commit_uow(session)
         VIP_STATE.pop(message.from_user.id, None)
 
         # Generate (stub)
@@ -248,7 +224,6 @@ async def on_text(message: Message):
 
         # Style wrap
         styled = tilek_wrap(u, result_text)
-        await _save_user(u)
         await message.answer(styled)
 
     elif kind == "music":
@@ -258,14 +233,14 @@ async def on_text(message: Message):
             await message.answer(_need_text("music"), reply_markup=kb_upsell())
             return
 
-        await _save_user(u)
+        # кредитти генерациядан мурун бекитебиз (connection да бошойт)
+        await commit_uow(session)
         VIP_STATE.pop(message.from_user.id, None)
 
         await message.answer("⏳ Музыка жасап жатам... (demo режим) 😎🪉")
         result_text = await generate_music_stub(prompt=prompt, minutes=1)
 
         styled = tilek_wrap(u, result_text)
-        await _save_user(u)
         await message.answer(styled)
 
     else:
@@ -277,7 +252,7 @@ async def on_text(message: Message):
 # Admin tools: give credits
 # =========================================================
 @router.message(Command("vip_give"))
-async def vip_give(message: Message):
+async def vip_give(message: Message, session: AsyncSession):
     """
     Admin only.
     Usage:
@@ -312,15 +287,13 @@ async def vip_give(message: Message):
         return
 
     target_id = int(tg_id_s)
-    u = await _get_user(target_id)
+    u = await upsert_user(session, target_id, refresh_username=False)
 
     if kind == "video":
         u.vip_video_credits += amount
-        await _save_user(u)
         await message.answer(f"✅ Берилди: tg_id={target_id} VIP_VIDEO +{amount}")
     elif kind == "music":
         u.vip_music_minutes += amount
-        await _save_user(u)
         await message.answer(f"✅ Берилди: tg_id={target_id} VIP_MUSIC +{amount} мин")
     else:
         await message.answer("❌ kind: video/music гана.")
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from app.config import INTENT_SLACK_WORDS
+from app.constants import FREE_DAILY_QUESTIONS, PAID_PLANS
+from app.data.texts import t
+from app.models import User
+from app.utils import day_key_utc, minutes_left, utcnow
+
+
+# =========================================================
+# Intent catalog
+# =========================================================
+# Ар бир фраза — stem'дер (сөз башы). Билдирүүдөгү сөз stem менен башталса дал келет:
+# "төлө" -> төлөйм / төлөм / төлөө. Фразанын бардык stem'дери табылышы керек.
+# "pro=" — так сөз гана (programming, proxy дал келбейт).
+_INTENT_PHRASES: dict[str, tuple[str, ...]] = {
+    "limits": (
+        "канча суроо калд", "суроо калд", "лимитим", "менин лимит",
+        "сколько вопрос остал", "вопрос остал", "мой лимит",
+        "how many question left", "question left", "my limit",
+    ),
+    "how_to_pay": (
+        "кантип төлө", "кантип сатып ал", "премиум сатып ал",
+        "как оплат", "как купить премиум", "как заплат",
+        "how pay", "how buy premium",
+    ),
+    "pro": ("pro= эмне", "pro= деген эмне", "что такое pro=", "что дает pro=", "what is pro="),
+    "plus": ("plus= эмне", "plus= деген эмне", "что такое plus=", "что дает plus=", "what is plus="),
+    "plans": (
+        "тариф", "премиум эмне", "премиум канча турат", "премиум баа",
+        "сколько стоит премиум", "цена премиум",
+        "premium price", "pricing",
+    ),
+    "vip_video": ("vip= video", "vip= видео", "видео пакет", "video pack"),
+    "vip_music": ("vip= music", "vip= музыка", "музыка пакет", "music pack"),
+    "faq": ("faq=", "бот эреже", "правила бот", "bot rules"),
+    "about": ("сен ким", "кто ты=", "who are= you=", "tilek ким"),
+}
+
+
+@dataclass(frozen=True)
+class _Phrase:
+    intent: str
+    stems: tuple[str, ...]
+
+
+class _TrieNode:
+    __slots__ = ("children", "terms", "exact")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.terms: list[int] = []  # ушул жерде бүткөн stem'дердин id'лери
+        self.exact: list[int] = []  # сөз так ушул жерде бүтсө гана
+
+
+_WORD_RE = re.compile(r"[\w']+", re.UNICODE)
+
+
+def _words(text: str) -> list[str]:
+    return _WORD_RE.findall((text or "").lower().replace("ё", "е"))
+
+
+class IntentRouter:
+    """
+    Stem trie (compile бир жолу, import учурунда) + фразалар боюнча inverted index.
+
+    match(): ар бир сөз trie аркылуу бир өтүү менен ал баштала турган бардык stem'дерди
+    табат -> ошол stem'дер кирген фразалардын санагычы өсөт -> бардык stem'и табылган
+    фразалардын эң узуну утат. Узун билдирүүлөр (фраза + INTENT_SLACK_WORDS сөздөн көп)
+    LLM'ге кетет — "Python'до recursion лимит" деген суроо лимит intent'и болбосун.
+    """
+
+    def __init__(self, catalog: dict[str, tuple[str, ...]], slack_words: int):
+        self.slack_words = max(0, int(slack_words))
+        self._root = _TrieNode()
+        self._stem_ids: dict[str, int] = {}
+        self._phrases: list[_Phrase] = []
+        self._by_stem: dict[int, list[int]] = {}  # stem id -> phrase idx
+
+        for intent, phrases in catalog.items():
+            for raw in phrases:
+                stems = tuple(raw.lower().split())
+                if not stems:
+                    continue
+                idx = len(self._phrases)
+                self._phrases.append(_Phrase(intent, stems))
+                for stem in set(stems):
+                    self._by_stem.setdefault(self._stem_id(stem), []).append(idx)
+
+        self.hits: dict[str, int] = {}
+        self.misses = 0
+
+    def _stem_id(self, stem: str) -> int:
+        sid = self._stem_ids.get(stem)
+        if sid is not None:
+            return sid
+        sid = self._stem_ids[stem] = len(self._stem_ids)
+        exact = stem.endswith("=")
+        node = self._root
+        for ch in stem.rstrip("="):
+            node = node.children.setdefault(ch, _TrieNode())
+        (node.exact if exact else node.terms).append(sid)
+        return sid
+
+    def _stems_of(self, word: str) -> list[int]:
+        found: list[int] = []
+        node = self._root
+        for ch in word:
+            node = node.children.get(ch)
+            if node is None:
+                break
+            found.extend(node.terms)
+        else:
+            found.extend(node.exact)
+        return found
+
+    def match(self, text: str) -> Optional[str]:
+        words = _words(text)
+        if not words:
+            return None
+
+        seen: set[int] = set()
+        for w in words:
+            seen.update(self._stems_of(w))
+
+        counts: dict[int, int] = {}
+        for sid in seen:
+            for idx in self._by_stem.get(sid, ()):
+                counts[idx] = counts.get(idx, 0) + 1
+
+        best: Optional[_Phrase] = None
+        for idx, n in counts.items():
+            phrase = self._phrases[idx]
+            if n < len(set(phrase.stems)):
+                continue
+            if len(words) > len(phrase.stems) + self.slack_words:
+                continue
+            if best is None or len(phrase.stems) > len(best.stems):
+                best = phrase
+
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits[best.intent] = self.hits.get(best.intent, 0) + 1
+        return best.intent
+
+    def stats(self) -> dict:
+        return {"hits": dict(self.hits), "misses": self.misses, "stems": len(self._stem_ids)}
+
+
+INTENTS = IntentRouter(_INTENT_PHRASES, slack_words=INTENT_SLACK_WORDS)
+
+
+# =========================================================
+# Answers (TEXTS + live user limits)
+# =========================================================
+def _limits_text(u: User) -> str:
+    if u.plan in PAID_PLANS:
+        until = u.plan_until.strftime("%Y-%m-%d") if u.plan_until else "—"
+        return (
+            f"📦 *{u.plan}* лимиттериң (калганы):\n\n"
+            f"• 💬 Чат: {u.chat_left}\n"
+            f"• 🎥 Видео: {u.video_left}\n"
+            f"• 🪉 Музыка: {u.music_left}\n"
+            f"• 🖼 Сүрөт: {u.image_left}\n"
+            f"• 🔊 Үн: {u.voice_left}\n"
+            f"• 📄 Документ: {u.doc_left}\n\n"
+            f"⏳ Мөөнөт: {until}"
+        )
+
+    used = (u.free_today_count or 0) if u.free_day_key == day_key_utc() else 0
+    text = (
+        f"🆓 FREE: бүгүн {max(0, FREE_DAILY_QUESTIONS - used)} / {FREE_DAILY_QUESTIONS} суроо калды.\n"
+    )
+    if u.blocked_until and u.blocked_until > utcnow():
+        text += f"⛔ Блок: дагы {minutes_left(u.blocked_until)} мүнөт.\n"
+    return text + "\n💎 Көбүрөөк керек болсо — «💎 Премиум» 😎"
+
+
+_ANSWERS: dict[str, Callable[[User], str]] = {
+    "limits": _limits_text,
+    "how_to_pay": lambda u: t("premium_how_to_pay"),
+    "pro": lambda u: t("premium_pro_about"),
+    "plus": lambda u: t("premium_plus_about"),
+    "plans": lambda u: t("premium_title"),
+    "vip_video": lambda u: t("vip_video_title"),
+    "vip_music": lambda u: t("vip_music_title"),
+    "faq": lambda u: t("support_faq"),
+    "about": lambda u: t("history_title"),
+}
+
+# сатуу интенттери — жоопко Премиум клавиатура
+SALES_INTENTS = frozenset({"how_to_pay", "pro", "plus", "plans", "vip_video", "vip_music"})
+
+
+def route_intent(text: str) -> Optional[str]:
+    return INTENTS.match(text)
+
+
+def intent_answer(intent: str, u: User) -> str:
+    return _ANSWERS[intent](u)
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from app.config import (
+    LLM_CONCURRENCY,
+    LLM_AGING_S,
+    LLM_QUEUE_MAX_WAIT_S,
+    LLM_SHED_ENABLED,
+    LLM_SHED_P95_TARGET_S,
+    LLM_SHED_WINDOW_S,
+    LLM_SHED_LEVEL1,
+    LLM_SHED_LEVEL2,
+    LLM_SHED_LEVEL3,
+    LLM_SHED_HOLD_S,
+)
+
+
+class LLMQueueTimeout(Exception):
+    """Кезекте LLM_QUEUE_MAX_WAIT_S'тен көп күттү."""
+
+
+# =========================================================
+# Priority queue + concurrency limit (Plan.priority)
+# =========================================================
+class LLMQueue:
+    """
+    LLM провайдерге бир убакта эң көп `concurrency` суроо барат; калгандары кезекте.
+
+    Бош слот чыкканда эң жогорку эффективдүү приоритет алат:
+        effective = priority + waited_s / aging_s
+    Баары бирдей темпте "карыгандыктан" тартип убакыттан көз каранды эмес —
+    heap ачкычы (enqueued_at - priority * aging_s). Башкача айтканда PRO FREE'ден
+    2 * aging_s секунд алдыда турат, бирок FREE ошончо күткөндөн кийин PRO'го жетет
+    (starvation жок).
+    """
+
+    def __init__(self, concurrency: int, aging_s: float, max_wait_s: Optional[float] = None):
+        self.concurrency = max(1, int(concurrency))
+        self.aging_s = max(0.001, float(aging_s))
+        self.max_wait_s = max_wait_s if max_wait_s and max_wait_s > 0 else None
+
+        self._active = 0
+        self._heap: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+        # metrics: priority -> [served, total_wait_s, max_wait_s]
+        self._waits: dict[int, list[float]] = {}
+        self.timeouts = 0
+
+    async def acquire(self, priority: int = 0) -> float:
+        """
+        Слот алат; канча күткөнүн (сек) кайтарат. Кийин release() милдеттүү.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        if self._active < self.concurrency and not self._heap:
+            self._active += 1
+            self._record(priority, 0.0)
+            return 0.0
+
+        fut: asyncio.Future = loop.create_future()
+        heapq.heappush(self._heap, (started - priority * self.aging_s, next(self._seq), fut))
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.max_wait_s)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # слот бизге берилип калган — кийинкиге өткөрөбүз
+                self.release()
+            else:
+                fut.cancel()  # heap'тен lazy өчөт
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise LLMQueueTimeout() from None
+            raise
+
+        waited = loop.time() - started
+        self._record(priority, waited)
+        return waited
+
+    def release(self) -> None:
+        while self._heap:
+            _, _, fut = heapq.heappop(self._heap)
+            if not fut.done():
+                fut.set_result(None)  # слот түз өткөрүлөт (_active өзгөрбөйт)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = 0) -> AsyncIterator[float]:
+        waited = await self.acquire(priority)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def _record(self, priority: int, waited: float) -> None:
+        row = self._waits.setdefault(priority, [0, 0.0, 0.0])
+        row[0] += 1
+        row[1] += waited
+        row[2] = max(row[2], waited)
+
+    def depth(self) -> int:
+        return sum(1 for _, _, fut in self._heap if not fut.done())
+
+    def inflight(self) -> int:
+        """Провайдерде + кезекте турган суроолор."""
+        return self._active + self.depth()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "depth": self.depth(),
+            "timeouts": self.timeouts,
+            "wait_by_priority": {
+                str(p): {
+                    "served": int(n),
+                    "avg_wait_s": round(total / n, 3) if n else 0.0,
+                    "max_wait_s": round(mx, 3),
+                }
+                for p, (n, total, mx) in sorted(self._waits.items())
+            },
+        }
+
+
+LLM_QUEUE = LLMQueue(
+    concurrency=LLM_CONCURRENCY,
+    aging_s=LLM_AGING_S,
+    max_wait_s=LLM_QUEUE_MAX_WAIT_S,
+)
+
+
+# =========================================================
+# Load shedding (admission control, FREE гана)
+# =========================================================
+SHED_NORMAL = 0
+SHED_FREE_SHORT = 1       # FREE: max_tokens кичине
+SHED_FREE_CACHE_ONLY = 2  # FREE: кэш / in-flight жооп гана
+SHED_FREE_REJECT = 3      # FREE: "кийинчерээк жаз"
+
+
+class LoadShedder:
+    """
+    pressure = max((active + depth) / concurrency, p95 / p95_target)
+    p95 — акыркы window_s ичиндеги "жоопко чейинки убакыт" (кезек + провайдер;
+    stream'де биринчи токенге чейин).
+
+    Деңгээл дароо көтөрүлөт, бирок төмөндөө hold_s туруктуу болгондо гана
+    (жана чектин 80%'нен төмөн) — flapping болбойт. Басым түшсө өзү калыбына келет.
+    """
+
+    def __init__(
+        self,
+        queue: LLMQueue,
+        enabled: bool,
+        p95_target_s: float,
+        window_s: float,
+        steps: tuple[float, float, float],
+        hold_s: float,
+    ):
+        self.queue = queue
+        self.enabled = enabled
+        self.p95_target_s = max(0.1, float(p95_target_s))
+        self.window_s = float(window_s)
+        self.steps = steps
+        self.hold_s = float(hold_s)
+
+        self._samples: deque[tuple[float, float]] = deque(maxlen=2000)
+        self._level = SHED_NORMAL
+        self._changed_at = 0.0
+        self.shed: dict[int, int] = {SHED_FREE_SHORT: 0, SHED_FREE_CACHE_ONLY: 0, SHED_FREE_REJECT: 0}
+
+    def observe(self, latency_s: float) -> None:
+        self._samples.append((time.monotonic(), float(latency_s)))
+
+    def p95(self) -> float:
+        cutoff = time.monotonic() - self.window_s
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        if not self._samples:
+            return 0.0
+        values = sorted(v for _, v in self._samples)
+        return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+    def pressure(self) -> float:
+        inflight = self.queue.inflight() / self.queue.concurrency
+        return max(inflight, self.p95() / self.p95_target_s)
+
+    def level(self) -> int:
+        if not self.enabled:
+            return SHED_NORMAL
+
+        pressure = self.pressure()
+        target = sum(1 for step in self.steps if pressure >= step)
+        now = time.monotonic()
+
+        if target > self._level:
+            self._level = target
+            self._changed_at = now
+        elif target < self._level and now - self._changed_at >= self.hold_s:
+            # бир кадам гана төмөн, жана чектен байкаларлык төмөн болсо
+            if pressure < self.steps[self._level - 1] * 0.8:
+                self._level -= 1
+                self._changed_at = now
+        return self._level
+
+    def count(self, level: int) -> None:
+        if level in self.shed:
+            self.shed[level] += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "level": self.level(),
+            "pressure": round(self.pressure(), 3),
+            "p95_s": round(self.p95(), 3),
+            "shed": {str(k): v for k, v in self.shed.items()},
+        }
+
+
+SHEDDER = LoadShedder(
+    queue=LLM_QUEUE,
+    enabled=LLM_SHED_ENABLED,
+    p95_target_s=LLM_SHED_P95_TARGET_S,
+    window_s=LLM_SHED_WINDOW_S,
+    steps=(LLM_SHED_LEVEL1, LLM_SHED_LEVEL2, LLM_SHED_LEVEL3),
+    hold_s=LLM_SHED_HOLD_S,
+)
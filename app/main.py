@@ -13,19 +13,34 @@ from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
-from sqlalchemy import select
+from sqlalchemy import select, update, text, case
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.config import BOT_TOKEN
-from app.db import ENGINE, SessionLocal
-from app.models import Base, User, Invoice
-from app.middleware import ChannelGateMiddleware
+from app.config import BOT_TOKEN, SCHEDULER_SWEEP_S, LAST_ACTION_FLUSH_S, LEADER_CHECK_S
+from app.db import ENGINE, SessionLocal, upsert_user, LEADER
+from app.models import Base, User, Invoice, next_due_at_sql
+from app.middleware import (
+    DbSessionMiddleware,
+    ChannelGateMiddleware,
+    MEMBERSHIP_CACHE,
+    on_channel_member_update,
+    flush_last_actions,
+)
+from app.cache import USER_CACHE, remember_user, invalidate_user
 from app.handlers.menu_router import get_router
 
 from app.services.cryptomus import verify_webhook
-from app.scheduler import ensure_resets
+from app.services.grok import RESPONSE_CACHE, GATEWAY, INFLIGHT
+from app.services.http_clients import HTTP
+from app.scheduler import ensure_resets, DUE_TIMERS
+from app.broadcast import BROADCASTS
+from app.llm_queue import LLM_QUEUE, SHEDDER
+from app.memory import memory_stats
+from app.usage import USAGE
+from app.intents import INTENTS
+from app.stats import STATS_CACHE, sync_rollup
 from app.utils import utcnow, in_30_days
-from app.constants import PLANS, REF_BONUS_USD, REF_FREE_PLUS_DAYS, REF_FREE_PLUS_MIN_PAID_USD
+from app.constants import PLANS, PAID_PLANS, REF_BONUS_USD, REF_FREE_PLUS_DAYS, REF_FREE_PLUS_MIN_PAID_USD
 
 
 # =========================================================
@@ -49,6 +64,31 @@ async def health():
     return {"ok": True, "service": "tilek_ai", "ts": utcnow().isoformat()}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    In-process кэштердин hit/miss санагычтары (TTL тууралоо үчүн).
+    """
+    return {
+        "ts": utcnow().isoformat(),
+        "user_cache": USER_CACHE.stats(),
+        "membership_cache": MEMBERSHIP_CACHE.stats(),
+        "admin_stats_cache": STATS_CACHE.stats(),
+        "llm_response_cache": RESPONSE_CACHE.stats(),
+        "llm_singleflight": INFLIGHT.stats(),
+        "llm_queue": LLM_QUEUE.stats(),
+        "llm_shedding": SHEDDER.stats(),
+        "llm_gateway": GATEWAY.stats(),
+        "chat_memory": memory_stats(),
+        "token_usage": USAGE.stats(),
+        "intent_router": INTENTS.stats(),
+        "http_clients": HTTP.stats(),
+        "due_timers": DUE_TIMERS.stats(),
+        "leader": LEADER.is_leader,
+        "broadcast": BROADCASTS.stats(),
+    }
+
+
 # =========================================================
 # Aiogram bot + dispatcher
 # =========================================================
@@ -58,19 +98,43 @@ bot = Bot(
 )
 
 dp = Dispatcher()
+dp.update.outer_middleware(DbSessionMiddleware())  # 1 update = 1 session/commit
 dp.message.middleware(ChannelGateMiddleware())
 dp.callback_query.middleware(ChannelGateMiddleware())
+dp.chat_member.register(on_channel_member_update)  # бот каналда админ болсо келет
 dp.include_router(get_router())
 
 
 # Background task handles
 _polling_task: Optional[asyncio.Task] = None
 _cron_task: Optional[asyncio.Task] = None
+_timer_task: Optional[asyncio.Task] = None
+_leader_task: Optional[asyncio.Task] = None
+_broadcast_task: Optional[asyncio.Task] = None
 
 
 # =========================================================
 # DB init
 # =========================================================
+# create_all бар таблицага колонка кошпойт — Alembic'ке чейин идемпотенттүү DDL
+_SCHEMA_PATCHES = (
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS next_due_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS ix_users_next_due_at ON users (next_due_at) WHERE next_due_at IS NOT NULL",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS tokens_left INTEGER",
+    "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS segment TEXT",
+    "ALTER TABLE token_usage ADD COLUMN IF NOT EXISTS cached_tokens INTEGER NOT NULL DEFAULT 0",
+    # admin издөө: lower(username) = / LIKE 'x%' (text_pattern_ops)
+    "CREATE INDEX IF NOT EXISTS ix_users_username_lc ON users (lower(username) text_pattern_ops)",
+)
+
+# Extension укугу жок болушу мүмкүн — ар бири өз transaction'унда, катасы fatal эмес
+_OPTIONAL_SCHEMA_PATCHES = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # fuzzy издөө: % жана ORDER BY <-> (GiST KNN)
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gist (lower(username) gist_trgm_ops)",
+)
+
+
 async def _db_init():
     """
     Create tables if they don't exist.
@@ -79,41 +143,125 @@ async def _db_init():
     log.info("DB init: creating tables (if not exist)...")
     async with ENGINE.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        for ddl in _SCHEMA_PATCHES:
+            await conn.execute(text(ddl))
+
+        await sync_rollup(conn)
+
+        # tokens_left backfill: колонка жаңы кошулса — учурдагы план бюджети толук берилет
+        await conn.execute(
+            update(User)
+            .where(User.tokens_left.is_(None))
+            .values(tokens_left=case(
+                {code: PLANS[code].monthly_tokens for code in PAID_PLANS},
+                value=User.plan,
+                else_=0,
+            ))
+        )
+
+        # next_due_at backfill (эски user'лер / колонка жаңы кошулса)
+        due = next_due_at_sql()
+        await conn.execute(
+            update(User)
+            .where(User.next_due_at.is_(None), due.is_not(None))
+            .values(next_due_at=due)
+        )
+
+    for ddl in _OPTIONAL_SCHEMA_PATCHES:
+        try:
+            async with ENGINE.begin() as conn:
+                await conn.execute(text(ddl))
+        except SQLAlchemyError as e:
+            log.warning("DB init: optional patch skipped (%s): %s", ddl.split(" ON ")[0], e)
     log.info("DB init: done ✅")
 
 
 # =========================================================
 # Cron loop (scheduler)
 # =========================================================
+async def _notify(tg_id: int, text: str) -> None:
+    try:
+        await bot.send_message(tg_id, text)
+    except Exception:
+        # колдонуучу ботту блоктосо ж.б — унчукпай өткөрөбүз
+        pass
+
+
+async def _leader_loop():
+    """
+    Advisory lock'ту кармап/текшерип турат.
+    Leader өлсө — LEADER_CHECK_S ичинде башка replica алат.
+    """
+    while True:
+        was_leader = LEADER.is_leader
+        try:
+            await LEADER.ensure()
+        except Exception as e:
+            log.warning("Leader check error: %s", e)
+        if LEADER.is_leader != was_leader:
+            log.info("Leader: %s", "acquired 👑" if LEADER.is_leader else "lost")
+            if LEADER.is_leader:
+                BROADCASTS.wake()  # мурунку leader'дин бүтпөгөн job'у болсо улантат
+                # бүт DB'дагы deadline'дарды leader гана кармайт
+                try:
+                    n = await DUE_TIMERS.load()
+                    log.info("Due timers loaded: %s ✅", n)
+                except Exception as e:
+                    log.warning("Due timers load error: %s", e)
+            else:
+                # башка user'лердин deadline'дары жаңы leader'де — heap'ти бошотобуз
+                DUE_TIMERS.clear()
+        await asyncio.sleep(LEADER_CHECK_S)
+
+
+async def _timer_loop():
+    """
+    Exact-time unblock / expiry / refill: DUE_TIMERS heap'и боюнча уктайт.
+    Leader'де — бүт deadline'дар, ensure_resets бүт кластер боюнча.
+    Башка replica'ларда — ушул процессте commit болгон жазуулар гана, жана ensure_resets
+    ошол tg_id'лер менен чектелет (калганын leader алат).
+    ensure_resets UPDATE ... RETURNING болгондуктан бир user эки жолу notify албайт.
+    """
+    await DUE_TIMERS.run(notify=_notify)
+
+
 async def _cron_loop():
     """
-    Every 60 seconds:
-    - free daily reset
-    - unblock users
-    - monthly refill
-    Optionally: notify users (ex: plan expired, unblocked, etc.)
+    Every LAST_ACTION_FLUSH_S (ар бир replica — pending ошол процесстин эс тутумунда):
+    - flush last_action_at (flood control, bulk UPDATE)
+    - flush token usage (token_usage upsert + users.tokens_left, batch)
+    Every SCHEDULER_SWEEP_S, leader гана (safety net — негизги иш _timer_loop'то):
+    - ensure_resets (unblock / expiry / monthly refill) — калып калгандар үчүн
+    - DUE_TIMERS.load() — horizon'го жаңы кирген deadline'дар
     """
     log.info("Cron loop started ✅")
 
-    async def notify(tg_id: int, text: str) -> None:
-        try:
-            await bot.send_message(tg_id, text)
-        except Exception:
-            # колдонуучу ботту блоктосо ж.б — унчукпай өткөрөбүз
-            pass
+    loop = asyncio.get_running_loop()
+    next_sweep = loop.time() + SCHEDULER_SWEEP_S
 
     while True:
+        await asyncio.sleep(LAST_ACTION_FLUSH_S)
+
+        # flood control'дун last_action_at'ын bulk жазабыз
         try:
-            # Сенин scheduler.py notify параметрин кабыл алса — эң жакшы
-            # Эгер кабыл албаса да, төмөнкүдөй try/except бузбайт.
-            await ensure_resets(notify=notify)  # type: ignore
-        except TypeError:
-            # ensure_resets(notify=...) жок болсо — fallback
-            await ensure_resets()
+            await flush_last_actions()
         except Exception as e:
-            log.warning("Cron loop error: %s", e)
+            log.warning("last_action flush error: %s", e)
+
+        try:
+            await USAGE.flush()
+        except Exception as e:
+            log.warning("token usage flush error: %s", e)
+
+        if loop.time() < next_sweep or not LEADER.is_leader:
+            continue
+        next_sweep = loop.time() + SCHEDULER_SWEEP_S
 
-        await asyncio.sleep(60)
+        try:
+            await ensure_resets(notify=_notify)
+            await DUE_TIMERS.load()
+        except Exception as e:
+            log.warning("Cron loop error: %s", e)
 
 
 # =========================================================
@@ -140,8 +288,13 @@ async def _polling_loop():
 @app.on_event("startup")
 async def on_startup():
     await _db_init()
+    # провайдерлердин узак жашаган HTTP pool'дору (keep-alive, DNS cache)
+    await HTTP.start()
 
-    global _polling_task, _cron_task
+    global _polling_task, _cron_task, _timer_task, _leader_task, _broadcast_task
+    _leader_task = asyncio.create_task(_leader_loop(), name="tilek_leader_loop")
+    _broadcast_task = asyncio.create_task(BROADCASTS.run(bot), name="tilek_broadcast_loop")
+    _timer_task = asyncio.create_task(_timer_loop(), name="tilek_timer_loop")
     _cron_task = asyncio.create_task(_cron_loop(), name="tilek_cron_loop")
     _polling_task = asyncio.create_task(_polling_loop(), name="tilek_polling_loop")
 
@@ -150,7 +303,7 @@ async def on_startup():
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    global _polling_task, _cron_task
+    global _polling_task, _cron_task, _timer_task, _leader_task, _broadcast_task
 
     # stop polling
     if _polling_task:
@@ -158,15 +311,28 @@ async def on_shutdown():
         with suppress(asyncio.CancelledError):
             await _polling_task
 
-    # stop cron
-    if _cron_task:
-        _cron_task.cancel()
-        with suppress(asyncio.CancelledError):
-            await _cron_task
+    # stop cron + timers + broadcast + leader
+    for task in (_cron_task, _timer_task, _broadcast_task, _leader_task):
+        if task:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
 
-    # close bot session
+    # pending last_action_at / token usage жоголбосун
+    with suppress(Exception):
+        await flush_last_actions()
+    with suppress(Exception):
+        await USAGE.flush()
+
+    # lock'ту дароо бошотобуз — башка replica күтпөй эле leader болот
+    with suppress(Exception):
+        await LEADER.release()
+
+    # close bot session + provider HTTP pools
     with suppress(Exception):
         await bot.session.close()
+    with suppress(Exception):
+        await HTTP.close()
 
     # dispose engine
     with suppress(Exception):
@@ -202,6 +368,7 @@ async def _ref_reward(session, buyer: User, paid_amount: float):
 
         if (ref_user.chat_left or 0) <= 0 and (ref_user.video_left or 0) <= 0:
             ref_user.chat_left = p.monthly_chat
+            ref_user.tokens_left = p.monthly_tokens
             ref_user.video_left = p.monthly_video
             ref_user.music_left = p.monthly_music
             ref_user.image_left = p.monthly_image
@@ -262,12 +429,7 @@ async def cryptomus_webhook(req: Request):
             inv.paid_at = utcnow()
 
             # Load user
-            u_res = await s.execute(select(User).where(User.tg_id == inv.tg_id))
-            u = u_res.scalar_one_or_none()
-            if not u:
-                u = User(tg_id=inv.tg_id)
-                s.add(u)
-                await s.flush()
+            u = await upsert_user(s, inv.tg_id)
 
             # Apply purchase
             if inv.kind == "PLAN_PLUS":
@@ -275,6 +437,7 @@ async def cryptomus_webhook(req: Request):
                 u.plan = "PLUS"
                 u.plan_until = in_30_days()
                 u.chat_left = p.monthly_chat
+                u.tokens_left = p.monthly_tokens
                 u.video_left = p.monthly_video
                 u.music_left = p.monthly_music
                 u.image_left = p.monthly_image
@@ -293,6 +456,7 @@ async def cryptomus_webhook(req: Request):
                 u.plan = "PRO"
                 u.plan_until = in_30_days()
                 u.chat_left = p.monthly_chat
+                u.tokens_left = p.monthly_tokens
                 u.video_left = p.monthly_video
                 u.music_left = p.monthly_music
                 u.image_left = p.monthly_image
@@ -326,6 +490,11 @@ async def cryptomus_webhook(req: Request):
 
             await s.commit()
 
+            # middleware кэши эски план/лимитти көрсөтпөсүн
+            remember_user(u)
+            if u.referrer_tg_id:
+                invalidate_user(u.referrer_tg_id)
+
     except SQLAlchemyError as e:
         log.exception("DB error in webhook: %s", e)
         # 200 => Cryptomus кайра-кайра жиберип тынчтыкты албайт
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import json
+import logging
+import zlib
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import (
+    MEMORY_MAX_TURNS,
+    MEMORY_KEEP_TURNS,
+    MEMORY_TURN_MAX_CHARS,
+    MEMORY_SUMMARY_MAX_CHARS,
+    MEMORY_IDLE_RESET_S,
+)
+from app.constants import PLANS
+from app.db import SessionLocal
+from app.models import ChatMemory
+from app.services.grok import grok_summarize
+from app.utils import utcnow, estimate_tokens
+
+
+log = logging.getLogger("tilek_ai.memory")
+
+Turn = list[str]  # [user_text, assistant_text]
+
+
+# =========================================================
+# Compact storage
+# =========================================================
+def _pack(turns: list[Turn]) -> bytes:
+    raw = json.dumps(turns, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def _unpack(blob: Optional[bytes]) -> list[Turn]:
+    if not blob:
+        return []
+    try:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+    except (zlib.error, ValueError):
+        return []
+
+
+def _is_idle(mem: ChatMemory) -> bool:
+    updated = mem.updated_at
+    if updated is None:
+        return True
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=dt.timezone.utc)
+    return (utcnow() - updated).total_seconds() > MEMORY_IDLE_RESET_S
+
+
+def memory_budget(plan: str) -> int:
+    p = PLANS.get(plan or "FREE")
+    return p.memory_tokens if p else 0
+
+
+# =========================================================
+# Read: prompt'ко кошулчу history
+# =========================================================
+async def load_memory(session: AsyncSession, tg_id: int) -> Optional[ChatMemory]:
+    return await session.get(ChatMemory, tg_id)
+
+
+def history_messages(mem: Optional[ChatMemory], budget_tokens: int) -> list[dict]:
+    """
+    summary (болсо) + эң жаңы turn'дер, budget_tokens'ке батканча.
+    Узак тыныгуудан кийин (MEMORY_IDLE_RESET_S) — бош: жаңы сүйлөшүү.
+    """
+    if mem is None or budget_tokens <= 0 or _is_idle(mem):
+        return []
+
+    used = 0
+    head: list[dict] = []
+    if mem.summary:
+        content = "Мурунку сүйлөшүүнүн кыскача мазмуну:\n" + mem.summary
+        cost = estimate_tokens(content)
+        if cost <= budget_tokens:
+            head.append({"role": "system", "content": content})
+            used += cost
+
+    tail: list[dict] = []
+    for user_text, answer in reversed(_unpack(mem.turns)):
+        cost = estimate_tokens(user_text) + estimate_tokens(answer)
+        if used + cost > budget_tokens:
+            break
+        used += cost
+        tail[:0] = [
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": answer},
+        ]
+
+    return head + tail
+
+
+# =========================================================
+# Write: жаңы turn (update'тин session'унда, middleware commit кылат)
+# =========================================================
+async def remember_turn(
+    session: AsyncSession,
+    mem: Optional[ChatMemory],
+    tg_id: int,
+    prompt: str,
+    answer: str,
+) -> None:
+    if mem is None:
+        # биринчи эки билдирүү параллель келсе — экинчиси PK IntegrityError'дон
+        # бүт update'ти (кармалган лимит менен) rollback кылбасын
+        await session.execute(
+            pg_insert(ChatMemory)
+            .values(tg_id=tg_id, turn_count=0, updated_at=utcnow())
+            .on_conflict_do_nothing(index_elements=[ChatMemory.tg_id])
+        )
+        mem = await session.get(ChatMemory, tg_id, with_for_update=True, populate_existing=True)
+    else:
+        # LLM учурунда фондо summary жазылып калышы мүмкүн — эски көчүрмөнү үстүнө жазбайбыз
+        await session.refresh(mem, with_for_update=True)
+
+    if _is_idle(mem):
+        mem.summary = None
+        turns: list[Turn] = []
+    else:
+        turns = _unpack(mem.turns)
+
+    turns.append([prompt[:MEMORY_TURN_MAX_CHARS], answer[:MEMORY_TURN_MAX_CHARS]])
+    # summary иштебей калса да өлчөм чексиз өспөсүн
+    turns = turns[-2 * MEMORY_MAX_TURNS:]
+
+    mem.turns = _pack(turns)
+    mem.turn_count = len(turns)
+    mem.updated_at = utcnow()
+
+    if len(turns) > MEMORY_MAX_TURNS:
+        _schedule_summary(tg_id)
+
+
+# =========================================================
+# Background summary
+# =========================================================
+_INFLIGHT: dict[int, asyncio.Task] = {}
+
+
+def _schedule_summary(tg_id: int) -> None:
+    if tg_id in _INFLIGHT:
+        return
+    task = asyncio.create_task(_summarize(tg_id))
+    _INFLIGHT[tg_id] = task
+    task.add_done_callback(lambda _t: _INFLIGHT.pop(tg_id, None))
+
+
+async def _summarize(tg_id: int) -> None:
+    # handler'дин commit'и бүтсүн (акыркы turn DB'га түшсүн)
+    await asyncio.sleep(1.0)
+
+    try:
+        async with SessionLocal() as s:
+            mem = await s.get(ChatMemory, tg_id)
+            if mem is None:
+                return
+            turns = _unpack(mem.turns)
+            old_summary = mem.summary
+
+        if len(turns) <= MEMORY_KEEP_TURNS:
+            return
+        old = turns[:-MEMORY_KEEP_TURNS]
+
+        summary = await grok_summarize(old_summary, old, tg_id=tg_id)
+        if not summary:
+            return
+
+        async with SessionLocal() as s:
+            mem = await s.get(ChatMemory, tg_id, with_for_update=True)
+            if mem is None:
+                return
+            current = _unpack(mem.turns)
+            if current[:len(old)] != old:
+                # ортодо сүйлөшүү reset болду — бул summary эскирди
+                return
+            rest = current[len(old):]
+            mem.summary = summary[:MEMORY_SUMMARY_MAX_CHARS]
+            mem.turns = _pack(rest)
+            mem.turn_count = len(rest)
+            await s.commit()
+    except Exception as e:
+        log.warning("Memory summary error (tg_id=%s): %s", tg_id, e)
+
+
+def memory_stats() -> dict:
+    return {"summaries_inflight": len(_INFLIGHT)}
@@ -1,18 +1,30 @@
 from __future__ import annotations
 
 import datetime as dt
+import time
+from collections import OrderedDict
 from contextlib import suppress
+from typing import Optional
 
 from aiogram import BaseMiddleware
-from aiogram.types import Message, CallbackQuery, TelegramObject
+from aiogram.types import Message, CallbackQuery, TelegramObject, Chat, ChatMemberUpdated
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.enums import ChatMemberStatus
 
-from sqlalchemy import select
-
-from app.config import REQUIRED_CHANNEL, CHANNEL_URL
-from app.db import SessionLocal
+from sqlalchemy import update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import (
+    REQUIRED_CHANNEL,
+    CHANNEL_URL,
+    MEMBERSHIP_CACHE_MAX,
+    MEMBERSHIP_TTL_OK_S,
+    MEMBERSHIP_TTL_NO_S,
+)
+from app.db import SessionLocal, get_current_user, commit_uow
 from app.models import User
+from app.constants import FREE_COOLDOWN_SECONDS, FLOOD_BURST, FLOOD_MAX_TRACKED
+from app.cache import TTLCache, get_user_snapshot, remember_user, snapshot_of
 from app.utils import utcnow
 
 
@@ -24,21 +36,196 @@ def _is_channel_id(val: str) -> bool:
     return val.strip().lstrip("-").isdigit()
 
 
+def _channel_chat() -> int | str:
+    return (
+        int(REQUIRED_CHANNEL)
+        if _is_channel_id(REQUIRED_CHANNEL)
+        else REQUIRED_CHANNEL
+    )
+
+
+def _is_required_channel(chat: Chat) -> bool:
+    if _is_channel_id(REQUIRED_CHANNEL):
+        return chat.id == int(REQUIRED_CHANNEL)
+    want = REQUIRED_CHANNEL.strip().lstrip("@").lower()
+    return bool(chat.username) and chat.username.lower() == want
+
+
+# ==========================================
+# Channel membership cache
+# ==========================================
+
+_MEMBER_STATUSES = (
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.ADMINISTRATOR,
+    ChatMemberStatus.CREATOR,
+)
+
+# user_id -> True (катталган) / False (катталган эмес)
+MEMBERSHIP_CACHE: TTLCache[int, bool] = TTLCache(
+    maxsize=MEMBERSHIP_CACHE_MAX,
+    ttl_s=MEMBERSHIP_TTL_OK_S,
+)
+
+
+def remember_membership(user_id: int, subscribed: bool) -> None:
+    ttl = MEMBERSHIP_TTL_OK_S if subscribed else MEMBERSHIP_TTL_NO_S
+    MEMBERSHIP_CACHE.set(user_id, subscribed, ttl_s=ttl)
+
+
+async def is_subscribed(bot, user_id: int) -> Optional[bool]:
+    """
+    True/False — так жыйынтык (кэшке түшөт).
+    None — канал туура эмес же API ката (кэшке түшпөйт, gate өткөрөт).
+    """
+    cached = MEMBERSHIP_CACHE.get(user_id)
+    if cached is not None:
+        return cached
+
+    try:
+        member = await bot.get_chat_member(chat_id=_channel_chat(), user_id=user_id)
+        subscribed = member.status in _MEMBER_STATUSES
+    except TelegramBadRequest:
+        subscribed = False
+    except Exception:
+        return None
+
+    remember_membership(user_id, subscribed)
+    return subscribed
+
+
+async def on_channel_member_update(update: ChatMemberUpdated) -> None:
+    """
+    Бот каналда админ болсо Telegram chat_member update жиберет —
+    кэшти дароо жаңылайбыз (get_chat_member'ге барбай калабыз).
+    """
+    if not REQUIRED_CHANNEL or not _is_required_channel(update.chat):
+        return
+    member = update.new_chat_member
+    remember_membership(member.user.id, member.status in _MEMBER_STATUSES)
+
+
+# ==========================================
+# Flood control (token bucket)
+# ==========================================
+
+class FloodControl:
+    """
+    Ар user'ге token bucket:
+    - сыйымдуулук: FLOOD_BURST билдирүү
+    - толуу ылдамдыгы: 1 токен / FREE_COOLDOWN_SECONDS
+    Bucket'тер LRU менен чектелген (FLOOD_MAX_TRACKED).
+
+    last_action_at DB'га ар update сайын жазылбайт: pending'де чогулуп,
+    flush_last_actions() менен бир bulk UPDATE болуп кетет.
+    """
+
+    def __init__(self, rate_per_s: float, burst: int, maxsize: int):
+        self.rate_per_s = float(rate_per_s)
+        self.burst = float(max(1, burst))
+        self.maxsize = max(1, int(maxsize))
+        # user_id -> (tokens, last_refill_monotonic)
+        self._buckets: OrderedDict[int, tuple[float, float]] = OrderedDict()
+        # user_id -> last allowed action (UTC), DB'га flush күтүп турат
+        self._pending: dict[int, dt.datetime] = {}
+
+    def allow(self, user_id: int) -> bool:
+        now = time.monotonic()
+        tokens, last = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate_per_s)
+
+        ok = tokens >= 1.0
+        if ok:
+            tokens -= 1.0
+            self._pending[user_id] = utcnow()
+
+        self._buckets[user_id] = (tokens, now)
+        self._buckets.move_to_end(user_id)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return ok
+
+    def drain_pending(self) -> dict[int, dt.datetime]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+
+FLOOD = FloodControl(
+    rate_per_s=1.0 / max(1, FREE_COOLDOWN_SECONDS),
+    burst=FLOOD_BURST,
+    maxsize=FLOOD_MAX_TRACKED,
+)
+
+
+async def flush_last_actions() -> int:
+    """
+    last_action_at'ты bulk UPDATE менен сактайт (cron loop чакырат).
+    Returns: канча user жазылды.
+    """
+    pending = FLOOD.drain_pending()
+    if not pending:
+        return 0
+
+    stmt = (
+        update(User)
+        .where(User.tg_id == bindparam("b_tg_id"))
+        .values(last_action_at=bindparam("b_at"))
+        .execution_options(synchronize_session=False)
+    )
+    rows = [{"b_tg_id": tg_id, "b_at": at} for tg_id, at in pending.items()]
+
+    async with SessionLocal() as s:
+        await s.execute(stmt, rows)
+        await s.commit()
+    return len(rows)
+
+
+# ==========================================
+# Unit of work: 1 update = 1 session = 1 commit
+# ==========================================
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    dp.update outer middleware.
+
+    - ар update'ке бир AsyncSession ачат → data["session"]
+    - handler бүткөндө бир жолу commit (ката болсо rollback)
+    - commit'тен кийин session'догу User'лер кэшке жазылат
+      (handler'лер кэшти өзүнчө жаңылабайт)
+    """
+
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        async with SessionLocal() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+                await commit_uow(session)
+            except Exception:
+                await session.rollback()
+                raise
+
+            for obj in list(session.identity_map.values()):
+                if isinstance(obj, User):
+                    remember_user(obj)
+
+            return result
+
+
 # ==========================================
 # MAIN MIDDLEWARE
 # ==========================================
 
 class ChannelGateMiddleware(BaseMiddleware):
     """
-    Бул middleware 4 функция аткарат:
+    Бул middleware 4 функция аткарат (user TTL кэштен окулат, data["db_user"]):
 
     1) Каналга катталуу текшерүү
     2) FREE блок текшерүү (blocked_until)
     3) План мөөнөтү бүткөнүн текшерүү
-    4) Flood control (спам токтотуу)
+    4) Flood control (token bucket, эс тутумда — DB'га жазбайт)
     """
 
-    async def call(self, handler, event: TelegramObject, data: dict):
+    async def __call__(self, handler, event: TelegramObject, data: dict):
 
         bot = data.get("bot")
         user_obj = data.get("event_from_user")
@@ -49,20 +236,10 @@ class ChannelGateMiddleware(BaseMiddleware):
         user_id = user_obj.id
 
         # ====================================================
-        # 1️⃣ DATABASE USER LOAD / CREATE
+        # 1️⃣ USER SNAPSHOT (TTL кэш → керек болсо DB load / create)
         # ====================================================
-        async with SessionLocal() as s:
-            res = await s.execute(select(User).where(User.tg_id == user_id))
-            user = res.scalar_one_or_none()
-
-            if not user:
-                user = User(
-                    tg_id=user_id,
-                    username=user_obj.username
-                )
-                s.add(user)
-                await s.commit()
-                await s.refresh(user)
+        session: AsyncSession = data["session"]  # DbSessionMiddleware (dp.update) берет
+        user = await get_user_snapshot(user_id, user_obj.username, session=session)
 
         data["db_user"] = user  # башка handler'лер колдонсун
 
@@ -71,19 +248,19 @@ class ChannelGateMiddleware(BaseMiddleware):
         # ====================================================
         if user.plan != "FREE" and user.plan_until:
             if utcnow() > user.plan_until:
-                async with SessionLocal() as s:
-                    res = await s.execute(select(User).where(User.tg_id == user_id))
-                    u = res.scalar_one_or_none()
-                    if u:
-                        u.plan = "FREE"
-                        u.plan_until = None
-                        u.chat_left = 0
-                        u.video_left = 0
-                        u.music_left = 0
-                        u.image_left = 0
-                        u.voice_left = 0
-                        u.doc_left = 0
-                        await s.commit()
+                # update'тин session'унда өзгөртөбүз — commit DbSessionMiddleware'де
+                u = await get_current_user(session, user_id, user_obj.username)
+                u.plan = "FREE"
+                u.plan_until = None
+                u.chat_left = 0
+                u.tokens_left = 0
+                u.video_left = 0
+                u.music_left = 0
+                u.image_left = 0
+                u.voice_left = 0
+                u.doc_left = 0
+                user = snapshot_of(u)
+                data["db_user"] = user
 
                 with suppress(Exception):
                     await bot.send_message(
@@ -119,23 +296,10 @@ class ChannelGateMiddleware(BaseMiddleware):
         # ====================================================
         if REQUIRED_CHANNEL:
 
-            try:
-                chat = (
-                    int(REQUIRED_CHANNEL)
-                    if _is_channel_id(REQUIRED_CHANNEL)
-                    else REQUIRED_CHANNEL
-                )
+            subscribed = await is_subscribed(bot, user_id)
 
-                member = await bot.get_chat_member(chat_id=chat, user_id=user_id)
-
-                if member.status not in (
-                    ChatMemberStatus.MEMBER,
-                    ChatMemberStatus.ADMINISTRATOR,
-                    ChatMemberStatus.OWNER
-                ):
-                    raise TelegramBadRequest("Not subscribed")
-
-            except TelegramBadRequest:
+            # None => канал туура эмес / API жеткиликсиз: бот токтобошу керек
+            if subscribed is False:
 
                 text = (
                     "🚪 Досум, биринчи каналга каттал!\n\n"
@@ -151,29 +315,13 @@ class ChannelGateMiddleware(BaseMiddleware):
 
                 return
 
-            except Exception:
-                # канал туура эмес болсо бот токтобошу керек
-                pass
-
         # ====================================================
-        # 5️⃣ FLOOD PROTECTION (simple anti spam)
+        # 5️⃣ FLOOD PROTECTION (token bucket, эс тутумда)
         # ====================================================
-        now = utcnow()
-
-        if hasattr(user, "last_action_at") and user.last_action_at:
-            delta = (now - user.last_action_at).total_seconds()
-            if delta < 1:  # 1 секунда ичинде көп жазса
-                if isinstance(event, Message):
-                    await event.answer("⏱ Жайыраак досум 😅")
-                return
-
-        # save last action
-        async with SessionLocal() as s:
-            res = await s.execute(select(User).where(User.tg_id == user_id))
-            u = res.scalar_one_or_none()
-            if u:
-                u.last_action_at = now
-                await s.commit()
+        if not FLOOD.allow(user_id):
+            if isinstance(event, Message):
+                await event.answer("⏱ Жайыраак досум 😅")
+            return
 
         # ====================================================
         # OK → allow дальше
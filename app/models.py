@@ -10,11 +10,18 @@ from sqlalchemy import (
     Float,
     Text,
     Boolean,
+    LargeBinary,
     Index,
     UniqueConstraint,
+    case,
+    event,
+    func,
+    text,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+from app.constants import PAID_PLANS, MONTHLY_REFILL_DAYS
+
 
 # =========================
 # Base
@@ -50,6 +57,8 @@ class User(Base):
 
     # monthly limits (remaining)
     chat_left: Mapped[int] = mapped_column(Integer, default=0)
+    # LLM токен бюджети (PLUS/PRO); NULL = эски сап, _db_init толтурат
+    tokens_left: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, default=0)
     video_left: Mapped[int] = mapped_column(Integer, default=0)
     music_left: Mapped[int] = mapped_column(Integer, default=0)
     image_left: Mapped[int] = mapped_column(Integer, default=0)
@@ -83,15 +92,67 @@ class User(Base):
 
     last_action_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
 
+    # scheduler: эң жакын иш убактысы = min(blocked_until, plan_until, next refill).
+    # Денормализацияланган; ORM жазуулар үчүн төмөнкү event'тер жаңылайт,
+    # bulk UPDATE'тер next_due_at_sql() колдонот.
+    next_due_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
     created_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
     updated_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
 
     __table_args__ = (
         Index("ix_users_plan", "plan"),
         Index("ix_users_country_code", "country_code"),
+        # partial: FREE + блоксуз user'лер (көпчүлүк) индекске кирбейт
+        Index(
+            "ix_users_next_due_at",
+            "next_due_at",
+            postgresql_where=text("next_due_at IS NOT NULL"),
+        ),
+    )
+
+
+# =========================
+# User.next_due_at
+# =========================
+MONTHLY_PERIOD = dt.timedelta(days=MONTHLY_REFILL_DAYS)
+
+
+def compute_next_due_at(u: User) -> Optional[dt.datetime]:
+    """
+    Python версиясы (ORM flush үчүн). next_due_at_sql() менен бирдей эреже:
+    - blocked_until
+    - PLUS/PRO: plan_until жана last_monthly_reset + 30 күн (anchor жок болсо — азыр)
+    """
+    due: list[dt.datetime] = []
+    if u.blocked_until:
+        due.append(u.blocked_until)
+    if u.plan in PAID_PLANS:
+        if u.plan_until:
+            due.append(u.plan_until)
+        due.append(u.last_monthly_reset + MONTHLY_PERIOD if u.last_monthly_reset else utcnow())
+    return min(due) if due else None
+
+
+def next_due_at_sql():
+    """
+    SQL версиясы (bulk UPDATE ... SET next_due_at = ...).
+    Postgres'те LEAST() NULL'дорду этибарга албайт.
+    """
+    paid = User.plan.in_(PAID_PLANS)
+    return func.least(
+        User.blocked_until,
+        case((paid, User.plan_until), else_=None),
+        case((paid, func.coalesce(User.last_monthly_reset + MONTHLY_PERIOD, func.now())), else_=None),
     )
 
 
+@event.listens_for(User, "before_insert")
+@event.listens_for(User, "before_update")
+def _sync_next_due_at(mapper, connection, target: User) -> None:
+    target.next_due_at = compute_next_due_at(target)
+
+
 # =========================
 # Invoice (Payments)
 # =========================
@@ -133,6 +194,104 @@ class Invoice(Base):
     )
 
 
+# =========================
+# Broadcast jobs
+# =========================
+class BroadcastJob(Base):
+    """
+    status:
+      - queued / running / paused
+      - cancelled / done
+    cursor_tg_id: users.tg_id боюнча keyset — ушул tg_id'ге чейин иштетилди
+    (restart/failover болсо ушул жерден улантат).
+    """
+
+    __tablename__ = "broadcast_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    admin_tg_id: Mapped[int] = mapped_column(Integer, index=True)
+    message_text: Mapped[str] = mapped_column(Text)
+    segment: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # Segment.to_json(); NULL = баары
+
+    status: Mapped[str] = mapped_column(String(16), default="queued")
+    cursor_tg_id: Mapped[int] = mapped_column(Integer, default=0)
+
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    sent: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+
+    # админдин progress билдирүүсү (edit кылынат)
+    progress_chat_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    progress_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
+    updated_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
+    finished_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_broadcast_jobs_status", "status"),
+    )
+
+
+# =========================
+# Chat memory (1 user = 1 сап)
+# =========================
+class ChatMemory(Base):
+    """
+    turns: zlib(JSON [[user, assistant], ...]) — акыркы MEMORY_MAX_TURNS чейин.
+    Эскилери фондо summary'ге жыйналат (app/memory.py) — сап өлчөмү туруктуу.
+    """
+
+    __tablename__ = "chat_memory"
+
+    tg_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    turns: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    turn_count: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
+
+
+# =========================
+# Token usage (күнүнө user x model боюнча 1 сап)
+# =========================
+class TokenUsage(Base):
+    """
+    app/usage.py эс тутумда жыйнап, batch менен кошот (ON CONFLICT ... + EXCLUDED).
+    latency_ms — жалпы сумма (орточо = latency_ms / requests).
+    """
+
+    __tablename__ = "token_usage"
+
+    tg_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[str] = mapped_column(String(10), primary_key=True)  # day_key_utc()
+    model: Mapped[str] = mapped_column(String(64), primary_key=True)
+
+    requests: Mapped[int] = mapped_column(Integer, default=0)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    latency_ms: Mapped[int] = mapped_column(Integer, default=0)
+    # провайдер prompt cache'тен окулган prompt токендер (prompt_tokens'ке кирет)
+    cached_tokens: Mapped[int] = mapped_column(Integer, default=0)
+
+
+# =========================
+# Optional: stats rollup (STATS_ROLLUP=1)
+# =========================
+class StatsRollup(Base):
+    """
+    Admin stats үчүн алдын ала эсептелген сандар.
+    Postgres trigger'лери жаңылайт (app/stats.py): users insert/delete/plan,
+    invoices status -> paid.
+    keys: users_total, plan_FREE, plan_PLUS, plan_PRO, paid_invoices, revenue_usd
+    Ар бир key STATS_ROLLUP_STRIPES сапка бөлүнөт ("users_total#3"), окууда суммаланат.
+    """
+
+    __tablename__ = "stats_rollup"
+
+    key: Mapped[str] = mapped_column(String(32), primary_key=True)
+    value: Mapped[float] = mapped_column(Float, default=0.0)
+
+
 # =========================
 # Optional: Admin logs
 # =========================
@@ -1,76 +1,63 @@
 from __future__ import annotations
 
+import asyncio
 import datetime as dt
-from typing import Awaitable, Callable, Optional
+import heapq
+import logging
+from typing import Awaitable, Callable, Iterable, Optional
 
-from sqlalchemy import select
+from sqlalchemy import update, case, select, event, inspect, and_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
-from app.models import User
-from app.constants import PLANS
-from app.utils import utcnow, day_key_utc
+from app.config import DUE_TIMER_HORIZON_S
+from app.db import SessionLocal, LEADER
+from app.models import User, MONTHLY_PERIOD, next_due_at_sql
+from app.cache import invalidate_user
+from app.constants import PLANS, PAID_PLANS
+from app.utils import utcnow
 
 
+log = logging.getLogger("tilek_ai.scheduler")
+
 # Notifier: async function like:
 #   async def notify(tg_id: int, text: str) -> None: ...
 Notifier = Optional[Callable[[int, str], Awaitable[None]]]
 
 
-def _is_expired(plan_until: Optional[dt.datetime]) -> bool:
-    return bool(plan_until and utcnow() >= plan_until)
+# User.<field>_left  <-  Plan.monthly_<field>
+_LIMIT_FIELDS = ("chat", "video", "music", "image", "voice", "doc", "tokens")
 
 
-def _ensure_anchor(u: User, now: dt.datetime) -> None:
+# =========================================================
+# SQL building blocks
+# =========================================================
+def _plan_limit(field: str):
     """
-    Anchor date for monthly refill.
-    If user plan is PLUS/PRO and last_monthly_reset is missing -> set now.
+    CASE users.plan WHEN 'PLUS' THEN 600 WHEN 'PRO' THEN 1200 ... END
+    Сандар PLANS'тан алынат — constants.py өзгөрсө SQL да өзгөрөт.
     """
-    if u.plan in ("PLUS", "PRO") and not u.last_monthly_reset:
-        u.last_monthly_reset = now
-
-
-def _refill_monthly(u: User) -> None:
-    if u.plan not in ("PLUS", "PRO"):
-        return
-    p = PLANS[u.plan]
-    u.chat_left = p.monthly_chat
-    u.video_left = p.monthly_video
-    u.music_left = p.monthly_music
-    u.image_left = p.monthly_image
-    u.voice_left = p.monthly_voice
-    u.doc_left = p.monthly_doc
+    return case(
+        {code: getattr(PLANS[code], f"monthly_{field}") for code in PAID_PLANS},
+        value=User.plan,
+        else_=getattr(User, f"{field}_left"),
+    )
 
 
-def _drop_to_free(u: User) -> None:
-    u.plan = "FREE"
-    u.plan_until = None
+def _refill_values() -> dict:
+    return {f"{f}_left": _plan_limit(f) for f in _LIMIT_FIELDS}
 
-    # paid limits to 0
-    u.chat_left = 0
-    u.video_left = 0
-    u.music_left = 0
-    u.image_left = 0
-    u.voice_left = 0
-    u.doc_left = 0
-    # VIP credits stay untouched (vip_video_credits, vip_music_minutes)
 
+def _free_values() -> dict:
+    # paid limits to 0; VIP credits stay untouched (vip_video_credits, vip_music_minutes)
+    values = {f"{f}_left": 0 for f in _LIMIT_FIELDS}
+    values.update(plan="FREE", plan_until=None)
+    return values
 
-def _next_refill_at(u: User) -> Optional[dt.datetime]:
-    """
-    Next refill time anchored to last_monthly_reset.
-    If last_monthly_reset is set -> next = +30 days.
-    """
-    if u.plan not in ("PLUS", "PRO"):
-        return None
-    if not u.last_monthly_reset:
-        return None
-    return u.last_monthly_reset + dt.timedelta(days=30)
 
-
-def _should_refill(u: User, now: dt.datetime) -> bool:
-    nxt = _next_refill_at(u)
-    return bool(nxt and now >= nxt)
+def _bulk(stmt):
+    # ORM identity map'ти синхрондобойбуз: session'до User объект жок
+    return stmt.execution_options(synchronize_session=False)
 
 
 def _text_unblocked() -> str:
@@ -91,22 +78,24 @@ def _text_expired_upsell() -> str:
     )
 
 
-async def ensure_resets(notify: Notifier = None) -> dict:
+async def ensure_resets(notify: Notifier = None, tg_ids: Optional[Iterable[int]] = None) -> dict:
     """
     Run every ~60s.
 
-    Does:
-    - daily reset for FREE counter by UTC day_key
+    Ар бир эреже — бир set-based UPDATE (Postgres ичинде иштейт),
+    Python'го RETURNING аркылуу notify керек болгон tg_id'лер гана келет.
+    Убакытка байланыштуу эрежелер next_due_at <= now менен чектелет
+    (partial index) — баасы убагы келген user'лердин санына жараша:
     - unblock users when blocked_until passed (optional notify)
     - premium expiry -> drop to FREE (optional notify with upsell)
     - monthly refill anchored to last_monthly_reset for PLUS/PRO
+
+    FREE күндүк санагыч бул жерде эмес — chat.on_text'те lazy reset болот.
+    tg_ids берилсе — ошол user'лер гана (leader эмес replica'нын өз deadline'дары).
     """
     now = utcnow()
-    today_key = day_key_utc()
 
     stats = {
-        "users_scanned": 0,
-        "daily_reset": 0,
         "unblocked": 0,
         "expired_to_free": 0,
         "monthly_refilled": 0,
@@ -114,56 +103,69 @@ async def ensure_resets(notify: Notifier = None) -> dict:
         "touched": 0,
     }
 
-    # We collect notifications and send AFTER commit (safer)
-    notifications: list[tuple[int, str]] = []
+    due = User.next_due_at <= now
+    if tg_ids is not None:
+        due = and_(due, User.tg_id.in_(list(tg_ids)))
 
     async with SessionLocal() as s:  # type: AsyncSession
-        res = await s.execute(select(User))
-        users = res.scalars().all()
-        stats["users_scanned"] = len(users)
-
-        for u in users:
-            changed = False
-
-            # 0) anchor init
-            _ensure_anchor(u, now)
-
-            # 1) daily reset (FREE daily counter)
-            if u.free_day_key != today_key:
-                u.free_day_key = today_key
-                u.free_today_count = 0
-                changed = True
-                stats["daily_reset"] += 1
-
-            # 2) unblock
-            if u.blocked_until and now >= u.blocked_until:
-                u.blocked_until = None
-                changed = True
-                stats["unblocked"] += 1
-                notifications.append((u.tg_id, _text_unblocked()))
-
-            # 3) plan expiry
-            if u.plan in ("PLUS", "PRO") and _is_expired(u.plan_until):
-                _drop_to_free(u)
-                changed = True
-                stats["expired_to_free"] += 1
-                notifications.append((u.tg_id, _text_expired_upsell()))
-
-            # 4) monthly refill (only if still PLUS/PRO)
-            if u.plan in ("PLUS", "PRO") and _should_refill(u, now):
-                _refill_monthly(u)
-                u.last_monthly_reset = now
-                changed = True
-                stats["monthly_refilled"] += 1
-
-            if changed:
-                u.updated_at = now
-                stats["touched"] += 1
-
-        if stats["touched"] > 0:
-            await s.commit()
+        # 0) anchor init: PLUS/PRO'до last_monthly_reset жок болсо -> now
+        await s.execute(_bulk(
+            update(User)
+            .where(due, User.plan.in_(PAID_PLANS), User.last_monthly_reset.is_(None))
+            .values(last_monthly_reset=now, updated_at=now)
+        ))
+
+        # 1) unblock
+        unblocked = (await s.execute(_bulk(
+            update(User)
+            .where(due, User.blocked_until <= now)
+            .values(blocked_until=None, updated_at=now)
+            .returning(User.tg_id)
+        ))).scalars().all()
+        stats["unblocked"] = len(unblocked)
+
+        # 2) plan expiry
+        expired = (await s.execute(_bulk(
+            update(User)
+            .where(due, User.plan.in_(PAID_PLANS), User.plan_until <= now)
+            .values(updated_at=now, **_free_values())
+            .returning(User.tg_id)
+        ))).scalars().all()
+        stats["expired_to_free"] = len(expired)
+
+        # 3) monthly refill (only if still PLUS/PRO — expiry жогоруда өттү)
+        refilled = (await s.execute(_bulk(
+            update(User)
+            .where(due, User.plan.in_(PAID_PLANS), User.last_monthly_reset <= now - MONTHLY_PERIOD)
+            .values(last_monthly_reset=now, updated_at=now, **_refill_values())
+            .returning(User.tg_id)
+        ))).scalars().all()
+        stats["monthly_refilled"] = len(refilled)
+
+        # 4) убагы келген user'лердин кийинки due убактысын кайра эсептейбиз
+        rescheduled = (await s.execute(_bulk(
+            update(User)
+            .where(due)
+            .values(next_due_at=next_due_at_sql())
+            .returning(User.tg_id, User.next_due_at)
+        ))).all()
+
+        await s.commit()
+
+    for tg_id, due_at in rescheduled:
+        DUE_TIMERS.schedule(tg_id, due_at)
+
+    # middleware user кэшинен чыгарабыз (unblock/expiry/refill дароо көрүнсүн).
+    touched = set(unblocked) | set(expired) | set(refilled)
+    for tg_id in touched:
+        invalidate_user(tg_id)
+    stats["touched"] = len(touched)
 
     # Send notifications after DB commit
+    notifications: list[tuple[int, str]] = (
+        [(tg_id, _text_unblocked()) for tg_id in unblocked]
+        + [(tg_id, _text_expired_upsell()) for tg_id in expired]
+    )
     if notify:
         for tg_id, text in notifications:
             try:
@@ -173,6 +175,142 @@ async def ensure_resets(notify: Notifier = None) -> dict:
                 # ignore notify errors to prevent scheduler crash
                 pass
 
-    return stats 
+    return stats
+
+
+# =========================================================
+# Due timers (exact-time unblock / expiry / refill)
+# =========================================================
+class DueTimers:
+    """
+    users.next_due_at боюнча min-heap.
+
+    Runner эң жакын deadline'га чейин уктайт, анан ensure_resets() чакырат:
+    leader'де — set-based, ошол учурда убагы келгендердин баарын бир жолу иштетет;
+    башка replica'ларда — heap'тен чыккан tg_id'лер гана (калганы leader'дин иши).
+    Бош убакта DB'га эч кандай суроо барбайт.
+
+    - heap'те (due_at, tg_id); эскирген жазуулар lazy өчүрүлөт (_due менен салыштырып)
+    - horizon'дон алыскы deadline'дар heap'ке кирбейт — sweep'те load() алып келет
+    """
+
+    def __init__(self, horizon_s: float):
+        self.horizon = dt.timedelta(seconds=horizon_s)
+        self._heap: list[tuple[dt.datetime, int]] = []
+        self._due: dict[int, dt.datetime] = {}
+        self._wakeup = asyncio.Event()
+        self.fired = 0
+
+    def schedule(self, tg_id: int, due_at: Optional[dt.datetime]) -> None:
+        if due_at is None or due_at > utcnow() + self.horizon:
+            self._due.pop(tg_id, None)
+            return
+        if self._due.get(tg_id) == due_at:
+            return
+
+        self._due[tg_id] = due_at
+        heapq.heappush(self._heap, (due_at, tg_id))
+        if self._heap[0] == (due_at, tg_id):
+            self._wakeup.set()  # жаңы эң жакын deadline — runner'ди ойготобуз
+
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(d, t) for t, d in self._due.items()]
+            heapq.heapify(self._heap)
+
+    async def load(self) -> int:
+        """
+        Horizon ичиндеги deadline'дарды partial index (ix_users_next_due_at) аркылуу жүктөйт.
+        """
+        until = utcnow() + self.horizon
+        async with SessionLocal() as s:
+            rows = (await s.execute(
+                select(User.tg_id, User.next_due_at)
+                .where(User.next_due_at.is_not(None), User.next_due_at <= until)
+            )).all()
+
+        # query учурунда schedule() кошкондор жоголбосун
+        loaded = {tg_id: due_at for tg_id, due_at in rows}
+        loaded.update(self._due)
+        self._due = loaded
+        self._heap = [(d, t) for t, d in self._due.items()]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+        return len(self._due)
+
+    def _head(self) -> Optional[dt.datetime]:
+        while self._heap:
+            due_at, tg_id = self._heap[0]
+            if self._due.get(tg_id) == due_at:
+                return due_at
+            heapq.heappop(self._heap)
+        return None
+
+    def clear(self) -> None:
+        """Leadership жоголгондо: бүт DB'дагы deadline'дар эми жаңы leader'де."""
+        self._heap = []
+        self._due = {}
+        self._wakeup.set()
+
+    def _pop_due(self, now: dt.datetime) -> list[int]:
+        popped: list[int] = []
+        while (head := self._head()) is not None and head <= now:
+            _, tg_id = heapq.heappop(self._heap)
+            self._due.pop(tg_id, None)
+            popped.append(tg_id)
+        return popped
+
+    async def run(self, notify: Notifier = None) -> None:
+        while True:
+            head = self._head()
+            now = utcnow()
+
+            if head is not None and head <= now:
+                popped = self._pop_due(now)
+                self.fired += len(popped)
+                try:
+                    await ensure_resets(
+                        notify=notify,
+                        tg_ids=None if LEADER.is_leader else popped,
+                    )
+                except Exception as e:
+                    # DB'да next_due_at калат — кийинки sweep кайра алат
+                    log.warning("Due timer error: %s", e)
+                continue
+
+            timeout = (head - now).total_seconds() if head is not None else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        head = self._head()
+        return {
+            "pending": len(self._due),
+            "heap": len(self._heap),
+            "next_due_at": head.isoformat() if head else None,
+            "fired": self.fired,
+        }
+
+
+DUE_TIMERS = DueTimers(horizon_s=DUE_TIMER_HORIZON_S)
+
+
+# ORM аркылуу next_due_at өзгөрсө (handler, webhook, admin) — commit'тен кийин heap'ке
+@event.listens_for(Session, "after_flush")
+def _collect_due_changes(session: Session, flush_context) -> None:
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User) and inspect(obj).attrs.next_due_at.history.has_changes():
+            session.info.setdefault("due_changes", {})[obj.tg_id] = obj.next_due_at
+
+
+@event.listens_for(Session, "after_commit")
+def _schedule_due_changes(session: Session) -> None:
+    for tg_id, due_at in session.info.pop("due_changes", {}).items():
+        DUE_TIMERS.schedule(tg_id, due_at)
+
 
-    
+@event.listens_for(Session, "after_rollback")
+def _drop_due_changes(session: Session) -> None:
+    session.info.pop("due_changes", None)
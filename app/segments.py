@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import datetime as dt
+import json
+from dataclasses import dataclass, asdict, field
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import SEGMENT_PAGE_SIZE
+from app.db import SessionLocal
+from app.models import User
+from app.cache import invalidate_user
+from app.utils import utcnow
+
+
+# =========================================================
+# Segment definition
+# =========================================================
+@dataclass(frozen=True)
+class Segment:
+    """
+    Аудитория фильтри (broadcast / gift). Бош талаа = чектөө жок.
+    Banned user'лер ар дайым чыгарылат.
+
+    Текст синтаксиси (admin жазат):
+      plan=PLUS,PRO country=KG,KZ lang=ky active=7 inactive=30 vip
+      all  -> баары (banned'ден башка)
+    """
+
+    plans: tuple[str, ...] = field(default_factory=tuple)
+    countries: tuple[str, ...] = field(default_factory=tuple)
+    languages: tuple[str, ...] = field(default_factory=tuple)
+    active_days: Optional[int] = None     # last_action_at акыркы N күндө
+    inactive_days: Optional[int] = None   # last_action_at N күндөн эски (же эч качан)
+    has_vip: bool = False                 # VIP video/music кредити бар
+
+    # ---------- text <-> Segment ----------
+    @classmethod
+    def parse(cls, text: str) -> "Segment":
+        """
+        ValueError — түшүнүксүз токен болсо (admin'ге help көрсөтүлөт).
+        """
+        kw: dict = {}
+        for token in (text or "").replace("\n", " ").split():
+            key, _, raw = token.partition("=")
+            key = key.strip().lower()
+
+            if key in ("all", "баары") and not raw:
+                continue
+            if key == "vip" and not raw:
+                kw["has_vip"] = True
+                continue
+
+            values = tuple(v.strip() for v in raw.split(",") if v.strip())
+            if not values:
+                raise ValueError(token)
+
+            if key == "plan":
+                kw["plans"] = tuple(v.upper() for v in values)
+            elif key == "country":
+                kw["countries"] = tuple(v.upper() for v in values)
+            elif key == "lang":
+                kw["languages"] = tuple(v.lower() for v in values)
+            elif key in ("active", "inactive") and values[0].isdigit():
+                kw[f"{key}_days"] = int(values[0])
+            else:
+                raise ValueError(token)
+
+        return cls(**kw)
+
+    def describe(self) -> str:
+        parts: list[str] = []
+        if self.plans:
+            parts.append("plan=" + ",".join(self.plans))
+        if self.countries:
+            parts.append("country=" + ",".join(self.countries))
+        if self.languages:
+            parts.append("lang=" + ",".join(self.languages))
+        if self.active_days is not None:
+            parts.append(f"active≤{self.active_days}d")
+        if self.inactive_days is not None:
+            parts.append(f"inactive≥{self.inactive_days}d")
+        if self.has_vip:
+            parts.append("vip")
+        return " ".join(parts) or "баары"
+
+    # ---------- JSON (broadcast_jobs.segment) ----------
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: Optional[str]) -> "Segment":
+        if not raw:
+            return cls()
+        data = json.loads(raw)
+        for key in ("plans", "countries", "languages"):
+            data[key] = tuple(data.get(key) or ())
+        return cls(**data)
+
+    # ---------- SQL ----------
+    def where(self) -> list:
+        now = utcnow()
+        conds: list = [User.is_banned.is_not(True)]
+        if self.plans:
+            conds.append(User.plan.in_(self.plans))
+        if self.countries:
+            conds.append(User.country_code.in_(self.countries))
+        if self.languages:
+            conds.append(User.language.in_(self.languages))
+        if self.active_days is not None:
+            conds.append(User.last_action_at >= now - dt.timedelta(days=self.active_days))
+        if self.inactive_days is not None:
+            conds.append(or_(
+                User.last_action_at.is_(None),
+                User.last_action_at < now - dt.timedelta(days=self.inactive_days),
+            ))
+        if self.has_vip:
+            conds.append(or_(User.vip_video_credits > 0, User.vip_music_minutes > 0))
+        return conds
+
+
+# =========================================================
+# Streaming (keyset by users.tg_id — эс тутум туруктуу)
+# =========================================================
+async def count_segment(session: AsyncSession, seg: Segment, after_tg_id: int = 0) -> int:
+    return (await session.execute(
+        select(func.count()).select_from(User).where(User.tg_id > after_tg_id, *seg.where())
+    )).scalar_one()
+
+
+async def fetch_page(
+    session: AsyncSession,
+    seg: Segment,
+    after_tg_id: int = 0,
+    limit: int = SEGMENT_PAGE_SIZE,
+) -> list[int]:
+    """
+    tg_id > after_tg_id болгон кийинки бет (ORDER BY tg_id, unique index боюнча).
+    """
+    return list((await session.execute(
+        select(User.tg_id)
+        .where(User.tg_id > after_tg_id, *seg.where())
+        .order_by(User.tg_id)
+        .limit(limit)
+    )).scalars().all())
+
+
+async def iter_pages(
+    seg: Segment,
+    page_size: int = SEGMENT_PAGE_SIZE,
+    after_tg_id: int = 0,
+) -> AsyncIterator[list[int]]:
+    """
+    Ар бир бет өзүнчө кыска session'до окулат — узун transaction/cursor кармалбайт.
+    """
+    while True:
+        async with SessionLocal() as s:
+            page = await fetch_page(s, seg, after_tg_id, page_size)
+        if not page:
+            return
+        yield page
+        after_tg_id = page[-1]
+
+
+async def bulk_update(seg: Segment, values: dict, page_size: int = SEGMENT_PAGE_SIZE) -> int:
+    """
+    Сегменттеги user'лерге бет-бет UPDATE (ар бир бет — өз commit'и, кыска lock).
+    values: {"vip_video_credits": User.vip_video_credits + 3, ...}
+    Returns: чындап жаңыланган user саны. Бет окулгандан кийин сегменттен чыгып
+    калгандар (ban, план өзгөрдү) UPDATE'те кайра текшерилип, өткөрүлөт.
+    """
+    total = 0
+    async for page in iter_pages(seg, page_size):
+        async with SessionLocal() as s:
+            res = await s.execute(
+                update(User)
+                .where(User.tg_id.in_(page), *seg.where())
+                .values(updated_at=utcnow(), **values)
+                .execution_options(synchronize_session=False)
+            )
+            await s.commit()
+        for tg_id in page:
+            invalidate_user(tg_id)
+        total += res.rowcount or 0
+    return total
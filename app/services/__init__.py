@@ -0,0 +1,7 @@
+# app/services -> app/handlers/services
+# Модулдар `app.services.*` деп импорттолот, файлдар ошол папкада турат.
+import os
+
+__path__ = [
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "handlers", "services")
+]
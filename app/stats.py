@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import select, func, text, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.config import ADMIN_STATS_TTL_S, STATS_ROLLUP, STATS_ROLLUP_STRIPES
+from app.cache import TTLCache
+from app.models import User, Invoice, StatsRollup
+
+
+STATS_CACHE: TTLCache[str, dict] = TTLCache(maxsize=1, ttl_s=ADMIN_STATS_TTL_S)
+
+_STAT_KEYS = ("users_total", "plan_FREE", "plan_PLUS", "plan_PRO", "paid_invoices", "revenue_usd")
+
+
+# =========================================================
+# Live aggregate (1 query, COUNT(*) FILTER)
+# =========================================================
+def _aggregate_query():
+    paid = Invoice.status == "paid"
+    users = select(
+        func.count().label("users_total"),
+        func.count().filter(User.plan == "FREE").label("plan_FREE"),
+        func.count().filter(User.plan == "PLUS").label("plan_PLUS"),
+        func.count().filter(User.plan == "PRO").label("plan_PRO"),
+    ).subquery()
+    invoices = select(
+        func.count().filter(paid).label("paid_invoices"),
+        func.coalesce(func.sum(Invoice.amount_usd).filter(paid), 0.0).label("revenue_usd"),
+    ).subquery()
+    # эки агрегат бир round trip'те (1 саптан CROSS JOIN)
+    return select(users, invoices)
+
+
+def _stripe_key(key: str, stripe: int) -> str:
+    return f"{key}#{stripe}"
+
+
+async def _from_rollup(session: AsyncSession) -> Optional[dict]:
+    # inline literal: bind param болсо SELECT менен GROUP BY'дагы туюнтма дал келбей калат
+    base = func.split_part(StatsRollup.key, literal_column("'#'"), literal_column("1"))
+    rows = (await session.execute(
+        select(base, func.sum(StatsRollup.value)).group_by(base)
+    )).all()
+    if not rows:
+        return None
+    data = {k: 0.0 for k in _STAT_KEYS}
+    data.update({k: v for k, v in rows if k in data})
+    return data
+
+
+async def admin_stats_snapshot(session: AsyncSession) -> dict:
+    """
+    STATS_ROLLUP болсо — stats_rollup'тан (туруктуу убакыт),
+    болбосо — бир агрегат query. Экөө тең ADMIN_STATS_TTL_S кэштелет.
+    """
+    cached = STATS_CACHE.get("admin")
+    if cached is not None:
+        return cached
+
+    data = await _from_rollup(session) if STATS_ROLLUP else None
+    if data is None:
+        data = dict((await session.execute(_aggregate_query())).mappings().one())
+
+    data = {k: (float(v) if k == "revenue_usd" else int(v)) for k, v in data.items()}
+    STATS_CACHE.set("admin", data)
+    return data
+
+
+# =========================================================
+# Rollup trigger'лери (_db_init чакырат)
+# =========================================================
+_ROLLUP_DDL = (
+    """
+    CREATE OR REPLACE FUNCTION stats_rollup_bump(k text, d double precision) RETURNS void AS $$
+        -- backend боюнча stripe: параллель transaction'дор ар башка сапты кулпулайт
+        INSERT INTO stats_rollup (key, value) VALUES (k || '#' || (pg_backend_pid() % {stripes}), d)
+        ON CONFLICT (key) DO UPDATE SET value = stats_rollup.value + EXCLUDED.value;
+    $$ LANGUAGE sql
+    """.format(stripes=STATS_ROLLUP_STRIPES),
+    """
+    CREATE OR REPLACE FUNCTION stats_rollup_users() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM stats_rollup_bump('users_total', 1);
+            PERFORM stats_rollup_bump('plan_' || NEW.plan, 1);
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM stats_rollup_bump('users_total', -1);
+            PERFORM stats_rollup_bump('plan_' || OLD.plan, -1);
+        ELSIF NEW.plan IS DISTINCT FROM OLD.plan THEN
+            PERFORM stats_rollup_bump('plan_' || OLD.plan, -1);
+            PERFORM stats_rollup_bump('plan_' || NEW.plan, 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION stats_rollup_invoices() RETURNS trigger AS $$
+    DECLARE
+        was_paid boolean := TG_OP = 'UPDATE' AND OLD.status = 'paid';
+        is_paid boolean := NEW.status = 'paid';
+    BEGIN
+        IF is_paid AND NOT was_paid THEN
+            PERFORM stats_rollup_bump('paid_invoices', 1);
+            PERFORM stats_rollup_bump('revenue_usd', COALESCE(NEW.amount_usd, 0));
+        ELSIF was_paid AND NOT is_paid THEN
+            PERFORM stats_rollup_bump('paid_invoices', -1);
+            PERFORM stats_rollup_bump('revenue_usd', -COALESCE(OLD.amount_usd, 0));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_stats_rollup_users ON users",
+    """
+    CREATE TRIGGER trg_stats_rollup_users
+    AFTER INSERT OR DELETE OR UPDATE OF plan ON users
+    FOR EACH ROW EXECUTE FUNCTION stats_rollup_users()
+    """,
+    "DROP TRIGGER IF EXISTS trg_stats_rollup_invoices ON invoices",
+    """
+    CREATE TRIGGER trg_stats_rollup_invoices
+    AFTER INSERT OR UPDATE OF status ON invoices
+    FOR EACH ROW EXECUTE FUNCTION stats_rollup_invoices()
+    """,
+)
+
+_ROLLUP_DROP = (
+    "DROP TRIGGER IF EXISTS trg_stats_rollup_users ON users",
+    "DROP TRIGGER IF EXISTS trg_stats_rollup_invoices ON invoices",
+)
+
+
+async def sync_rollup(conn: AsyncConnection) -> None:
+    """
+    STATS_ROLLUP=1: trigger'лерди коёт жана stats_rollup'ту бир жолу так эсептеп толтурат
+    (ар бир startup'та — дрейф болсо өзү оңолот).
+    STATS_ROLLUP=0: trigger'лерди алып салат (жазууларга кошумча баа калбасын).
+
+    Бир нече replica бир убакта баштаса — transaction advisory lock менен кезек-кезеги менен.
+    """
+    if not STATS_ROLLUP:
+        for ddl in _ROLLUP_DROP:
+            await conn.execute(text(ddl))
+        return
+
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('stats_rollup'))"))
+
+    for ddl in _ROLLUP_DDL:
+        await conn.execute(text(ddl))
+
+    data = dict((await conn.execute(_aggregate_query())).mappings().one())
+    # так сан 0-stripe'ка, калган stripe'тар 0 — бир upsert, таблица бош калбайт
+    rows = [
+        {"key": _stripe_key(k, i), "value": float(v) if i == 0 else 0.0}
+        for k, v in data.items()
+        for i in range(STATS_ROLLUP_STRIPES)
+    ]
+    stmt = pg_insert(StatsRollup).values(rows)
+    await conn.execute(stmt.on_conflict_do_update(
+        index_elements=[StatsRollup.key],
+        set_={"value": stmt.excluded.value},
+    ))
+    # эски/ашыкча stripe'тар (STATS_ROLLUP_STRIPES азайса) суммага кошулбасын
+    await conn.execute(
+        StatsRollup.__table__.delete()
+        .where(StatsRollup.key.not_in([r["key"] for r in rows]))
+    )
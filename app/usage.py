@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import update, bindparam, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.db import SessionLocal
+from app.models import User, TokenUsage
+from app.cache import invalidate_user
+from app.constants import PAID_PLANS
+from app.utils import day_key_utc
+
+
+log = logging.getLogger("tilek_ai.usage")
+
+
+@dataclass
+class _Agg:
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: int = 0
+    cached_tokens: int = 0
+
+    def add(self, other: "_Agg") -> None:
+        self.requests += other.requests
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.latency_ms += other.latency_ms
+        self.cached_tokens += other.cached_tokens
+
+
+# =========================================================
+# In-memory meter -> batched flush
+# =========================================================
+class UsageMeter:
+    """
+    Ар бир LLM жооптун usage'и эс тутумда (tg_id, day, model) боюнча жыйналат.
+    flush() (cron loop, LAST_ACTION_FLUSH_S) аны бир INSERT ... ON CONFLICT менен
+    token_usage'ка кошот жана users.tokens_left'тен бир executemany UPDATE менен кемитет.
+
+    pending_tokens(): flush боло элек токендер — budget текшерүүдө DB'дагы
+    tokens_left'тен кемитилет (бул replica үчүн так).
+    """
+
+    def __init__(self):
+        self._agg: dict[tuple[int, str, str], _Agg] = {}
+        self._pending: dict[int, int] = {}
+
+        self.requests = 0
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def record(
+        self,
+        tg_id: Optional[int],
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency_s: float,
+        cached_tokens: int = 0,
+    ) -> None:
+        """
+        cached_tokens — prompt_tokens'тин провайдер cache'тен келген бөлүгү (метрика гана;
+        бюджеттен толук prompt_tokens кемийт).
+        """
+        if not tg_id:
+            return
+        key = (tg_id, day_key_utc(), model)
+        agg = self._agg.setdefault(key, _Agg())
+        agg.add(_Agg(1, int(prompt_tokens), int(completion_tokens), int(latency_s * 1000), int(cached_tokens)))
+
+        used = int(prompt_tokens) + int(completion_tokens)
+        self._pending[tg_id] = self._pending.get(tg_id, 0) + used
+        self.requests += 1
+        self.tokens += used
+        self.prompt_tokens += int(prompt_tokens)
+        self.cached_tokens += int(cached_tokens)
+
+    def pending_tokens(self, tg_id: int) -> int:
+        return self._pending.get(tg_id, 0)
+
+    async def flush(self) -> int:
+        """
+        Returns: канча (tg_id, day, model) сап жазылды.
+        Ката болсо — маалымат кайра эс тутумга кайтат (кийинки flush'та кетет).
+        """
+        if not self._agg:
+            return 0
+        agg, self._agg = self._agg, {}
+        pending, self._pending = self._pending, {}
+
+        rows = [
+            {
+                "tg_id": tg_id,
+                "day": day,
+                "model": model,
+                "requests": a.requests,
+                "prompt_tokens": a.prompt_tokens,
+                "completion_tokens": a.completion_tokens,
+                "latency_ms": a.latency_ms,
+                "cached_tokens": a.cached_tokens,
+            }
+            for (tg_id, day, model), a in agg.items()
+        ]
+        ins = pg_insert(TokenUsage)
+        upsert = ins.on_conflict_do_update(
+            index_elements=[TokenUsage.tg_id, TokenUsage.day, TokenUsage.model],
+            set_={
+                col: getattr(TokenUsage, col) + getattr(ins.excluded, col)
+                for col in ("requests", "prompt_tokens", "completion_tokens", "latency_ms", "cached_tokens")
+            },
+        )
+        charge = (
+            update(User)
+            .where(User.tg_id == bindparam("b_tg_id"), User.plan.in_(PAID_PLANS))
+            .values(tokens_left=func.greatest(func.coalesce(User.tokens_left, 0) - bindparam("b_used"), 0))
+            .execution_options(synchronize_session=False)
+        )
+
+        try:
+            async with SessionLocal() as s:
+                await s.execute(upsert, rows)
+                await s.execute(charge, [{"b_tg_id": t, "b_used": n} for t, n in pending.items()])
+                await s.commit()
+        except Exception:
+            self.flush_errors += 1
+            for key, a in agg.items():
+                self._agg.setdefault(key, _Agg()).add(a)
+            for tg_id, n in pending.items():
+                self._pending[tg_id] = self._pending.get(tg_id, 0) + n
+            raise
+
+        for tg_id in pending:
+            invalidate_user(tg_id)
+        self.flushes += 1
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "prompt_cache_hit_ratio": (
+                round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0
+            ),
+            "pending_rows": len(self._agg),
+            "pending_users": len(self._pending),
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+
+USAGE = UsageMeter()
+
+
+def tokens_left(u) -> Optional[int]:
+    """
+    PLUS/PRO: калган токен (flush боло электерди эсепке алып). FREE: None (чектелбейт —
+    FREE күндүк суроо саны менен чектелген).
+    """
+    if u.plan not in PAID_PLANS or u.tokens_left is None:
+        return None
+    return max(0, u.tokens_left - USAGE.pending_tokens(u.tg_id))
@@ -151,6 +151,13 @@ def clamp_text(text: str, limit: int = 3500) -> str:
     return t[: limit - 1].rstrip() + "…"
 
 
+def estimate_tokens(text: str) -> int:
+    """
+    Болжол: кириллица ~3 символ/токен (tokenizer'сиз, арзан).
+    """
+    return len(text or "") // 3 + 1
+
+
 def safe_username(username: Optional[str]) -> str:
     """
     Normalize username for logging/UI.
@@ -0,0 +1,90 @@
+import pytest
+
+from app.handlers.services import llm_gateway
+from app.handlers.services.llm_gateway import CircuitBreaker
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", c)
+    return c
+
+
+def _breaker() -> CircuitBreaker:
+    return CircuitBreaker(error_rate=0.5, slow_s=5.0, cooldown_s=30.0, alpha=0.5, min_calls=2)
+
+
+def _tripped(clock) -> CircuitBreaker:
+    b = _breaker()
+    b.record_failure(0.1)
+    b.record_failure(0.1)
+    assert b.state == "open"
+    return b
+
+
+def test_stays_closed_below_min_calls(clock):
+    b = _breaker()
+    b.record_failure(0.1)
+    assert b.state == "closed"
+    assert b.allow()
+
+
+def test_opens_on_error_rate(clock):
+    b = _tripped(clock)
+    assert b.trips == 1
+    assert not b.allow()
+
+
+def test_opens_on_latency(clock):
+    b = _breaker()
+    b.record_success(6.0)
+    b.record_success(6.0)
+    assert b.state == "open"
+
+
+def test_half_open_allows_single_probe(clock):
+    b = _tripped(clock)
+    clock.now += 30
+    assert b.allow()
+    assert b.state == "half_open"
+    assert not b.allow()
+
+
+def test_half_open_success_closes_and_resets(clock):
+    b = _tripped(clock)
+    clock.now += 30
+    assert b.allow()
+    b.record_success(0.2)
+    assert b.state == "closed"
+    # эски статистика ташталды: EWMA сыноо суроосунан башталат
+    assert b.calls == 1
+    assert b.error_ewma == 0.0
+    assert b.latency_ewma == 0.2
+    assert b.allow()
+
+
+@pytest.mark.parametrize("probe", ["failure", "slow", "abandoned"])
+def test_half_open_bad_probe_reopens(clock, probe):
+    b = _tripped(clock)
+    clock.now += 30
+    assert b.allow()
+    if probe == "failure":
+        b.record_failure(0.1)
+    elif probe == "slow":
+        b.record_success(6.0)
+    else:
+        b.record_abandoned(3.0)
+    assert b.state == "open"
+    assert b.trips == 2
+    assert not b.allow()
+    clock.now += 30
+    assert b.allow()
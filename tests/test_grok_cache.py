@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import grok
+
+
+HISTORY = [
+    {"role": "user", "content": "Менин атым Азамат"},
+    {"role": "assistant", "content": "Салам, Азамат!"},
+]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """GATEWAY'ди алмаштырат: канча жолу провайдерге барганын санайт."""
+    state = SimpleNamespace(calls=0, gate=None)
+    provider = SimpleNamespace(model="test-model")
+
+    async def run(op, discard=None):
+        state.calls += 1
+        if state.gate is not None:
+            await state.gate.wait()
+        return provider, (f"жооп {state.calls}", None)
+
+    monkeypatch.setattr(grok.GATEWAY, "configured", lambda: [provider])
+    monkeypatch.setattr(grok.GATEWAY, "run", run)
+    monkeypatch.setattr(grok, "RESPONSE_CACHE", grok.TTLCache(maxsize=100, ttl_s=60))
+    monkeypatch.setattr(grok, "INFLIGHT", grok.SingleFlight())
+    return state
+
+
+def test_user_with_history_hits_cache(upstream):
+    async def main():
+        first = await grok.grok_chat("Менин атым ким?", history=HISTORY)
+        again = await grok.grok_chat("менин атым ким", history=HISTORY)
+        return first, again
+
+    first, again = asyncio.run(main())
+    assert upstream.calls == 1
+    assert again.text == first.text
+
+
+def test_different_history_does_not_share_cache(upstream):
+    async def main():
+        await grok.grok_chat("Менин атым ким?", history=HISTORY)
+        await grok.grok_chat("Менин атым ким?", history=HISTORY[:1])
+        await grok.grok_chat("Менин атым ким?")
+
+    asyncio.run(main())
+    assert upstream.calls == 3
+
+
+def test_user_with_history_shares_inflight_request(upstream):
+    async def main():
+        upstream.gate = asyncio.Event()
+        tasks = [
+            asyncio.create_task(grok.grok_chat("Эмне кыла аласың?", history=HISTORY))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        upstream.gate.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(main())
+    assert upstream.calls == 1
+    assert results[0].text == results[1].text
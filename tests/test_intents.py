@@ -0,0 +1,73 @@
+import pytest
+
+from app.intents import INTENTS, IntentRouter
+
+
+@pytest.mark.parametrize(
+    "text, intent",
+    [
+        ("Канча суроо калды?", "limits"),
+        ("сколько вопросов осталось", "limits"),
+        ("кантип төлөйм", "how_to_pay"),
+        ("How do I pay?", "how_to_pay"),
+        ("что такое PRO", "pro"),
+        ("Plus деген эмне", "plus"),
+        ("VIP видео", "vip_video"),
+        ("Сен кимсиң?", "about"),
+        ("FAQ", "faq"),
+    ],
+)
+def test_catalog_matches_ky_ru_en(text, intent):
+    assert INTENTS.match(text) == intent
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "Python'до recursion лимит канча болот деп ойлойсуң",
+        "Как оплатить коммуналку через приложение банка быстро",
+        "what is programming",
+        "кто тырнак",
+    ],
+)
+def test_catalog_leaves_real_questions_to_llm(text):
+    assert INTENTS.match(text) is None
+
+
+def test_prefix_stem_matches_word_forms():
+    r = IntentRouter({"pay": ("төлө",)}, slack_words=0)
+    assert r.match("төлөйм") == "pay"
+    assert r.match("төлөм") == "pay"
+    assert r.match("төл") is None
+
+
+def test_exact_stem_requires_whole_word():
+    r = IntentRouter({"pro": ("pro= эмне",)}, slack_words=0)
+    assert r.match("pro эмне") == "pro"
+    assert r.match("programming эмне") is None
+    assert r.match("pr эмне") is None
+
+
+def test_slack_words_cut_off_long_messages():
+    catalog = {"limits": ("суроо калд",)}
+    assert IntentRouter(catalog, slack_words=0).match("суроо калды") == "limits"
+    assert IntentRouter(catalog, slack_words=0).match("канча суроо калды") is None
+    assert IntentRouter(catalog, slack_words=1).match("канча суроо калды") == "limits"
+    assert IntentRouter(catalog, slack_words=1).match("менин канча суроо калды") is None
+
+
+def test_all_stems_required_and_longest_phrase_wins():
+    r = IntentRouter({"plans": ("премиум",), "plans_price": ("премиум баа",)}, slack_words=2)
+    assert r.match("баа") is None
+    assert r.match("премиум") == "plans"
+    assert r.match("премиум баасы") == "plans_price"
+
+
+def test_stats_count_hits_and_misses():
+    r = IntentRouter({"faq": ("faq=",)}, slack_words=0)
+    r.match("faq")
+    r.match("faq")
+    r.match("салам")
+    assert r.stats()["hits"] == {"faq": 2}
+    assert r.stats()["misses"] == 1
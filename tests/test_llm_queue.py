@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.llm_queue import LLMQueue, LLMQueueTimeout
+
+
+async def _served_order(queue: LLMQueue, waiters: list[tuple[str, int, float]]) -> list[str]:
+    """
+    Слот бош эмес кезде waiters'ти (name, priority, delay_before_enqueue) кезекке коёт,
+    анан слотту бошотуп, кимдер кандай тартипте кызмат алганын кайтарат.
+    """
+    order: list[str] = []
+    await queue.acquire(0)
+
+    async def waiter(name: str, priority: int):
+        async with queue.slot(priority):
+            order.append(name)
+
+    tasks = []
+    for name, priority, delay in waiters:
+        if delay:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(waiter(name, priority)))
+        await asyncio.sleep(0)
+
+    queue.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_acquire_is_immediate_under_capacity():
+    async def main():
+        q = LLMQueue(concurrency=2, aging_s=10)
+        waited = [await q.acquire(0), await q.acquire(0)]
+        return waited, q.stats()
+
+    waited, stats = asyncio.run(main())
+    assert waited == [0.0, 0.0]
+    assert stats["active"] == 2
+    assert stats["depth"] == 0
+
+
+def test_higher_priority_is_served_first():
+    order = asyncio.run(_served_order(
+        LLMQueue(concurrency=1, aging_s=10),
+        [("free", 0, 0), ("plus", 1, 0), ("pro", 2, 0)],
+    ))
+    assert order == ["pro", "plus", "free"]
+
+
+def test_aging_lets_long_waiting_free_overtake_pro():
+    # FREE PRO'дон 2 * aging_s (= 0.02 сек) алдыда кезекке турса — биринчи кызмат алат
+    order = asyncio.run(_served_order(
+        LLMQueue(concurrency=1, aging_s=0.01),
+        [("free", 0, 0), ("pro", 2, 0.05)],
+    ))
+    assert order == ["free", "pro"]
+
+
+def test_release_hands_slot_to_waiter_without_freeing_it():
+    async def main():
+        q = LLMQueue(concurrency=1, aging_s=10)
+        await q.acquire(0)
+        waiter = asyncio.create_task(q.acquire(0))
+        await asyncio.sleep(0)
+        assert q.stats()["depth"] == 1
+
+        q.release()
+        await waiter
+        handed = q.stats()
+        q.release()
+        return handed, q.stats()
+
+    handed, after = asyncio.run(main())
+    # слот түз waiter'ге өттү: active ошол бойдон 1
+    assert handed["active"] == 1
+    assert handed["depth"] == 0
+    assert after["active"] == 0
+
+
+def test_queue_timeout_does_not_leak_slot():
+    async def main():
+        q = LLMQueue(concurrency=1, aging_s=10, max_wait_s=0.02)
+        await q.acquire(0)
+        with pytest.raises(LLMQueueTimeout):
+            await q.acquire(0)
+        q.release()
+        # timeout болгон waiter heap'те калса да слот жоголбойт
+        waited = await q.acquire(0)
+        return waited, q.stats()
+
+    waited, stats = asyncio.run(main())
+    assert waited == 0.0
+    assert stats["timeouts"] == 1
+    assert stats["active"] == 1
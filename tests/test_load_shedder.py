@@ -0,0 +1,82 @@
+import pytest
+
+from app import llm_queue
+from app.llm_queue import (
+    LLMQueue,
+    LoadShedder,
+    SHED_NORMAL,
+    SHED_FREE_SHORT,
+    SHED_FREE_CACHE_ONLY,
+    SHED_FREE_REJECT,
+)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(llm_queue.time, "monotonic", c)
+    return c
+
+
+def _shedder(enabled: bool = True) -> LoadShedder:
+    return LoadShedder(
+        queue=LLMQueue(concurrency=4, aging_s=10),
+        enabled=enabled,
+        p95_target_s=1.0,
+        window_s=60,
+        steps=(1.0, 1.5, 2.0),
+        hold_s=10,
+    )
+
+
+def test_shedder_disabled_is_always_normal(clock):
+    s = _shedder(enabled=False)
+    s.observe(100.0)
+    assert s.level() == SHED_NORMAL
+
+
+def test_shedder_rises_immediately(clock):
+    s = _shedder()
+    assert s.level() == SHED_NORMAL
+    s.observe(1.6)
+    assert s.level() == SHED_FREE_CACHE_ONLY
+    s.observe(2.5)
+    s.observe(2.5)
+    assert s.level() == SHED_FREE_REJECT
+
+
+def test_shedder_steps_down_one_level_per_hold(clock):
+    s = _shedder()
+    s.observe(3.0)
+    assert s.level() == SHED_FREE_REJECT
+
+    clock.now += 61  # sample'дар терезеден чыкты — басым 0
+    assert s.level() == SHED_FREE_CACHE_ONLY
+    assert s.level() == SHED_FREE_CACHE_ONLY  # hold_s өтө элек
+    clock.now += 10
+    assert s.level() == SHED_FREE_SHORT
+    clock.now += 10
+    assert s.level() == SHED_NORMAL
+
+
+def test_shedder_hysteresis_band_holds_level(clock):
+    s = _shedder()
+    s.observe(1.2)
+    assert s.level() == SHED_FREE_SHORT
+
+    clock.now += 61
+    s.observe(0.9)  # чектен (1.0) төмөн, бирок 80%'тен (0.8) жогору
+    clock.now += 30
+    assert s.level() == SHED_FREE_SHORT
+
+    clock.now += 31
+    s.observe(0.5)
+    assert s.level() == SHED_NORMAL
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from app.cache import SingleFlight
+
+
+def test_concurrent_calls_share_one_leader():
+    async def main():
+        sf = SingleFlight()
+        calls = 0
+        gate = asyncio.Event()
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await gate.wait()
+            return "answer"
+
+        tasks = [asyncio.create_task(sf.do("k", fn)) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        return calls, await asyncio.gather(*tasks), sf.stats()
+
+    calls, results, stats = asyncio.run(main())
+    assert calls == 1
+    assert results == ["answer"] * 3
+    assert stats == {"inflight": 0, "leaders": 1, "shared": 2}
+
+
+def test_leader_error_reaches_waiters():
+    async def main():
+        sf = SingleFlight()
+        gate = asyncio.Event()
+
+        async def fn():
+            await gate.wait()
+            raise ValueError("boom")
+
+        tasks = [asyncio.create_task(sf.do("k", fn)) for _ in range(2)]
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_leader_cancel_lets_waiter_retry():
+    async def main():
+        sf = SingleFlight()
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                await asyncio.sleep(10)  # leader cancel болгонго чейин илинип турат
+            return "fresh"
+
+        leader = asyncio.create_task(sf.do("k", fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(sf.do("k", fn))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        result = await waiter
+        return calls, result, sf.inflight("k")
+
+    calls, result, inflight = asyncio.run(main())
+    # waiter cancel болбойт — өзү жаңы leader болуп кайра сурайт
+    assert result == "fresh"
+    assert calls == 2
+    assert inflight is None